@@ -1,6 +1,6 @@
-from . import autograd, nn
+from . import autograd, nn, serve
 from .nn import Checkpoint
-from .autograd import tensor, new_graph, no_track
+from .autograd import tensor, new_graph, no_track, autocast
 from .autograd import add, sub, mul, div, pow, exp, log, dot, sum, transpose, flatten, reshape
 from .nn.utils import load_model as load, save_model as save
 from .autograd.graph import Graph
@@ -12,7 +12,8 @@ class Node:
     parent_broadcast_shape (tuple or None): If the parent needs to be broadcasted from one shape to
       another, then the final broadcasted shape of the parent is stored here.
       If they cannot be broadcasted, then it is None
-    backward_fn (Operation.backward): Sets the grad_fn of Tensor(operand) involved in the Operation
+    backward_fn (functools.partial): Operation.backward bound to all the operands of the Operation,
+      sets the grad_fn of Tensor(operand) involved in the Operation
     visited (bool) - If Node is visited or not
   '''
 
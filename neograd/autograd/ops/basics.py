@@ -1,5 +1,5 @@
 import numpy as np
-from .operation import Operation
+from .operation import Operation, Context
 
 
 # <------------ADD------------>
@@ -17,7 +17,7 @@ class Add(Operation):
       Tensor of the result
     '''
     tens1, tens2 = self.get_tensors(tens1, tens2)
-    return self.get_result_tensor(tens1.data+tens2.data, tens1, tens2)
+    return self.get_result_tensor(self.get_data(tens1)+self.get_data(tens2), tens1, tens2)
 
   def backward(self, tens1, tens2):
     '''Sets grad_fn of operands
@@ -26,11 +26,13 @@ class Add(Operation):
     which results in upper gradient
 
     Args:
-      tens1 (Tensor): First operand
-      tens2 (Tensor): Second operand
+      tens1 (Tensor or float or np.ndarray): First operand
+      tens2 (Tensor or float or np.ndarray): Second operand
     '''
-    tens1.set_grad_fn(lambda ug:ug)
-    tens2.set_grad_fn(lambda ug:ug)
+    if self.operand_requires_grad(tens1):
+      tens1.set_grad_fn(lambda ug:ug)
+    if self.operand_requires_grad(tens2):
+      tens2.set_grad_fn(lambda ug:ug)
 
 def add(tens1, tens2):
   '''Abstraction for Add.forward
@@ -60,7 +62,7 @@ class Sub(Operation):
       Tensor of the result
     '''
     tens1, tens2 = self.get_tensors(tens1, tens2)
-    return self.get_result_tensor(tens1.data-tens2.data, tens1, tens2)
+    return self.get_result_tensor(self.get_data(tens1)-self.get_data(tens2), tens1, tens2)
   
   def backward(self, tens1, tens2):
     '''Sets grad_fn of operands
@@ -70,11 +72,13 @@ class Sub(Operation):
     matrix which results in negative upper gradient
 
     Args:
-      tens1 (Tensor): First operand
-      tens2 (Tensor): Second operand
+      tens1 (Tensor or float or np.ndarray): First operand
+      tens2 (Tensor or float or np.ndarray): Second operand
     '''
-    tens1.set_grad_fn(lambda ug:ug)
-    tens2.set_grad_fn(lambda ug:-ug)
+    if self.operand_requires_grad(tens1):
+      tens1.set_grad_fn(lambda ug:ug)
+    if self.operand_requires_grad(tens2):
+      tens2.set_grad_fn(lambda ug:-ug)
 
 def sub(tens1, tens2):
   '''Abstraction for Sub.forward
@@ -104,7 +108,7 @@ class Mul(Operation):
       Tensor of the result
     '''
     tens1, tens2 = self.get_tensors(tens1, tens2)
-    return self.get_result_tensor(tens1.data*tens2.data, tens1, tens2)
+    return self.get_result_tensor(self.get_data(tens1)*self.get_data(tens2), tens1, tens2)
   
   def backward(self, tens1, tens2):
     '''Sets grad_fn of operands
@@ -113,11 +117,14 @@ class Mul(Operation):
     multiplied with upper gradient
 
     Args:
-      tens1 (Tensor): First operand
-      tens2 (Tensor): Second operand
+      tens1 (Tensor or float or np.ndarray): First operand
+      tens2 (Tensor or float or np.ndarray): Second operand
     '''
-    tens1.set_grad_fn(lambda ug:tens2.data*ug)
-    tens2.set_grad_fn(lambda ug:tens1.data*ug)
+    data1, data2 = self.get_data(tens1), self.get_data(tens2)
+    if self.operand_requires_grad(tens1):
+      tens1.set_grad_fn(lambda ug:data2*ug)
+    if self.operand_requires_grad(tens2):
+      tens2.set_grad_fn(lambda ug:data1*ug)
 
 def mul(tens1, tens2):
   '''Abstraction for Mul.forward
@@ -147,7 +154,7 @@ class Div(Operation):
       Tensor of the result
     '''
     tens1, tens2 = self.get_tensors(tens1, tens2)
-    return self.get_result_tensor(tens1.data/tens2.data, tens1, tens2)
+    return self.get_result_tensor(self.get_data(tens1)/self.get_data(tens2), tens1, tens2)
   
   def backward(self, tens1, tens2):
     '''Sets grad_fn of operands
@@ -157,11 +164,14 @@ class Div(Operation):
     gradient
 
     Args:
-      tens1 (Tensor): First operand
-      tens2 (Tensor): Second operand
+      tens1 (Tensor or float or np.ndarray): First operand
+      tens2 (Tensor or float or np.ndarray): Second operand
     '''
-    tens1.set_grad_fn(lambda ug:(1/tens2.data)*ug)
-    tens2.set_grad_fn(lambda ug:((-1*tens1.data)/np.power(tens2.data, 2))*ug)
+    data1, data2 = self.get_data(tens1), self.get_data(tens2)
+    if self.operand_requires_grad(tens1):
+      tens1.set_grad_fn(lambda ug:(1/data2)*ug)
+    if self.operand_requires_grad(tens2):
+      tens2.set_grad_fn(lambda ug:((-1*data1)/np.power(data2, 2))*ug)
 
 def div(tens1, tens2):
   '''Abstraction for Div.forward
@@ -191,7 +201,7 @@ class Dot(Operation):
       Tensor of the result
     '''
     tens1, tens2 = self.get_tensors(tens1, tens2)
-    return self.get_result_tensor(np.dot(tens1.data, tens2.data), tens1, tens2)
+    return self.get_result_tensor(np.dot(self.get_data(tens1), self.get_data(tens2)), tens1, tens2)
   
   def backward(self, tens1, tens2):
     '''Sets grad_fn of operands
@@ -200,11 +210,14 @@ class Dot(Operation):
     transpose of tens1.data, which is dotted with upper gradient
 
     Args:
-      tens1 (Tensor): First operand
-      tens2 (Tensor): Second operand
+      tens1 (Tensor or float or np.ndarray): First operand
+      tens2 (Tensor or float or np.ndarray): Second operand
     '''
-    tens1.set_grad_fn(lambda ug:np.dot(ug, tens2.data.T))
-    tens2.set_grad_fn(lambda ug:np.dot(tens1.data.T, ug))
+    data1, data2 = np.asarray(self.get_data(tens1)), np.asarray(self.get_data(tens2))
+    if self.operand_requires_grad(tens1):
+      tens1.set_grad_fn(lambda ug:np.dot(ug, data2.T))
+    if self.operand_requires_grad(tens2):
+      tens2.set_grad_fn(lambda ug:np.dot(data1.T, ug))
 
 def dot(tens1, tens2):
   '''Abstraction for Dot.forward
@@ -233,17 +246,20 @@ class Exp(Operation):
       Tensor of the result
     '''
     tens = self.get_tensors(tens)
-    return self.get_result_tensor(np.exp(tens.data), tens)
+    return self.get_result_tensor(np.exp(self.get_data(tens)), tens, ctx=Context())
   
-  def backward(self, tens):
+  def backward(self, tens, ctx):
     '''Sets grad_fn of operand
 
-    Local gradient is exponentiation of tens.data itself
+    Local gradient is exponentiation of tens.data itself, which is the result
+    of forward
 
     Args:
       tens (Tensor or int or float or list or np.ndarray): Operand
+      ctx (Context): Context with the result of forward
     '''
-    tens.set_grad_fn(lambda ug:np.exp(tens.data)*ug)
+    result = ctx.result
+    tens.set_grad_fn(lambda ug:result*ug)
 
 def exp(tens):
   '''Abstraction for Exp.forward
@@ -271,7 +287,7 @@ class Log(Operation):
       Tensor of the result
     '''
     tens = self.get_tensors(tens)
-    return self.get_result_tensor(np.log(tens.data), tens)
+    return self.get_result_tensor(np.log(self.get_data(tens)), tens)
   
   def backward(self, tens):
     '''Sets grad_fn of operand
@@ -310,21 +326,25 @@ class Pow(Operation):
       Tensor of the result
     '''
     tens1, tens2 = self.get_tensors(tens1, tens2)
-    return self.get_result_tensor(np.power(tens1.data, tens2.data), tens1, tens2)
+    return self.get_result_tensor(np.power(self.get_data(tens1), self.get_data(tens2)), tens1, tens2, ctx=Context())
   
-  def backward(self, tens1, tens2):
+  def backward(self, tens1, tens2, ctx):
     '''Sets grad_fn of operands
 
     Local gradient of tens1 is tens1.data^(tens2.data-1), local gradient of tens2 is
     log(tens1.data), which is element wise multiplied with upper gradient
 
     Args:
-      tens1 (Tensor): First operand
-      tens2 (Tensor): Second operand
+      tens1 (Tensor or float or np.ndarray): First operand
+      tens2 (Tensor or float or np.ndarray): Second operand
+      ctx (Context): Context with the result of forward
     '''
-    result = np.power(tens1.data, tens2.data)
-    tens1.set_grad_fn(lambda ug:(np.power(tens1.data, tens2.data-1) * tens2.data)*ug)
-    tens2.set_grad_fn(lambda ug:(result*np.log(tens1.data))*ug)
+    data1, data2 = self.get_data(tens1), self.get_data(tens2)
+    if self.operand_requires_grad(tens1):
+      tens1.set_grad_fn(lambda ug:(np.power(data1, data2-1) * data2)*ug)
+    if self.operand_requires_grad(tens2):
+      result = ctx.result
+      tens2.set_grad_fn(lambda ug:(result*np.log(data1))*ug)
 
 def pow(tens1, tens2):
   '''Abstraction for Pow.forward
@@ -366,7 +386,7 @@ class Sum(Operation):
       Tensor of the result
     '''
     tens = self.get_tensors(tens)
-    return self.get_result_tensor(np.sum(tens.data, axis=self.axis), tens)
+    return self.get_result_tensor(np.sum(self.get_data(tens), axis=self.axis), tens)
   
   def backward(self, tens):
     '''Sets grad_fn of operand
@@ -413,7 +433,7 @@ class Transpose(Operation):
       Tensor of the result
     '''
     tens = self.get_tensors(tens)
-    return self.get_result_tensor(tens.data.T, tens)
+    return self.get_result_tensor(np.transpose(self.get_data(tens)), tens)
 
   def backward(self, tens):
     '''Sets grad_fn of operand
@@ -451,7 +471,7 @@ class Flatten(Operation):
       Tensor of the result
     '''
     tens = self.get_tensors(tens)
-    flattened = tens.data.flatten()
+    flattened = np.ravel(self.get_data(tens))
     return self.get_result_tensor(flattened.reshape(flattened.shape[0],1), tens)
   
   def backward(self, tens):
@@ -491,7 +511,7 @@ class Reshape(Operation):
       Tensor of the result
     '''
     tens = self.get_tensors(tens)
-    return self.get_result_tensor(tens.data.reshape(new_shape), tens)
+    return self.get_result_tensor(np.reshape(self.get_data(tens), new_shape), tens)
   
   def backward(self, tens):
     '''Sets grad_fn of operand
@@ -1,6 +1,6 @@
 import math
 import numpy as np
-from .operation import Operation
+from .operation import Operation, Context
 
 
 class Conv:
@@ -115,6 +115,21 @@ class Conv:
       zip of fragments and ony other objects in args
     '''
     return zip(self.generate_fragments(padded_inputs, kernel_shape), *args)
+  
+  def get_indices_dtype(self, kernel_shape):
+    '''Returns the smallest int dtype that can hold the index of an element in a fragment
+
+    Used to save the argmax indices of pooling windows compactly, int8 is used for all
+    kernels with upto 128 elements
+
+    Args:
+      kernel_shape (tuple): Shape of the kernel
+    
+    Returns:
+      np.int8 if the index fits in it else np.int32
+    '''
+    kernel_x_dim, kernel_y_dim = kernel_shape[-2:]
+    return np.int8 if kernel_x_dim*kernel_y_dim<=np.iinfo(np.int8).max+1 else np.int32
 
 
 # <------------CONV2D------------>
@@ -144,10 +159,11 @@ class Conv2D(Operation, Conv):
     '''
     inputs, kernel, bias = self.get_tensors(inputs, kernel, bias)
     self.validate_inputs(inputs)
-    outputs = np.empty((inputs.shape[0], *self.get_result_shape(inputs.shape, kernel.shape)))
-    padded_inputs = self.pad(inputs.data)
+    kernel_data, bias_data = self.get_data(kernel), self.get_data(bias)
+    padded_inputs = self.pad(self.get_data(inputs))
+    outputs = np.empty((inputs.shape[0], *self.get_result_shape(inputs.shape, kernel.shape)), dtype=np.result_type(padded_inputs, kernel_data))
     for (fragment, _, _), idx in self.fragment_iterator(padded_inputs, kernel.shape, np.ndindex(outputs.shape[-2:])):
-      output = np.sum((fragment*kernel.data), axis=(1,2)) + bias.data
+      output = np.sum((fragment*kernel_data), axis=(1,2)) + bias_data
       outputs[:,idx[0],idx[1]] = output
     return self.get_result_tensor(outputs, inputs, kernel, bias)
   
@@ -174,20 +190,21 @@ class Conv2D(Operation, Conv):
       bias (Tensor): bias value
     '''
     from ..utils import unbroadcast_data
-    padded_inputs = self.pad(inputs.data)
+    kernel_data = self.get_data(kernel)
+    padded_inputs = self.pad(self.get_data(inputs))
 
     def inputs_backward(ug):
-      inputs_grads = np.zeros(padded_inputs.shape)
+      inputs_grads = np.zeros(padded_inputs.shape, dtype=np.result_type(ug, kernel_data))
       for (fragment, row_slice, col_slice), idx in self.fragment_iterator(padded_inputs, kernel.shape, np.ndindex(ug.shape[-2:])):
         sliced_ug = ug[:,idx[0],idx[1]]
         sum_grad = np.ones(fragment.shape)*sliced_ug.reshape(sliced_ug.size,1,1)
-        fragment_grad = kernel.data*sum_grad
+        fragment_grad = kernel_data*sum_grad
         inputs_grads[:, row_slice, col_slice]+=fragment_grad
       unpadded_inputs_grads = self.unpad(inputs_grads)
       return unpadded_inputs_grads
 
     def kernel_backward(ug):
-      kernel_grads = np.zeros(kernel.shape)
+      kernel_grads = np.zeros(kernel.shape, dtype=np.result_type(ug, padded_inputs))
       for (fragment, _, _), idx in self.fragment_iterator(padded_inputs, kernel.shape, np.ndindex(ug.shape[-2:])):
         sliced_ug = ug[:,idx[0],idx[1]]
         sum_grad = np.ones(fragment.shape)*sliced_ug.reshape(sliced_ug.size,1,1)
@@ -198,9 +215,12 @@ class Conv2D(Operation, Conv):
     def bias_backward(ug):
       return np.sum(ug)
       
-    inputs.set_grad_fn(inputs_backward)
-    kernel.set_grad_fn(kernel_backward)
-    bias.set_grad_fn(bias_backward)
+    if self.operand_requires_grad(inputs):
+      inputs.set_grad_fn(inputs_backward)
+    if self.operand_requires_grad(kernel):
+      kernel.set_grad_fn(kernel_backward)
+    if self.operand_requires_grad(bias):
+      bias.set_grad_fn(bias_backward)
   
   def validate_inputs(self, inputs):
     '''Validates the inputs
@@ -259,12 +279,13 @@ class Conv3D(Operation, Conv):
     '''
     inputs, kernel, bias = self.get_tensors(inputs, kernel, bias)
     self.validate_inputs(inputs)
-    outputs = np.empty((inputs.shape[0], kernel.shape[0], *self.get_result_shape(inputs.shape, kernel.shape)))
-    padded_inputs = self.pad(inputs.data)
+    kernel_data, bias_data = self.get_data(kernel), self.get_data(bias)
+    padded_inputs = self.pad(self.get_data(inputs))
+    outputs = np.empty((inputs.shape[0], kernel.shape[0], *self.get_result_shape(inputs.shape, kernel.shape)), dtype=np.result_type(padded_inputs, kernel_data))
     for (fragment,_,_), idx in self.fragment_iterator(padded_inputs, kernel.shape, np.ndindex(outputs.shape[-2:])):
       expanded_fragment = np.expand_dims(fragment, axis=1)
-      output = expanded_fragment*kernel.data
-      output = np.sum(output, axis=(2,3,4)) + bias.data
+      output = expanded_fragment*kernel_data
+      output = np.sum(output, axis=(2,3,4)) + bias_data
       outputs[:,:,idx[0],idx[1]] = output
     return self.get_result_tensor(outputs, inputs, kernel, bias)
   
@@ -294,22 +315,23 @@ class Conv3D(Operation, Conv):
       bias (Tensor): bias value
     '''
     from ..utils import unbroadcast_data
-    padded_inputs = self.pad(inputs.data)
+    kernel_data = self.get_data(kernel)
+    padded_inputs = self.pad(self.get_data(inputs))
 
     def inputs_backward(ug):
-      inputs_grads = np.zeros(padded_inputs.shape)
+      inputs_grads = np.zeros(padded_inputs.shape, dtype=np.result_type(ug, kernel_data))
       for (fragment, row_slice, col_slice), idx in self.fragment_iterator(padded_inputs, kernel.shape, np.ndindex(ug.shape[-2:])):
         expanded_fragment = np.expand_dims(fragment, axis=1)
         sliced_ug = ug[:,:,idx[0],idx[1]]
         sliced_ug = sliced_ug.reshape(*sliced_ug.shape,1,1,1)
         sum_grad = np.ones(expanded_fragment.shape)*sliced_ug
-        fragment_grad = np.sum(sum_grad*kernel.data, axis=1)
+        fragment_grad = np.sum(sum_grad*kernel_data, axis=1)
         inputs_grads[:,:,row_slice,col_slice]+=fragment_grad
       unpadded_inputs_grads = self.unpad(inputs_grads)
       return unpadded_inputs_grads
     
     def kernel_backward(ug):
-      kernel_grads = np.zeros(kernel.shape)
+      kernel_grads = np.zeros(kernel.shape, dtype=np.result_type(ug, padded_inputs))
       for (fragment,_,_), idx in self.fragment_iterator(padded_inputs, kernel.shape, np.ndindex(ug.shape[-2:])):
         expanded_fragment = np.expand_dims(fragment,1)
         sliced_ug = ug[:,:,idx[0],idx[1]]
@@ -326,9 +348,12 @@ class Conv3D(Operation, Conv):
       grad = np.sum(grad, axis=1, keepdims=True)
       return grad
     
-    inputs.set_grad_fn(inputs_backward)
-    kernel.set_grad_fn(kernel_backward)
-    bias.set_grad_fn(bias_backward)
+    if self.operand_requires_grad(inputs):
+      inputs.set_grad_fn(inputs_backward)
+    if self.operand_requires_grad(kernel):
+      kernel.set_grad_fn(kernel_backward)
+    if self.operand_requires_grad(bias):
+      bias.set_grad_fn(bias_backward)
   
   def validate_inputs(self, inputs):
     '''Validates the inputs
@@ -387,6 +412,10 @@ class MaxPool2D(Operation, Conv):
     The fragments are generated, for each of it, the maximum value in the x and y dims
     is returned for all examples
 
+    Since argmax operates only on one axis, the fragment is first flattened across x and
+    y dims (last two dims). The argmax indices are saved in the smallest int dtype for
+    backward
+
     Args:
       inputs (Tensor or int or float or list or np.ndarray): Data to be maxpooled
     
@@ -395,41 +424,64 @@ class MaxPool2D(Operation, Conv):
     '''
     inputs = self.get_tensors(inputs)
     self.validate_inputs(inputs)
-    outputs = np.empty((inputs.shape[0], *self.get_result_shape(inputs.shape, self.kernel_shape)))
-    padded_inputs = self.pad(inputs.data)
+    outputs, indices = self.pool(self.get_data(inputs))
+    return self.get_result_tensor(outputs, inputs, ctx=Context(indices=indices))
+  
+  def pool(self, inputs_data):
+    '''Max pools the data and returns the argmax indices alongside
+
+    Args:
+      inputs_data (np.ndarray): Data to be maxpooled
+    
+    Returns:
+      outputs and the argmax indices of each fragment
+    '''
+    outputs = np.empty((inputs_data.shape[0], *self.get_result_shape(inputs_data.shape, self.kernel_shape)), dtype=inputs_data.dtype)
+    indices = np.empty(outputs.shape, dtype=self.get_indices_dtype(self.kernel_shape))
+    padded_inputs = self.pad(inputs_data)
     for (fragment,_,_), idx in self.fragment_iterator(padded_inputs, self.kernel_shape, np.ndindex(outputs.shape[-2:])):
-      outputs[:,idx[0],idx[1]] = np.max(fragment, axis=(1,2))
-    return self.get_result_tensor(outputs, inputs)
+      flattened_fragment = fragment.reshape(fragment.shape[0], -1)
+      args = np.argmax(flattened_fragment, axis=-1)
+      outputs[:,idx[0],idx[1]] = np.take_along_axis(flattened_fragment, args[:,None], axis=-1)[:,0]
+      indices[:,idx[0],idx[1]] = args
+    return outputs, indices
   
-  def backward(self, inputs):
+  def backward(self, inputs, ctx):
     '''Sets the grad_fn of inputs
 
-    Since argmax operates only on one axis, the fragment is first flattened across x and
-    y dims (last two dims)
-    Then the one hot encoding of the max indices are taken that are the multiplied
-    with the corresponding upper grad slice
+    The one hot encoding of the argmax indices saved during forward are taken that are
+    then multiplied with the corresponding upper grad slice
     fragment_grad is reshaped to original fragment shape
 
     Args:
       inputs (Tensor): Tensor that is maxpooled
+      ctx (Context): Context with the argmax indices saved during forward
     '''
-    padded_inputs = self.pad(inputs.data)
-
     def inputs_backward(ug):
-      inputs_grad = np.empty(padded_inputs.shape)
-      for (fragment,row_slice,col_slice),idx in self.fragment_iterator(padded_inputs, self.kernel_shape, np.ndindex(ug.shape[-2:])):
-        sliced_ug = ug[:,idx[0],idx[1]]
-        fragment_shape = fragment.shape
-        flattened_fragment = fragment.reshape(fragment_shape[0], fragment_shape[1]*fragment_shape[2])
-        args = np.argmax(flattened_fragment, axis=-1)
-        fragment_grad = np.eye(flattened_fragment.shape[-1])[args] # one hot encoding of args
-        fragment_grad = fragment_grad.reshape(fragment_shape)
-        inputs_grad[:,row_slice,col_slice] = fragment_grad*np.expand_dims(sliced_ug,axis=(1,2))
-      unpadded_inputs_grads = self.unpad(inputs_grad)
-      return unpadded_inputs_grads
+      return self.unpool(ug, ctx.indices, inputs.shape)
 
     inputs.set_grad_fn(inputs_backward)
   
+  def unpool(self, ug, indices, inputs_shape):
+    '''Routes the upper gradient of each fragment to its argmax
+
+    Args:
+      ug (np.ndarray): Upper gradient
+      indices (np.ndarray): Argmax indices returned by pool
+      inputs_shape (tuple): Shape of the inputs that were maxpooled
+    
+    Returns:
+      gradient of the inputs
+    '''
+    inputs_grad = np.empty(inputs_shape[:-2] + tuple(dim+(2*self.padding) for dim in inputs_shape[-2:]), dtype=ug.dtype)
+    one_hot = np.eye(self.kernel_shape[0]*self.kernel_shape[1])
+    for (fragment,row_slice,col_slice),idx in self.fragment_iterator(inputs_grad, self.kernel_shape, np.ndindex(ug.shape[-2:])):
+      sliced_ug = ug[:,idx[0],idx[1]]
+      fragment_grad = one_hot[indices[:,idx[0],idx[1]]] # one hot encoding of args
+      fragment_grad = fragment_grad.reshape(fragment.shape)
+      inputs_grad[:,row_slice,col_slice] = fragment_grad*np.expand_dims(sliced_ug,axis=(1,2))
+    return self.unpad(inputs_grad)
+  
   def validate_inputs(self, inputs):
     '''Validates the inputs
 
@@ -486,6 +538,10 @@ class MaxPool3D(Operation, Conv):
     The fragments are generated, for each of it, the maximum value in the x and y dims
     is returned for all examples across all channels
 
+    Since argmax operates only on one axis, the fragment is first flattened across x and
+    y dims (last two dims). The argmax indices are saved in the smallest int dtype for
+    backward
+
     Args:
       inputs (Tensor or int or float or list or np.ndarray): Data to be maxpooled
     
@@ -494,41 +550,64 @@ class MaxPool3D(Operation, Conv):
     '''
     inputs = self.get_tensors(inputs)
     self.validate_inputs(inputs)
-    outputs = np.empty((inputs.shape[0], inputs.shape[1], *self.get_result_shape(inputs.shape, self.kernel_shape)))
-    padded_inputs = self.pad(inputs.data)
+    outputs, indices = self.pool(self.get_data(inputs))
+    return self.get_result_tensor(outputs, inputs, ctx=Context(indices=indices))
+  
+  def pool(self, inputs_data):
+    '''Max pools the data and returns the argmax indices alongside
+
+    Args:
+      inputs_data (np.ndarray): Data to be maxpooled
+    
+    Returns:
+      outputs and the argmax indices of each fragment
+    '''
+    outputs = np.empty((inputs_data.shape[0], inputs_data.shape[1], *self.get_result_shape(inputs_data.shape, self.kernel_shape)), dtype=inputs_data.dtype)
+    indices = np.empty(outputs.shape, dtype=self.get_indices_dtype(self.kernel_shape))
+    padded_inputs = self.pad(inputs_data)
     for (fragment,_,_), idx in self.fragment_iterator(padded_inputs, self.kernel_shape, np.ndindex(outputs.shape[-2:])):
-      outputs[:,:,idx[0],idx[1]] = np.max(fragment, axis=(2,3))
-    return self.get_result_tensor(outputs, inputs)
+      flattened_fragment = fragment.reshape(fragment.shape[0], fragment.shape[1], -1)
+      args = np.argmax(flattened_fragment, axis=-1)
+      outputs[:,:,idx[0],idx[1]] = np.take_along_axis(flattened_fragment, args[...,None], axis=-1)[...,0]
+      indices[:,:,idx[0],idx[1]] = args
+    return outputs, indices
   
-  def backward(self, inputs):
+  def backward(self, inputs, ctx):
     '''Sets the grad_fn of inputs
 
-    Since argmax operates only on one axis, the fragment is first flattened across x and
-    y dims (last two dims)
-    Then the one hot encoding of the max indices are taken that are the multiplied
-    with the corresponding upper grad slice
+    The one hot encoding of the argmax indices saved during forward are taken that are
+    then multiplied with the corresponding upper grad slice
     fragment_grad is reshaped to original fragment shape
 
     Args:
       inputs (Tensor): Tensor that is maxpooled
+      ctx (Context): Context with the argmax indices saved during forward
     '''
-    padded_inputs = self.pad(inputs.data)
-
     def inputs_backward(ug):
-      inputs_grad = np.empty(padded_inputs.shape)
-      for (fragment,row_slice,col_slice),idx in self.fragment_iterator(padded_inputs, self.kernel_shape, np.ndindex(ug.shape[-2:])):
-        sliced_ug = ug[:,:,idx[0],idx[1]]
-        fragment_shape = fragment.shape
-        flattened_fragment = fragment.reshape(fragment_shape[0]*fragment_shape[1], fragment_shape[2]*fragment_shape[3])
-        args = np.argmax(flattened_fragment, axis=-1)
-        fragment_grad = np.eye(flattened_fragment.shape[-1])[args] # one hot encoding of args
-        fragment_grad = fragment_grad.reshape(fragment_shape)
-        inputs_grad[:,:,row_slice,col_slice] = fragment_grad*np.expand_dims(sliced_ug,axis=(2,3))
-      unpadded_inputs_grads = self.unpad(inputs_grad)
-      return unpadded_inputs_grads
-    
+      return self.unpool(ug, ctx.indices, inputs.shape)
+
     inputs.set_grad_fn(inputs_backward)
   
+  def unpool(self, ug, indices, inputs_shape):
+    '''Routes the upper gradient of each fragment to its argmax
+
+    Args:
+      ug (np.ndarray): Upper gradient
+      indices (np.ndarray): Argmax indices returned by pool
+      inputs_shape (tuple): Shape of the inputs that were maxpooled
+    
+    Returns:
+      gradient of the inputs
+    '''
+    inputs_grad = np.empty(inputs_shape[:-2] + tuple(dim+(2*self.padding) for dim in inputs_shape[-2:]), dtype=ug.dtype)
+    one_hot = np.eye(self.kernel_shape[0]*self.kernel_shape[1])
+    for (fragment,row_slice,col_slice),idx in self.fragment_iterator(inputs_grad, self.kernel_shape, np.ndindex(ug.shape[-2:])):
+      sliced_ug = ug[:,:,idx[0],idx[1]]
+      fragment_grad = one_hot[indices[:,:,idx[0],idx[1]]] # one hot encoding of args
+      fragment_grad = fragment_grad.reshape(fragment.shape)
+      inputs_grad[:,:,row_slice,col_slice] = fragment_grad*np.expand_dims(sliced_ug,axis=(2,3))
+    return self.unpad(inputs_grad)
+  
   def validate_inputs(self, inputs):
     '''Validates the inputs
 
@@ -1,5 +1,37 @@
 import numpy as np
+from functools import partial
 from ..node import Node
+from ..utils import get_autocast_dtype
+
+
+class Context:
+  '''Stores the values of an Operation that are needed in its backward pass
+
+  The forward pass of an Operation can save the values it has already calculated, like the
+  result or masks, so that they needn't be recalculated during the backward pass. A new Context
+  is created for each forward pass, so Operations that are called multiple times, like Layers,
+  don't overwrite the values saved by the previous calls
+
+  Masks must be saved as np.ndarray of bool, which take 1 byte per element
+
+  Parameters:
+    result (np.ndarray or None): data of the result Tensor of the Operation, it is set by
+      Operation.get_result_tensor
+  '''
+  def __init__(self, **saved):
+    '''
+    Args:
+      **saved: Values to be saved, they are accessible as attributes
+    '''
+    self.result = None
+    for attr, val in saved.items():
+      setattr(self, attr, val)
+  
+  def __repr__(self):
+    return f'Context({list(self.__dict__.keys())})'
+  
+  def __str__(self):
+    return f'Context({list(self.__dict__.keys())})'
 
 
 class Operation:
@@ -8,32 +40,54 @@ class Operation:
   Used when some input is getting transformed into an output, for functions
   where gradient calculation is required with the forward pass and the backward
   pass defined
+
+  Operands that don't require gradient, ie Python scalars, lists, np.ndarray or Tensors
+  with requires_grad=False are treated as immediates, they are never wrapped in a Tensor,
+  never added to the graph and never get a grad_fn
+
+  Parameters:
+    autocast_dtype (None or np.dtype): dtype that the data of operands is cast to, set by
+      autocast for the current thread. None means no casting
   '''
+  @property
+  def autocast_dtype(self):
+    '''Returns the dtype of the autocast that the current thread is in, None if it isn't in one
+    '''
+    return get_autocast_dtype()
   
   def process_operands(self, operands):
-    '''All operands are converted to Tensors
+    '''Processes the operands of the Operation
+
+    Tensors are kept as they are, int and float are converted to float and list or
+    np.ndarray are processed into np.ndarray of floats. None of these are wrapped in a
+    Tensor, they are used as immediates
 
     Args:
       operands (Tensor or int or float or list or np.ndarray): Operands of the Operation
     
     Returns:
-      tuple of Tensors
+      tuple of Tensors or immediates
     '''
     from ..tensor import Tensor
+    from ..utils import process_data
     operands = list(operands)
     for i,operand in enumerate(operands):
-      if not isinstance(operand, Tensor):
-        operands[i] = Tensor(operand)
+      if isinstance(operand, Tensor):
+        continue
+      if type(operand) in (int, float):
+        operands[i] = float(operand)
+      else:
+        operands[i] = process_data(operand)
     return tuple(operands)
   
   def get_tensors(self, *operands):
-    '''Returns the processed operands as tuple of Tensors
+    '''Returns the processed operands as tuple of Tensors or immediates
 
     Args:
       *operands (Tensor or int or float or list or np.ndarray): Operands of the Operation
     
     Returns:
-      tuple of Tensors if len(tuple)>1 else returns the first Tensor
+      tuple of Tensors or immediates if len(tuple)>1 else returns the first one
     '''
     tensors = self.process_operands(operands)
     if len(tensors)==0:
@@ -43,6 +97,39 @@ class Operation:
     else:
       return tensors
   
+  def get_data(self, operand):
+    '''Returns the data of a processed operand
+
+    Immediates are their own data. Under autocast, floating point arrays are cast
+    to autocast_dtype
+
+    Args:
+      operand (Tensor or float or np.ndarray): Processed operand of the Operation
+    
+    Returns:
+      data of the operand
+    '''
+    from ..tensor import Tensor
+    data = operand.data if isinstance(operand, Tensor) else operand
+    if (self.autocast_dtype is not None) and isinstance(data, np.ndarray) and (data.dtype!=self.autocast_dtype):
+      return data.astype(self.autocast_dtype)
+    return data
+  
+  def operand_requires_grad(self, operand):
+    '''Checks if gradient must be calculated for an operand
+
+    Immediates and Tensors with requires_grad=False are constants and never
+    require gradient
+
+    Args:
+      operand (Tensor or float or np.ndarray): Processed operand of the Operation
+    
+    Returns:
+      True if operand is a Tensor with requires_grad=True else False
+    '''
+    from ..tensor import Tensor
+    return isinstance(operand, Tensor) and operand.requires_grad
+  
   def get_broadcast_shape(self, *tensors):
     '''Return broadcasted shape of Tensors
 
@@ -50,7 +137,7 @@ class Operation:
     , else None.
 
     Args:
-      *tensors (Tensor): Tensors that should be broadcasted
+      *tensors (Tensor or float or np.ndarray): Tensors or immediates that should be broadcasted
 
     Returns:
       Broadcasted shape if it can be broadcasted, if not None
@@ -58,10 +145,10 @@ class Operation:
       it returns None
     '''
     for tens in tensors:
-      if not(tens.requires_broadcasting):
+      if not(getattr(tens, 'requires_broadcasting', True)):
         return None
     try:
-      return np.broadcast_shapes(*(tens.data.shape for tens in tensors))
+      return np.broadcast_shapes(*(np.shape(self.get_data(tens)) for tens in tensors))
     except ValueError:
       return None
   
@@ -73,25 +160,31 @@ class Operation:
     requires_grad to True
 
     Args:
-      tensors (Tensor): Tensors that are operated on
+      tensors (Tensor or float or np.ndarray): Tensors or immediates that are operated on
     '''
     for tens in tensors:
-      if tens.requires_grad:
+      if self.operand_requires_grad(tens):
         return True
     return False
   
-  def get_result_tensor(self, result, *tensors):
+  def get_result_tensor(self, result, *tensors, ctx=None):
     '''Returns the result tensor of the Operation
     
-    If tracking is enabled, then, it creates a Node for the result_tensor
-    with parent_broadcast_shape and adds edges to the graph
+    If tracking is enabled and the result requires grad, then, it creates a Node for the
+    result_tensor with parent_broadcast_shape and adds edges to the graph, only from the
+    operands that require grad. The backward_fn of the Node is bound to all the operands,
+    including the immediates, so that the backward pass gets them in the same order as
+    forward. If a Context is given, then data of the result_tensor is saved in it and it is
+    passed to the backward as ctx keyword argument
     
-    If tracking is disabled, then no Node creation and edge addition
-    occurs
+    If tracking is disabled or none of the operands require grad, then no Node creation
+    and edge addition occurs
 
     Args:
-      result (np object): Result after performing a raw numpy operation
-      *tensors (Tensor): Operands of the operation
+      result (np object or float): Result after performing a raw numpy operation
+      *tensors (Tensor or float or np.ndarray): Operands of the operation
+      ctx (Context or None): Context with values saved during forward for backward.
+        Defaults to None
 
     Returns:
       Tensor of the result
@@ -99,19 +192,36 @@ class Operation:
     from ..tensor import Tensor
     from ..utils import get_graph
     graph = get_graph()
-    result = result.astype(np.ndarray)
+    result = np.asarray(result)
     result_tensor = Tensor(result, self.result_requires_grad(tensors))
-    if graph.track:
+    if graph.track and result_tensor.requires_grad:
       result_node = Node(result_tensor)
-      result_node.backward_fn = self.backward
+      if ctx is None:
+        result_node.backward_fn = partial(self.backward, *tensors)
+      else:
+        ctx.result = result_tensor.data
+        result_node.backward_fn = partial(self.backward, *tensors, ctx=ctx)
+      if self.autocast_dtype is not None:
+        result_node.backward_fn = partial(self.autocast_backward, self.autocast_dtype, result_node.backward_fn)
       result_node.parent_broadcast_shape = self.get_broadcast_shape(*tensors)
-      graph.add_edge(result_node, tensors)
+      graph.add_edge(result_node, [tens for tens in tensors if self.operand_requires_grad(tens)])
     return result_tensor
   
+  def autocast_backward(self, dtype, backward_fn):
+    '''Runs backward_fn under autocast with the dtype the forward was run in
+
+    Args:
+      dtype (np.dtype): dtype of autocast during forward
+      backward_fn: backward bound to the operands
+    '''
+    from ..utils import autocast
+    with autocast(dtype):
+      backward_fn()
+  
   def backward(self, *args):
     '''Abstract backward method
 
     Raises:
       NotImplementedError: If backward method isn't overridden
     '''
-    raise NotImplementedError(f"Backward method not implemented for Operation {self}")
\ No newline at end of file
+    raise NotImplementedError(f"Backward method not implemented for Operation {self}")
@@ -1,3 +1,4 @@
+import numpy as np
 from .utils import process_data, unbroadcast_data
 from .ops import add, sub, mul, div, pow as _pow, transpose, sum as _sum, exp, dot, flatten, reshape
 
@@ -76,7 +77,7 @@ class Tensor:
     '''The essence of autograd, final gradient calculations for the Tensor is performed here
 
     The gradient of each child is taken as upper gradient, the backward_fn of the 
-    Node of the Tensor is executed to set the grad_fn of Tensor.
+    Node of the child is executed to set the grad_fn of Tensor.
 
     grad_fn is executed, the grad is then unbroadcasted, if Tensor has been broadcasted
     during the Operation. auto-removal of Tensor from the graph is performed when
@@ -92,7 +93,7 @@ class Tensor:
     graph = get_graph()
     for child in node.children:
       if self.requires_grad and calculate_grads:
-        child.backward_fn(*[node.tens for node in child.parents])
+        child.backward_fn()
         upper_grad = child.tens.grad
         grad = self.grad_fn(upper_grad)
         grad = unbroadcast_data(grad, self.shape, child.parent_broadcast_shape)
@@ -295,10 +296,13 @@ class Tensor:
     if gradients are flowing into a Tensor from two different paths, they need to be
     summed up
 
+    The gradient is cast to the dtype of data, so that the grads of Tensors computed under
+    autocast stay in low precision, while those of float64 Tensors like Params are float64
+
     Args:
       grad (np.ndarray): The gradient to be added/accumulated
     '''
-    self.grad+=grad
+    self.grad+=np.asarray(grad, dtype=self.data.dtype)
   
   @property
   def data(self):
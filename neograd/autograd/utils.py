@@ -1,3 +1,4 @@
+import threading
 import numpy as np
 from .graph import Graph
 from itertools import zip_longest
@@ -7,7 +8,9 @@ def process_data(data):
   '''Checks and processes the data for storage in Tensor
 
   Supported types for data - [int, float, list, np.ndarray]
-  Elements in data should be float or be typecastable to float
+  Elements in data should be float or be typecastable to float. Under autocast, arrays
+  of float16 and float32 keep their dtype, so that Tensors can hold the low precision
+  results of Operations, everything else is cast to float64
 
   Args:
     data (int or float or list or np.ndarray): Data to be processed
@@ -23,6 +26,8 @@ def process_data(data):
   if type(data) in supported_types:
     if not isinstance(data, np.ndarray):
       data = np.array(data)
+    if (data.dtype in (np.float16, np.float32)) and (get_autocast_dtype() is not None):
+      return data
     try:
       data = data.astype(float)
     except ValueError:
@@ -77,6 +82,33 @@ def unbroadcast_data(data, orig_data_shape, broadcasted_shape):
     unbroadcasted_data = data
   return unbroadcasted_data
 
+def pack_mask(mask):
+  '''Packs a bool mask into bits
+
+  Each element of the mask takes 1 bit instead of 1 byte, the shape isn't stored
+  and must be given while unpacking
+
+  Args:
+    mask (np.ndarray): bool mask to be packed
+  
+  Returns:
+    1D np.ndarray of uint8 with the packed bits
+  '''
+  return np.packbits(mask, axis=None)
+
+def unpack_mask(packed_mask, shape):
+  '''Unpacks a mask that was packed with pack_mask
+
+  Args:
+    packed_mask (np.ndarray): Packed bits of the mask
+    shape (tuple): Shape of the original mask
+  
+  Returns:
+    bool mask of the given shape
+  '''
+  size = int(np.prod(shape))
+  return np.unpackbits(packed_mask, count=size).reshape(shape).view(bool)
+
 def get_graph():
   '''Returns graph that is in use and present in Graph.graph
 
@@ -100,14 +132,18 @@ class new_graph:
   circumstances where it shouldn't interfere with the global _NG_GRAPH
 
   After entering, Graph object created is set in Graph.graph. After exiting
-  the Graph.graph is set back to None which implies that global _NG_GRAPH will
-  be used
+  the Graph.graph is set back to the graph that was in use before entering, which
+  is None, implying that global _NG_GRAPH will be used, unless new_graph is nested
+
+  Parameters:
+    prev_graph (Graph or None): Graph.graph before entering
   '''
   def __enter__(self):
+    self.prev_graph = Graph.graph
     Graph.graph = Graph()
   
   def __exit__(self, exc_type, exc_value, exc_traceback):
-    Graph.graph = None
+    Graph.graph = self.prev_graph
 
 
 class no_track:
@@ -118,19 +154,60 @@ class no_track:
   any backward pass
 
   On entering, graph.track is set to False to indicate no tracking and on exiting, it is
-  set back to True
+  set back to what it was before entering
 
   Parameters:
     graph (Graph): The current graph in use
+    prev_track (bool): graph.track before entering
   '''
   def __init__(self):
     self.graph = get_graph()
 
   def __enter__(self):
+    self.prev_track = self.graph.track
     self.graph.track = False
   
   def __exit__(self, exc_type, exc_value, exc_traceback):
-    self.graph.track = True
+    self.graph.track = self.prev_track
+
+
+_autocast_state = threading.local()
+
+def get_autocast_dtype():
+  '''Returns the dtype of the autocast that the current thread is in
+
+  Returns:
+    np.dtype, None if the thread isn't in an autocast
+  '''
+  return getattr(_autocast_state, 'dtype', None)
+
+
+class autocast:
+  '''Runs Operations in a lower precision
+
+  Context Manager under which the floating point data of the operands of Operations is
+  cast to dtype before computing with it, so their results and what they save for backward
+  are in dtype. The backward of these Operations also runs in dtype, even if backward is
+  called outside the Context Manager
+
+  The dtype is kept per thread, so an autocast only affects the Operations run by the
+  thread that entered it, like the training loop and not a Batcher serving the Model
+
+  Grads are accumulated in the dtype of the data of each Tensor, so Params, which keep
+  float64 data, get float64 grads and their data is the master copy updated by the optimizers
+
+  Parameters:
+    dtype (np.dtype): Precision to run the Operations in. Defaults to np.float16
+  '''
+  def __init__(self, dtype=np.float16):
+    self.dtype = dtype
+
+  def __enter__(self):
+    self.prev_dtype = get_autocast_dtype()
+    _autocast_state.dtype = self.dtype
+  
+  def __exit__(self, exc_type, exc_value, exc_traceback):
+    _autocast_state.dtype = self.prev_dtype
 
 
 def _evaluate_grad_check(analytical_grads, calculated_grads, epsilon, print_vals):
@@ -1,5 +1,6 @@
 from .model import Model
-from .layers import Sequential, Dropout, Linear, Conv2D, Conv3D, MaxPool2D, MaxPool3D
+from .layers import Sequential, Dropout, Linear, Flatten, Conv2D, Conv3D, MaxPool2D, MaxPool3D, ActivationCheckpoint, BatchNorm, FusedLinear, FusedConv
 from .activations import ReLU, Sigmoid, Tanh, Softmax, LeakyReLU
 from .checkpoint import Checkpoint
-from .utils import save_model, load_model
\ No newline at end of file
+from .utils import save_model, load_model
+from .export import ExportedModel, load_exported
\ No newline at end of file
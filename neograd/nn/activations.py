@@ -1,12 +1,26 @@
 from .layers import Layer
-from ..autograd.ops.operation import Operation
+from ..autograd.ops.operation import Operation, Context
+from ..autograd.utils import pack_mask, unpack_mask
 import numpy as np
 
 
 # <------------RELU------------>
 class ReLU(Layer, Operation):
   '''ReLU Layer
+
+  Parameters:
+    pack_mask (bool): Whether the mask saved for backward must be packed into
+      bits, 1 bit per element instead of 1 byte. Defaults to False
   '''
+  def __init__(self, pack_mask=False):
+    '''
+    Args:
+      pack_mask (bool): Whether the mask saved for backward must be packed into
+        bits. Defaults to False
+    '''
+    Layer.__init__(self)
+    self.pack_mask = pack_mask
+
   def forward(self, inputs):
     '''Calculates ReLU of inputs
 
@@ -17,21 +31,49 @@ class ReLU(Layer, Operation):
       Tensor of result
     '''
     inputs = self.get_tensors(inputs)
-    return self.get_result_tensor(np.maximum(0, inputs.data), inputs)
+    result, mask = self.activate(self.get_data(inputs))
+    return self.get_result_tensor(result, inputs, ctx=Context(mask=mask))
   
-  def backward(self, inputs):
+  def backward(self, inputs, ctx):
     '''Sets the grad_fn of the Tensor
 
     If element in data is greater than zero, its local gradient will be 1
-    else 0
+    else 0, which is the bool mask saved during forward, it is unpacked only
+    when the gradient is calculated
 
     Args:
       inputs (Tensor): Operand
+      ctx (Context): Context with the mask saved during forward
     '''
-    inputs.set_grad_fn(lambda ug:np.where(inputs.data>=0, 1, 0)*ug)
+    inputs.set_grad_fn(lambda ug:self.calc_grad(ctx.mask, ug))
+  
+  def activate(self, arr):
+    '''Calculates ReLU of the data
+
+    Args:
+      arr (np.ndarray): Data to be activated
+    
+    Returns:
+      ReLU of the data and the mask needed by calc_grad, packed if pack_mask
+    '''
+    mask = arr>=0
+    return np.maximum(0, arr), pack_mask(mask) if self.pack_mask else mask
+  
+  def calc_grad(self, mask, ug):
+    '''Calculates the gradient from the mask returned by activate
+
+    Args:
+      mask (np.ndarray): Mask returned by activate
+      ug (np.ndarray): Upper gradient
+    
+    Returns:
+      gradient of the inputs
+    '''
+    mask = unpack_mask(mask, ug.shape) if self.pack_mask else mask
+    return mask*ug
 
   def __repr__(self):
-    return 'ReLU()'
+    return f'ReLU(pack_mask={self.pack_mask})'
   
   def __str__(self):
     return 'ReLU'
@@ -51,16 +93,43 @@ class Sigmoid(Layer, Operation):
       Tensor of result
     '''
     inputs = self.get_tensors(inputs)
-    return self.get_result_tensor(1/(1+np.exp(-inputs.data)), inputs)
+    result, _ = self.activate(self.get_data(inputs))
+    return self.get_result_tensor(result, inputs, ctx=Context())
   
-  def backward(self, inputs):
+  def backward(self, inputs, ctx):
     '''Sets the grad_fn of the Tensor
 
+    Local gradient is calculated from the result of the forward pass
+
     Args:
       inputs (Tensor): Operand
+      ctx (Context): Context with the result of forward
+    '''
+    inputs.set_grad_fn(lambda ug:self.calc_grad(ctx.result, ug))
+  
+  def activate(self, arr):
+    '''Calculates Sigmoid of the data
+
+    Args:
+      arr (np.ndarray): Data to be activated
+    
+    Returns:
+      Sigmoid of the data, twice since the result is what calc_grad needs
+    '''
+    result = 1/(1+np.exp(-arr))
+    return result, result
+  
+  def calc_grad(self, result, ug):
+    '''Calculates the gradient from the result of activate
+
+    Args:
+      result (np.ndarray): Sigmoid of the inputs
+      ug (np.ndarray): Upper gradient
+    
+    Returns:
+      gradient of the inputs
     '''
-    result = 1/(1+np.exp(-inputs.data))
-    inputs.set_grad_fn(lambda ug:(result*(1-result))*ug)
+    return (result*(1-result))*ug
 
   def __repr__(self):
     return 'Sigmoid()'
@@ -83,16 +152,43 @@ class Tanh(Layer, Operation):
       Tensor of result
     '''
     inputs = self.get_tensors(inputs)
-    return self.get_result_tensor(np.tanh(inputs.data), inputs)
+    result, _ = self.activate(self.get_data(inputs))
+    return self.get_result_tensor(result, inputs, ctx=Context())
   
-  def backward(self, inputs):
+  def backward(self, inputs, ctx):
     '''Sets the grad_fn of the Tensor
 
+    Local gradient is calculated from the result of the forward pass
+
     Args:
       inputs (Tensor): Operand
+      ctx (Context): Context with the result of forward
+    '''
+    inputs.set_grad_fn(lambda ug:self.calc_grad(ctx.result, ug))
+  
+  def activate(self, arr):
+    '''Calculates Tanh of the data
+
+    Args:
+      arr (np.ndarray): Data to be activated
+    
+    Returns:
+      Tanh of the data, twice since the result is what calc_grad needs
+    '''
+    result = np.tanh(arr)
+    return result, result
+  
+  def calc_grad(self, result, ug):
+    '''Calculates the gradient from the result of activate
+
+    Args:
+      result (np.ndarray): Tanh of the inputs
+      ug (np.ndarray): Upper gradient
+    
+    Returns:
+      gradient of the inputs
     '''
-    result = np.tanh(inputs.data)
-    inputs.set_grad_fn(lambda ug:(1-np.power(result,2))*ug)
+    return (1-np.square(result))*ug
   
   def __repr__(self):
     return 'Tanh()'
@@ -125,10 +221,10 @@ class Softmax(Layer, Operation):
       Tensor of result
     '''
     inputs = self.get_tensors(inputs)
-    result = self.calc_softmax(inputs.data, axis=self.axis)
-    return self.get_result_tensor(result, inputs)
+    result = self.calc_softmax(self.get_data(inputs), axis=self.axis)
+    return self.get_result_tensor(result, inputs, ctx=Context())
   
-  def backward(self, inputs):
+  def backward(self, inputs, ctx):
     '''Sets the grad_fn of the Tensor
 
     Quite a tricky one, first the Jacobian of each of the slices along
@@ -137,6 +233,7 @@ class Softmax(Layer, Operation):
 
     Args:
       inputs (Tensor): Operand
+      ctx (Context): Context with the result of forward
     '''
     def softmax_grad(arr, ug_slices): # arr will always be 1d array
       local_grad = -np.broadcast_to(arr, (arr.size, arr.size))
@@ -149,10 +246,9 @@ class Softmax(Layer, Operation):
       ug_slices.append(arr)
 
     def grad_backward(ug):
-      result = np.apply_along_axis(self.calc_softmax, self.axis, inputs.data)
       ug_slices = []
       np.apply_along_axis(get_ug_slices, self.axis, ug, ug_slices)
-      grads = np.apply_along_axis(softmax_grad, self.axis, result, ug_slices)
+      grads = np.apply_along_axis(softmax_grad, self.axis, ctx.result, ug_slices)
       return grads
 
     inputs.set_grad_fn(grad_backward)
@@ -183,13 +279,21 @@ class Softmax(Layer, Operation):
 # <------------LEAKYRELU------------>
 class LeakyReLU(Layer, Operation):
   '''LeakyReLU Layer
+
+  Parameters:
+    leak (float): leak value
+    pack_mask (bool): Whether the mask saved for backward must be packed into
+      bits, 1 bit per element instead of 1 byte. Defaults to False
   '''
-  def __init__(self, leak=0.01):
+  def __init__(self, leak=0.01, pack_mask=False):
     '''
     Args:
       leak (float): leak value
+      pack_mask (bool): Whether the mask saved for backward must be packed into
+        bits. Defaults to False
     '''
     self.leak = leak
+    self.pack_mask = pack_mask
 
   def forward(self, inputs):
     '''Calculates LeakyReLU of inputs
@@ -201,22 +305,49 @@ class LeakyReLU(Layer, Operation):
       Tensor of result
     '''
     inputs = self.get_tensors(inputs)
-    arr = inputs.data
-    return self.get_result_tensor(np.where(arr>=0, arr, self.leak*arr), inputs)
+    result, mask = self.activate(self.get_data(inputs))
+    return self.get_result_tensor(result, inputs, ctx=Context(mask=mask))
   
-  def backward(self, inputs):
+  def backward(self, inputs, ctx):
     '''Sets the grad_fn of the Tensor
 
     If element in data is greater than zero, its local gradient will be 1
-    else will be leak value
+    else will be leak value, which is decided by the bool mask saved during forward,
+    it is unpacked only when the gradient is calculated
 
     Args:
       inputs (Tensor): Operand
+      ctx (Context): Context with the mask saved during forward
+    '''
+    inputs.set_grad_fn(lambda ug:self.calc_grad(ctx.mask, ug))
+  
+  def activate(self, arr):
+    '''Calculates LeakyReLU of the data
+
+    Args:
+      arr (np.ndarray): Data to be activated
+    
+    Returns:
+      LeakyReLU of the data and the mask needed by calc_grad, packed if pack_mask
+    '''
+    mask = arr>=0
+    return np.where(mask, arr, self.leak*arr), pack_mask(mask) if self.pack_mask else mask
+  
+  def calc_grad(self, mask, ug):
+    '''Calculates the gradient from the mask returned by activate
+
+    Args:
+      mask (np.ndarray): Mask returned by activate
+      ug (np.ndarray): Upper gradient
+    
+    Returns:
+      gradient of the inputs
     '''
-    inputs.set_grad_fn(lambda ug: np.where(inputs.data>=0, 1, self.leak)*ug)
+    mask = unpack_mask(mask, ug.shape) if self.pack_mask else mask
+    return np.where(mask, ug, self.leak*ug)
 
   def __repr__(self):
-    return f'LeakyReLU(leak={self.leak})'
+    return f'LeakyReLU(leak={self.leak}, pack_mask={self.pack_mask})'
   
   def __str__(self):
     return 'LeakyReLU'
\ No newline at end of file
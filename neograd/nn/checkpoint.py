@@ -1,38 +1,107 @@
 import os
+import atexit
 import json
+import queue
+import threading
 import numpy as np
 import datetime as dt
 import secrets
+import sqlite3
 from hashlib import sha256
+from .storage import BlobStore, save_chunked, load_chunked, save_sharded, load_sharded
 
 
 class Checkpoint:
   '''Creates and initializes files for checkpoints
     
-  A JSON file checkpoints.json is created which contains the dict which has the tracked values
-  and also the params file name at the time of adding a checkpoint, operates in append mode
-  A new params file is created at each checkpoint and the JSON file is updated
+  An index checkpoints.db, which is a sqlite3 database, is created that has a row for each
+  session and for each checkpoint, with the tracked values and the params file name at the
+  time of adding it. A new params file is created at each checkpoint and a row is inserted
+  into the index in a transaction, so the existing rows are never rewritten and an
+  interrupted write doesn't corrupt the index. A checkpoints.json from before the index
+  was used is imported into it once
 
   Parameters:
     session (str): Current session that is in use
     dirpath (str): Directory in which checkpoints must be saved
     model (Model): Model to be checkpointed
     hash_length (int): Character length of session identifiers. Defaults to 16
+    index (sqlite3.Connection): Connection to checkpoints.db
+    async_writes (bool): Whether params files are written by a background thread
+    pending (None or queue.Queue): Queue of the params files to be written, if async_writes
+    written (None or queue.Queue): Queue of the checkpoints whose params files have been
+      written and that are yet to be inserted into the index, if async_writes
+    writer (None or threading.Thread): Thread that writes the params files, if async_writes
+    write_error (None or Exception): Exception raised while writing a params file, that
+      hasn't been raised yet
+    blobs (None or BlobStore): Store of the params in the blobs directory, if deduplicate
+    codec (None or str): Codec of the compressed params files
+    sharded (bool): Whether the params are written as shards
+    max_shard_size (None or int): Maximum size of a shard in bytes
   '''
-  def __init__(self, model, dirpath, hash_length=16):
+  def __init__(self, model, dirpath, hash_length=16, async_writes=False, max_pending=2, deduplicate=False, codec=None,
+    sharded=False, max_shard_size=None):
     '''
+    In async_writes mode, add only copies the params and queues them to be written by a
+    background thread, so the training loop doesn't wait for the disk. If max_pending
+    writes are already queued, then add waits for one to finish, which bounds the memory
+    used by the copies. A checkpoint is inserted into the index by the thread using the
+    Checkpoint, at the next add, wait, load, best or query after its params file has been
+    written, so the index never has a checkpoint without its file. An exception raised
+    while writing is raised by the next add, wait or load. The queued params files are
+    written when the interpreter exits
+
+    If deduplicate, then instead of a params file with all the params, each checkpoint
+    writes a manifest {hash}.json that references the params by their content in a
+    BlobStore shared by all the sessions, so unchanged params, like those of frozen
+    layers, are written only once
+
+    If codec, then the params file {hash}.ngc is written by save_chunked with codec, so
+    its chunks are compressed in parallel
+
+    If sharded, then the params are written by save_sharded to the directory {hash}, as
+    shards that are written and read concurrently
+
+    Args:
+      async_writes (bool): Whether params files are written by a background thread.
+        Defaults to False
+      max_pending (int): Maximum number of params files queued to be written in
+        async_writes mode. Defaults to 2
+      deduplicate (bool): Whether the params are written as content addressed blobs.
+        Defaults to False
+      codec (None or str): Codec of the compressed params file, one of 'zlib', 'lzma' and
+        'bz2'. Defaults to None, which is a dill pickled file
+      sharded (bool): Whether the params are written as shards. Defaults to False
+      max_shard_size (None or int): Maximum size of a shard in bytes if sharded. Defaults
+        to None, which is a shard per layer
+
     Raises:
       AssertionError: if hash_length<0 and hash_length>64
+      ValueError: If more than one of deduplicate, codec and sharded are given
     '''
+    if deduplicate+(codec is not None)+sharded>1:
+      raise ValueError("Only one of deduplicate, codec and sharded can be given")
     self.session = None
     self.dirpath = None
     assert hash_length>0 and hash_length<=64, 'Hash length must be between 1 and 64'
     self.hash_length = hash_length
     self._init_files(dirpath)
     self.model = model
+    self.async_writes = async_writes
+    self.pending = self.written = self.writer = self.write_error = None
+    self.blobs = BlobStore(f'{self.dirpath}/blobs') if deduplicate else None
+    self.codec = codec
+    self.sharded = sharded
+    self.max_shard_size = max_shard_size
+    if async_writes:
+      self.pending = queue.Queue(maxsize=max_pending)
+      self.written = queue.Queue()
+      self.writer = threading.Thread(target=self._write_pending, daemon=True)
+      self.writer.start()
+      atexit.register(self.wait)
   
   def new_session(self):
-    '''Creates a new session in checkpoints.json
+    '''Creates a new session in the index
 
     Also creates a new directory for the session
 
@@ -41,34 +110,34 @@ class Checkpoint:
     '''
     self.session = self._generate_hash()
     os.mkdir(f'{self.dirpath}/{self.session}')
+    with self.index:
+      self.index.execute('INSERT INTO sessions (session) VALUES (?)', (self.session,))
     return self
   
   def specify_session(self, session):
-    '''Used to specify a particular session to use for checkpoints.json
+    '''Used to specify a particular session to use for the checkpoints
 
     Args:
       session (str): The session to be used
     
     Raises:
-      ValueError: If session is not already in checkpoints.json
+      ValueError: If session is not already in the index
     '''
-    with open(f'{self.dirpath}/checkpoints.json', 'r') as checkpoints_fp:
-      existing_checkpoints = json.load(checkpoints_fp)
-      if session in existing_checkpoints:
-        self.session = session
-      else:
-        raise ValueError(f"Invalid session {session} specified!")
+    if self.index.execute('SELECT 1 FROM sessions WHERE session=?', (session,)).fetchone() is None:
+      raise ValueError(f"Invalid session {session} specified!")
+    self.session = session
 
   def add(self, **tracked):
     '''Adds a new checkpoint
 
     Args:
-      **tracked: All the data that needs to be tracked in checkpoints.json
+      **tracked: All the data that needs to be tracked in the index
     
     Raises:
       ValueError: If forbidden_attrs ('datetime') are used as keys in tracked, because
         the same key is used by neograd to add key of the same value, which might get overwritten
       ValueError: If values in tracked aren't serializable and don't belong to builtin classes
+      Exception: Raised while writing a previous params file in async_writes mode
     '''
     forbidden_attrs = ('datetime')
     allowed_types = (int, float, str, dict, list)
@@ -77,6 +146,8 @@ class Checkpoint:
         raise ValueError(f'Only {allowed_types} can be tracked, if using a Tensor, use data attribute and convert it into native python objects or strings!')
       if attr in forbidden_attrs:
         raise ValueError(f'Attribute {attr} must not be present in forbidden_attrs {forbidden_attrs}, as neograd uses them internally!')
+    self._raise_write_error()
+    self._insert_written()
     updated_checkpoint, params_fname_hash = self._update(tracked)
     self._save(updated_checkpoint, params_fname_hash)
   
@@ -100,30 +171,130 @@ class Checkpoint:
   def _save(self, updated_checkpoint, params_fname_hash):
     '''Saves the checkpoint
 
-    Saves the checkpoint details onto checkpoints.json and creates a new file
-    with the params of the model
-
-    if self.session isn't already in existing checkpoints, then it creates a new dict
-    and adds the checkpoint there.
+    Creates a new file with the params of the model and inserts the checkpoint
+    details into the index, in async_writes mode a copy of the params is queued
+    to be written instead, and the checkpoint is inserted once it's written
 
     Args:
       updated_checkpoint (Checkpoint): Checkpoint that is updated
       params_fname_hash (str): Hash that is generated to be the name of filename
     '''
-    with open(f'{self.dirpath}/checkpoints.json', 'r') as checkpoints_fp:
-      existing_checkpoints = json.load(checkpoints_fp)
-    with open(f'{self.dirpath}/checkpoints.json', 'w') as checkpoints_fp:
-      if existing_checkpoints.get(self.session) is None:
-        existing_checkpoints[self.session] = {}
-      existing_checkpoints[self.session][params_fname_hash] = updated_checkpoint
-      json.dump(existing_checkpoints, checkpoints_fp, indent=4)
-    self.model.save(f'{self.dirpath}/{self.session}/{params_fname_hash}.hkl')
+    if self.async_writes:
+      self.pending.put((self.session, params_fname_hash, updated_checkpoint, self._snapshot(self._get_params())))
+      return
+    self._write(self.session, params_fname_hash, self._get_params())
+    with self.index:
+      self._insert_checkpoint(self.session, params_fname_hash, updated_checkpoint)
+  
+  def _get_params(self):
+    '''Returns the data of the params of the model in the form they are written in
+
+    Params that don't require grad, like those of frozen layers, are put in the blobs
+    right away, so they aren't copied in async_writes mode. They're hashed at every
+    checkpoint, since their data can be changed in place, like by loading, without
+    being replaced
+
+    Returns:
+      dict of name to data or digest if deduplicate, dict of name to data if codec or
+      sharded, else parameters(as_dict=True)
+    '''
+    if self.blobs is not None:
+      params = {}
+      for name, param in self.model.named_parameters().items():
+        params[name] = param.data if param.requires_grad else self.blobs.put(param.data)
+      return params
+    if (self.codec is not None) or self.sharded:
+      return {name: param.data for name, param in self.model.named_parameters().items()}
+    return self.model.parameters(as_dict=True)
+  
+  def _write(self, session, params_fname_hash, params):
+    '''Writes the params file, compressed if codec, or the manifest and blobs if deduplicate,
+    or the shards if sharded
+
+    Args:
+      session (str): Session of the checkpoint
+      params_fname_hash (str): Hash that is the name of the params file
+      params (dict): Data of the params as returned by _get_params
+    '''
+    fpath_hash = f'{self.dirpath}/{session}/{params_fname_hash}'
+    if self.blobs is not None:
+      self.blobs.write_manifest(f'{fpath_hash}.json', params)
+    elif self.codec is not None:
+      save_chunked(f'{fpath_hash}.ngc', params, self.codec)
+    elif self.sharded:
+      save_sharded(fpath_hash, params, self.max_shard_size)
+    else:
+      self.model.save(f'{fpath_hash}.hkl', params)
+  
+  def _snapshot(self, params):
+    '''Copies the data of the params, so that they can be written while the model is trained
+
+    Args:
+      params (dict or list or np.ndarray or str): Data of the params as returned by _get_params
+
+    Returns:
+      params with their data copied
+    '''
+    if isinstance(params, dict):
+      return {attr: self._snapshot(val) for attr, val in params.items()}
+    if isinstance(params, list):
+      return [self._snapshot(val) for val in params]
+    return params.copy() if isinstance(params, np.ndarray) else params
+  
+  def _write_pending(self):
+    '''Writes the queued params files one after the other, runs on the writer thread
+
+    Once a write fails, the following ones are skipped until the exception is raised.
+    The checkpoints whose params files have been written are put in written
+    '''
+    while True:
+      session, params_fname_hash, checkpoint, params = self.pending.get()
+      try:
+        if self.write_error is None:
+          self._write(session, params_fname_hash, params)
+          self.written.put((session, params_fname_hash, checkpoint))
+      except Exception as e:
+        self.write_error = e
+      finally:
+        self.pending.task_done()
+  
+  def wait(self):
+    '''Waits until all the queued params files are written and their checkpoints are
+    inserted into the index
+
+    Raises:
+      Exception: Raised while writing a params file in async_writes mode
+    '''
+    if self.async_writes:
+      self.pending.join()
+    self._insert_written()
+    self._raise_write_error()
+  
+  def _insert_written(self):
+    '''Inserts the checkpoints whose params files have been written into the index, if async_writes
+    '''
+    if not(self.async_writes) or self.written.empty():
+      return
+    with self.index:
+      while not(self.written.empty()):
+        self._insert_checkpoint(*self.written.get())
+  
+  flush = wait
+  
+  def _raise_write_error(self):
+    '''Raises the exception raised while writing a params file, if any
+    '''
+    write_error, self.write_error = self.write_error, None
+    if write_error is not None:
+      raise write_error
   
   def load(self, params_fname, load_params=True):
     '''Retrieves the Checkpoint
 
     Returns the checkpoint based on the params_fname and loads the params
-    onto the model if load_params is True
+    onto the model if load_params is True, from the manifest, the compressed params
+    file or the shards of the same name if the checkpoint was deduplicated, compressed
+    or sharded
 
     Args:
       params_fname (str): Filename to load params from
@@ -133,25 +304,95 @@ class Checkpoint:
       Checkpoint desired
     
     Raises:
-      ValueError: If the current session is not present in checkpoints.py
+      ValueError: If the current session is not present in the index
+      ValueError: If params_fname isn't a checkpoint of the current session
+      Exception: Raised while writing a params file in async_writes mode
     '''
     params_fname_hash = params_fname.rstrip('.hkl')
-    with open(f'{self.dirpath}/checkpoints.json') as checkpoints_fp:
-      session = json.load(checkpoints_fp).get(self.session)
-      if session is None:
-        raise ValueError(f"Invalid session {self.session}")
-      if params_fname_hash not in session.keys():
-        raise ValueError(f"File {params_fname} not in current session {self.session} directory! Please specify the session using Checkpoint.specify_session")
-      checkpoint = session[params_fname_hash]
+    self.wait()
+    if self.index.execute('SELECT 1 FROM sessions WHERE session=?', (self.session,)).fetchone() is None:
+      raise ValueError(f"Invalid session {self.session}")
+    row = self.index.execute('SELECT tracked FROM checkpoints WHERE session=? AND fname=?', (self.session, params_fname_hash)).fetchone()
+    if row is None:
+      raise ValueError(f"File {params_fname} not in current session {self.session} directory! Please specify the session using Checkpoint.specify_session")
+    checkpoint = json.loads(row[0])
     if load_params:
-      self.model.load(f'{self.dirpath}/{self.session}/{params_fname}')
+      fpath_hash = f'{self.dirpath}/{self.session}/{params_fname_hash}'
+      if os.path.exists(f'{fpath_hash}.json'):
+        BlobStore(f'{self.dirpath}/blobs').load_manifest(f'{fpath_hash}.json', self.model.named_parameters())
+      elif os.path.exists(f'{fpath_hash}.ngc'):
+        load_chunked(f'{fpath_hash}.ngc', self.model.named_parameters())
+      elif os.path.exists(f'{fpath_hash}/manifest.json'):
+        load_sharded(fpath_hash, self.model.named_parameters())
+      else:
+        self.model.load(f'{self.dirpath}/{self.session}/{params_fname}')
     return checkpoint
   
+  def best(self, metric, mode='min', k=1, session=None):
+    '''Returns the params file names of the checkpoints with the best tracked metric
+
+    Only the index is read, so the best checkpoint is restored with
+    load(best(metric)[0])
+
+    Args:
+      metric (str): Name of the tracked value
+      mode (str): 'min' if lower values of metric are better else 'max'. Defaults to 'min'
+      k (int): Number of checkpoints to return. Defaults to 1
+      session (None or str): Session to search in. Defaults to None, which is the current session
+    
+    Returns:
+      list of upto k params file names, from the best to the worst
+    
+    Raises:
+      ValueError: If mode isn't 'min' or 'max'
+    '''
+    if mode not in ('min', 'max'):
+      raise ValueError(f"mode must be 'min' or 'max', got {mode}")
+    self._insert_written()
+    rows = self.index.execute(f'''
+      SELECT checkpoints.fname FROM metrics JOIN checkpoints ON checkpoints.id=metrics.checkpoint_id
+      WHERE metrics.name=? AND checkpoints.session=?
+      ORDER BY metrics.value {'ASC' if mode=='min' else 'DESC'}, checkpoints.id LIMIT ?
+    ''', (metric, self.session if session is None else session, k))
+    return [f'{fname}.hkl' for fname, in rows]
+  
+  def query(self, session=None, where=None):
+    '''Returns the params file names of the checkpoints whose tracked values match where
+
+    Only the index is read
+
+    Args:
+      session (None or str): Session to search in. Defaults to None, which is the current session
+      where (None or dict): Dict of name of a tracked value to either a value that it must be
+        equal to, or a tuple of an operator out of '<', '<=', '>', '>=', '==', '!=' and the
+        value to compare it with. Defaults to None, which matches all the checkpoints
+    
+    Returns:
+      list of params file names, in the order they were added
+    
+    Raises:
+      ValueError: If an operator isn't supported
+    '''
+    self._insert_written()
+    conditions, args = ['checkpoints.session=?'], [self.session if session is None else session]
+    for name, condition in (where or {}).items():
+      operator, value = condition if isinstance(condition, tuple) else ('==', condition)
+      if operator not in ('<', '<=', '>', '>=', '==', '!='):
+        raise ValueError(f"Unsupported operator {operator}")
+      conditions.append(f'EXISTS (SELECT 1 FROM metrics WHERE metrics.checkpoint_id=checkpoints.id AND metrics.name=? AND metrics.value{operator}?)')
+      args+=[name, value]
+    rows = self.index.execute(f"SELECT fname FROM checkpoints WHERE {' AND '.join(conditions)} ORDER BY id", args)
+    return [f'{fname}.hkl' for fname, in rows]
+  
   def _init_files(self, dirpath):
     '''Initializes files required for Checkpoint
 
     Creates a new folder at dirpath, if it doesn't exist
-    A checkpoint.json file is created, if it is empty, then a new session is created
+    checkpoints.db is created with its tables, if it doesn't exist. The metrics table has a row
+    for each int, float or str tracked value of each checkpoint, indexed by name and value,
+    and by checkpoint. If it has no sessions, then
+    checkpoints.json in dirpath, if any, is imported into it, if there are still no sessions,
+    then a new session is created
     if self.session is None, then automatically the last session is initialized as self.session
 
     Args:
@@ -164,26 +405,74 @@ class Checkpoint:
       pass
     self.dirpath = dirpath # All validation passed, can be assigned to self
 
-    try:
-      with open(f'{dirpath}/checkpoints.json', 'x') as checkpoints_fp: # Create checkpoints.json or do nothing if already exists
-        pass
-    except FileExistsError:
-      pass
+    self.index = sqlite3.connect(f'{dirpath}/checkpoints.db')
+    with self.index:
+      self.index.executescript('''
+        CREATE TABLE IF NOT EXISTS sessions (session TEXT PRIMARY KEY);
+        CREATE TABLE IF NOT EXISTS checkpoints (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          session TEXT NOT NULL REFERENCES sessions(session),
+          fname TEXT NOT NULL,
+          tracked TEXT NOT NULL,
+          UNIQUE (session, fname)
+        );
+        CREATE TABLE IF NOT EXISTS metrics (
+          checkpoint_id INTEGER NOT NULL REFERENCES checkpoints(id),
+          name TEXT NOT NULL,
+          value
+        );
+        CREATE INDEX IF NOT EXISTS metrics_by_value ON metrics (name, value);
+        CREATE INDEX IF NOT EXISTS metrics_by_checkpoint ON metrics (checkpoint_id, name);
+      ''')
+      if self.index.execute('SELECT 1 FROM sessions').fetchone() is None:
+        self._import_json()
+      elif self.index.execute('SELECT 1 FROM metrics').fetchone() is None: # index created before metrics were
+        for checkpoint_id, tracked in self.index.execute('SELECT id, tracked FROM checkpoints').fetchall():
+          self._insert_metrics(checkpoint_id, json.loads(tracked))
     
-    with open(f'{dirpath}/checkpoints.json') as checkpoints_fp:
-      contents = checkpoints_fp.read()
-      if contents.strip()!='':
-        sessions = json.loads(contents) #json.JSONDecodeError is raised if JSON file is invalid
-        if self.session is None:
-          if len(sessions)==0:
-            self.new_session()
-          else:
-            self.session = list(sessions.keys())[-1]
-      else: # checkpoints.json is empty
-        sessions = {}
+    if self.session is None:
+      last_session = self.index.execute('SELECT session FROM sessions ORDER BY rowid DESC LIMIT 1').fetchone()
+      if last_session is None:
         self.new_session()
-    with open(f'{dirpath}/checkpoints.json', 'w') as checkpoints_fp:
-      json.dump(sessions, checkpoints_fp, indent=4)
+      else:
+        self.session = last_session[0]
+  
+  def _import_json(self):
+    '''Inserts the sessions and checkpoints of checkpoints.json into the index, if it exists
+    '''
+    try:
+      with open(f'{self.dirpath}/checkpoints.json') as checkpoints_fp:
+        contents = checkpoints_fp.read()
+    except FileNotFoundError:
+      return
+    if contents.strip()=='':
+      return
+    sessions = json.loads(contents) #json.JSONDecodeError is raised if JSON file is invalid
+    for session, checkpoints in sessions.items():
+      self.index.execute('INSERT INTO sessions (session) VALUES (?)', (session,))
+      for fname, tracked in checkpoints.items():
+        self._insert_checkpoint(session, fname, tracked)
+  
+  def _insert_checkpoint(self, session, fname, tracked):
+    '''Inserts a checkpoint into the index, along with its metrics
+
+    Args:
+      session (str): Session of the checkpoint
+      fname (str): Hash that is the name of the params file
+      tracked (dict): Tracked values of the checkpoint
+    '''
+    cursor = self.index.execute('INSERT INTO checkpoints (session, fname, tracked) VALUES (?, ?, ?)', (session, fname, json.dumps(tracked)))
+    self._insert_metrics(cursor.lastrowid, tracked)
+  
+  def _insert_metrics(self, checkpoint_id, tracked):
+    '''Inserts the scalar tracked values of a checkpoint into the metrics table
+
+    Args:
+      checkpoint_id (int): id of the checkpoint in the index
+      tracked (dict): Tracked values of the checkpoint
+    '''
+    self.index.executemany('INSERT INTO metrics (checkpoint_id, name, value) VALUES (?, ?, ?)',
+      ((checkpoint_id, name, value) for name, value in tracked.items() if isinstance(value, (int, float, str))))
   
   def _generate_hash(self):
     '''Generates 64 hex digit sha256 hash of a random number
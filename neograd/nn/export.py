@@ -0,0 +1,160 @@
+import json
+import numpy as np
+from .model import Model
+from .layers import Param, Sequential, ActivationCheckpoint, Linear, Flatten, Dropout, BatchNorm, Conv2D, Conv3D, MaxPool2D, MaxPool3D
+from .activations import ReLU, LeakyReLU, Sigmoid, Tanh, Softmax
+from ..autograd.utils import no_track
+
+
+EXPORT_FORMAT_VERSION = 1
+
+EXPORTABLE_LAYERS = (Linear, Flatten, Conv2D, Conv3D, MaxPool2D, MaxPool3D, Dropout, BatchNorm, ReLU, LeakyReLU, Sigmoid, Tanh, Softmax)
+
+LAYER_TYPES = {layer_type.__name__: layer_type for layer_type in EXPORTABLE_LAYERS}
+
+
+def get_layer_spec(layer, name, arrays):
+  '''Returns the JSON spec of a layer and adds its arrays to arrays
+
+  The attributes of the layer are exported as they are, so that it can be rebuilt without
+  running its constructor, which would initialize Params that are then overwritten.
+  Params and np.ndarray attributes, like the int8 weights of a quantized layer, are added
+  to arrays, named with the name of the layer as the prefix. ActivationCheckpoint is
+  exported as its segment, since the exported Model only runs inference
+
+  Args:
+    layer (Layer or Container): Layer to be exported
+    name (str): Name of the layer
+    arrays (dict): Dict of name to np.ndarray, that is added to
+
+  Returns:
+    dict of the spec
+
+  Raises:
+    TypeError: If layer isn't one of the standard layers
+  '''
+  if isinstance(layer, ActivationCheckpoint):
+    return get_layer_spec(layer.segment, name, arrays)
+  if type(layer)==Sequential:
+    return {'type': 'Sequential', 'layers': [get_layer_spec(sub_layer, f'{name}.{i}', arrays) for i, sub_layer in enumerate(layer.layers)]}
+  if type(layer) not in EXPORTABLE_LAYERS:
+    raise TypeError(f"{type(layer).__name__} can't be exported, only the standard layers can be")
+  spec = {'type': type(layer).__name__, 'attrs': {}, 'arrays': [], 'params': {}}
+  for attr, val in layer.__dict__.items():
+    if isinstance(val, Param):
+      spec['params'][attr] = val.requires_broadcasting
+      arrays[f'{name}.{attr}'] = val.data
+    elif isinstance(val, (np.ndarray, np.generic)):
+      spec['arrays'].append(attr)
+      arrays[f'{name}.{attr}'] = val
+    else:
+      spec['attrs'][attr] = val
+  return spec
+
+
+def build_layer(spec, name, arrays):
+  '''Rebuilds a layer from its spec, with its Params not requiring grad
+
+  Args:
+    spec (dict): Spec of the layer
+    name (str): Name of the layer
+    arrays (dict or NpzFile): Exported arrays
+
+  Returns:
+    Layer or Sequential
+  '''
+  if spec['type']=='Sequential':
+    return Sequential(*(build_layer(sub_spec, f'{name}.{i}', arrays) for i, sub_spec in enumerate(spec['layers'])))
+  layer = LAYER_TYPES[spec['type']].__new__(LAYER_TYPES[spec['type']])
+  for attr, val in spec['attrs'].items():
+    setattr(layer, attr, tuple(val) if isinstance(val, list) else val) # JSON turns tuples into lists
+  for attr in spec['arrays']:
+    setattr(layer, attr, arrays[f'{name}.{attr}'])
+  for attr, requires_broadcasting in spec['params'].items():
+    setattr(layer, attr, Param(arrays[f'{name}.{attr}'], requires_grad=False, requires_broadcasting=requires_broadcasting))
+  return layer
+
+
+def export_model(model, fpath):
+  '''Exports the model for inference, without pickling it
+
+  The topology of the model is written as JSON to fpath.json and the data of its Params
+  and other arrays as an uncompressed npz to fpath.npz. Since the forward method of the
+  model isn't exported, only a model with a single Sequential, whose forward just calls
+  it, can be exported, operations like reshapes must be layers of the Sequential, like
+  Flatten
+
+  Args:
+    model (Model): Model to be exported
+    fpath (str): File path without extension
+
+  Raises:
+    TypeError: If model isn't an instance of Model
+    ValueError: If model doesn't have a single Sequential as its only layer
+    TypeError: If any of the layers isn't one of the standard layers
+  '''
+  if not isinstance(model, Model):
+    raise TypeError(f'Expected Model object, instead got {type(model)}')
+  model_layers = model.get_layers()
+  if len(model_layers)!=1 or type(next(iter(model_layers.values())))!=Sequential:
+    raise ValueError(f'Only a Model with a single Sequential can be exported, got layers {list(model_layers)}')
+  arrays = {}
+  layers = {attr: get_layer_spec(layer, attr, arrays) for attr, layer in model.get_layers().items()}
+  with open(f'{fpath}.json', 'w') as fp:
+    json.dump({'version': EXPORT_FORMAT_VERSION, 'layers': layers}, fp)
+  np.savez(f'{fpath}.npz', **arrays)
+
+
+def load_exported(fpath):
+  '''Loads a model exported by export_model
+
+  Args:
+    fpath (str): File path without extension, that was passed to export_model
+
+  Returns:
+    ExportedModel in eval mode
+
+  Raises:
+    ValueError: If the export is of an unsupported version
+  '''
+  with open(f'{fpath}.json') as fp:
+    topology = json.load(fp)
+  if topology['version']!=EXPORT_FORMAT_VERSION:
+    raise ValueError(f"Unsupported export version {topology['version']}")
+  with np.load(f'{fpath}.npz') as arrays:
+    layers = {attr: build_layer(spec, attr, arrays) for attr, spec in topology['layers'].items()}
+  return ExportedModel(layers)
+
+
+class ExportedModel(Model):
+  '''Inference only Model rebuilt from an export
+
+  Its Sequential is run without tracking, always in eval mode and none of its Params
+  require grad
+  '''
+  def __init__(self, layers):
+    '''
+    Args:
+      layers (dict): Dict of the attribute to the Sequential
+    '''
+    for attr, layer in layers.items():
+      setattr(self, attr, layer)
+    self.set_eval(True)
+
+  def set_eval(self, eval):
+    '''Keeps the layers in eval mode, whatever eval is
+    '''
+    super().set_eval(True)
+
+  def forward(self, inputs):
+    '''Forward pass of ExportedModel
+
+    Args:
+      inputs (Tensor or np.ndarray): Inputs to the model
+
+    Returns:
+      Tensor of the result
+    '''
+    sequential, = self.get_layers().values()
+    with no_track():
+      return sequential(inputs)
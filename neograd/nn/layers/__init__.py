@@ -1,5 +1,7 @@
-from copy import deepcopy
+import numpy as np
+import copyreg
 from ...autograd.tensor import Tensor
+from ...autograd.utils import process_data
 
 
 class Container:
@@ -157,21 +159,6 @@ class Layer:
     for param in self.parameters(as_dict=False):
       param.unfreeze()
   
-  def __getstate__(self):
-    '''Returns the state for the object that is to be pickled
-
-    The instances of Param data are set to 0, to prevent saving of all the params
-    in the Layer.
-    If required, then the weights can be saved and loaded separately
-
-    Returns:
-      state of the current Layer
-    '''
-    state = deepcopy(self.__dict__)
-    for param_attr in self.parameters(as_dict=True).keys():
-      state[param_attr].data = 0 # Wanted to set it to None, but it isnt supported by Tensor, so set it to the next best 0
-    return state
-  
   def __setattr__(self, attr, val):
     '''Sets attributes for the Layer
 
@@ -199,7 +186,10 @@ class Param(Tensor):
   Parameters:
     __frozen (bool): Whether current Param is frozen or not. This is required because we
       need to know if it has been frozen before unfreeze is called
+    _flat_grad (None or np.ndarray): View into the flat grad buffer if the Param has been
+      flattened by Model.flatten_parameters, else None
   '''
+  _flat_grad = None
 
   def __init__(self, data, requires_grad=False, requires_broadcasting=True):
     super().__init__(data, requires_grad, requires_broadcasting)
@@ -207,9 +197,13 @@ class Param(Tensor):
   
   def freeze(self):
     '''Sets requires_grad=False
+
+    Only a Param that requires grad is marked as frozen, so that unfreeze doesn't make
+    Params that never required grad, like the running statistics of BatchNorm, trainable
     '''
+    if self.requires_grad:
+      self.__frozen = True
     self.requires_grad = False
-    self.__frozen = True
   
   def unfreeze(self):
     '''Sets requires_grad=True only if its frozen
@@ -222,6 +216,133 @@ class Param(Tensor):
       self.requires_grad = True
     self.__frozen = False
   
+  def flatten(self, data_buffer, grad_buffer):
+    '''Makes data and grad views into slices of flat buffers
+
+    The current data and grad are copied into the buffers
+
+    Args:
+      data_buffer (np.ndarray): 1D slice of the flat data buffer, of size of data
+      grad_buffer (np.ndarray): 1D slice of the flat grad buffer, of size of data
+    '''
+    data_buffer[:] = self.data.ravel()
+    grad_buffer[:] = np.ravel(self.grad) if self.grad is not None else 0
+    grad = self.grad
+    self._data = data_buffer.reshape(self.shape)
+    self._flat_grad = grad_buffer.reshape(self.shape)
+    self._grad = None if grad is None else self._flat_grad
+  
+  def __reduce_ex__(self, protocol):
+    '''Pickles the Param without copying its data
+
+    Only data, requires_grad, requires_broadcasting and whether it's frozen are pickled,
+    grad is reset and the Param is unpickled without passing data through process_data,
+    so this works with any protocol. With protocol 5, available from Python 3.8, NumPy
+    pickles data as a PickleBuffer, which is written straight from the array, or kept out
+    of band if pickle is given a buffer_callback, in which case the unpickled data is a
+    view of the buffers passed to pickle.loads, with older protocols data is copied
+
+    Args:
+      protocol (int): Pickle protocol
+
+    Returns:
+      tuple to reconstruct the Param with
+    '''
+    state = {'_data': np.asarray(self.data), 'requires_grad': self.requires_grad, 'requires_broadcasting': self.requires_broadcasting,
+      '_grad': 0. if self.requires_grad else None, 'grad_fn': None, '_Param__frozen': self.__frozen}
+    return (copyreg.__newobj__, (type(self),), state)
+  
+  def save(self, fpath):
+    '''Saves the data as a .npy file, whose header is padded so that the data is aligned
+
+    Args:
+      fpath (str): File path
+    '''
+    np.save(fpath, self.data)
+  
+  def load(self, fpath, mmap=False):
+    '''Loads the data from a .npy file saved by save
+
+    If mmap, then data becomes a read only memory map of the file, which is read lazily
+    and shared through the page cache by all the processes mapping it, detaching the Param
+    from the flat buffers. Else if the shape and dtype match, then the file is read straight
+    into the current data, without any intermediate copies, else it's read and set as data
+
+    Args:
+      fpath (str): File path
+      mmap (bool): Whether to memory map the file. Defaults to False
+    
+    Raises:
+      ValueError: If the file is truncated, in which case the data read into in place
+        is partly overwritten
+    '''
+    if mmap:
+      self._data = np.load(fpath, mmap_mode='r')
+      self._flat_grad = None
+      return
+    with open(fpath, 'rb') as fp:
+      read_header = {(1,0): np.lib.format.read_array_header_1_0, (2,0): np.lib.format.read_array_header_2_0}.get(np.lib.format.read_magic(fp))
+      if read_header is not None:
+        shape, fortran_order, dtype = read_header(fp)
+        if (shape==self.shape) and (dtype==self.data.dtype) and not(fortran_order) and self.data.flags.c_contiguous and self.data.flags.writeable:
+          num_read = fp.readinto(memoryview(self.data).cast('B'))
+          if num_read!=self.data.nbytes:
+            raise ValueError(f"{fpath} is truncated, read {num_read} of {self.data.nbytes} bytes")
+          return
+    self.data = np.load(fpath)
+  
+  @property
+  def data(self):
+    '''Returns the data present in the Param
+
+    Returns:
+      data (np.ndarray): Data in the Param
+    '''
+    return self._data
+  
+  @data.setter
+  def data(self, data):
+    '''Sets the data to the Param
+
+    If the Param is flattened, then data of the same shape is copied into the flat buffer,
+    data of a different shape detaches the Param from the flat buffers
+
+    Args:
+      data (int or float or list or np.ndarray): Data to be set
+    '''
+    if self._flat_grad is None:
+      self._data = process_data(data)
+    elif data is not self._data: # in place operations like param.data-=x set the same view back
+      data = process_data(data)
+      if data.shape==self.shape:
+        self._data[...] = data
+      else:
+        self._data = data
+        self._flat_grad = None
+  
+  @property
+  def grad(self):
+    '''Returns the grad of the Param
+
+    Returns:
+      grad (None or float or np.ndarray): grad of the Param
+    '''
+    return self._grad
+  
+  @grad.setter
+  def grad(self, grad):
+    '''Sets the grad of the Param
+
+    If the Param is flattened, then grad is copied into the flat buffer
+
+    Args:
+      grad (None or float or np.ndarray): grad to be set
+    '''
+    if (self._flat_grad is not None) and (grad is not None) and (grad is not self._flat_grad):
+      self._flat_grad[...] = grad
+      grad = self._flat_grad
+    self._grad = grad
+  
   def __str__(self):
     return f'Param({super().__str__()})'
   
@@ -230,5 +351,7 @@ class Param(Tensor):
 
 
 # these imports should be done after defining Layer, Container, Param to avoid circular import
-from .misc import Sequential, Linear, Dropout
-from .conv import Conv2D, Conv3D, MaxPool2D, MaxPool3D
\ No newline at end of file
+from .misc import Sequential, Linear, Flatten, Dropout, ActivationCheckpoint, BatchNorm
+from .conv import Conv2D, Conv3D, MaxPool2D, MaxPool3D
+from .fused import FusedLinear, FusedConv
+from .quantize import Quantizable
\ No newline at end of file
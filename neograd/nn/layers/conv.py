@@ -1,11 +1,15 @@
 import numpy as np
 from ..layers import Layer, Param
 from ...autograd.ops import conv2d, conv3d, maxpool2d, maxpool3d
+from ...autograd.ops import conv as conv_ops
+from .quantize import Quantizable
 
 
-class Conv2D(Layer):
+class Conv2D(Quantizable, Layer):
   '''Implements Conv2D
 
+  Can be quantized to int8 weights with a single scale, since there's only one kernel
+
   Parameters:
     padding (int): Padding value to be applied. Defaults to 0
     stride (int): Stride to be taken. Defaults to 1
@@ -38,16 +42,36 @@ class Conv2D(Layer):
     '''
     return conv2d(inputs, self.weights, self.bias, self.padding, self.stride)
   
+  def get_channel_axes(self):
+    '''Returns both the axes of the kernel
+    '''
+    return (0,1)
+  
+  def quantized_forward(self, quantized_inputs):
+    '''Forward pass on the int8 inputs and kernel
+
+    Args:
+      quantized_inputs (np.ndarray): Array of the int8 inputs, of accumulation_dtype
+    
+    Returns:
+      np.ndarray of the result
+    '''
+    conv_op = conv_ops.Conv2D(self.padding, self.stride)
+    outputs = conv_op.forward(quantized_inputs, self.quantized_weights.astype(self.accumulation_dtype), 0).data
+    return outputs*(self.inputs_scale*self.weights_scale) + self.bias.data
+  
   def __repr__(self):
-    return f'Conv2D(kernel_shape={self.weights.shape}, padding={self.padding}, stride={self.stride})'
+    return f'Conv2D(kernel_shape={self.get_weights_shape()}, padding={self.padding}, stride={self.stride})'
   
   def __str__(self):
-    return f'Conv2D(kernel_shape={self.weights.shape}, padding={self.padding}, stride={self.stride})'
+    return f'Conv2D(kernel_shape={self.get_weights_shape()}, padding={self.padding}, stride={self.stride})'
 
 
-class Conv3D(Layer):
+class Conv3D(Quantizable, Layer):
   '''Implements Conv3D
 
+  Can be quantized to int8 weights with a scale per out channel
+
   Parameters:
     padding (int): Padding value to be applied. Defaults to 0
     stride (int): Stride to be taken. Defaults to 1
@@ -82,12 +106,31 @@ class Conv3D(Layer):
     '''
     return conv3d(inputs, self.weights, self.bias, self.padding, self.stride)
   
+  def get_channel_axes(self):
+    '''Returns the axes of in_channels and the kernel, since each out channel has a kernel
+    '''
+    return (1,2,3)
+  
+  def quantized_forward(self, quantized_inputs):
+    '''Forward pass on the int8 inputs and kernels
+
+    Args:
+      quantized_inputs (np.ndarray): Array of the int8 inputs, of accumulation_dtype
+    
+    Returns:
+      np.ndarray of the result
+    '''
+    conv_op = conv_ops.Conv3D(self.padding, self.stride)
+    outputs = conv_op.forward(quantized_inputs, self.quantized_weights.astype(self.accumulation_dtype), 0).data
+    scale = self.inputs_scale*self.weights_scale.reshape(-1,1,1)
+    return outputs*scale + self.bias.data.reshape(-1,1,1)
+  
   def __repr__(self):
-    kernel_shape = self.weights.shape
+    kernel_shape = self.get_weights_shape()
     return f'Conv3D(out_channels={kernel_shape[0]}, in_channels={kernel_shape[1]}, kernel_shape={kernel_shape[2:]}, padding={self.padding}, stride={self.stride})'
   
   def __str__(self):
-    kernel_shape = self.weights.shape
+    kernel_shape = self.get_weights_shape()
     return f'Conv3D(out_channels={kernel_shape[0]}, in_channels={kernel_shape[1]}, kernel_shape={kernel_shape[2:]}, padding={self.padding}, stride={self.stride})'
 
 
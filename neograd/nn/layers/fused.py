@@ -0,0 +1,231 @@
+import numpy as np
+from ..layers import Layer
+from .misc import Linear
+from .conv import Conv2D, Conv3D, MaxPool2D, MaxPool3D
+from ..activations import ReLU, LeakyReLU, Sigmoid, Tanh
+from ...autograd.ops import conv as conv_ops
+from ...autograd.ops.operation import Operation, Context
+
+
+FUSABLE_ACTIVATIONS = (ReLU, LeakyReLU, Sigmoid, Tanh)
+
+
+class FusedLinear(Layer, Operation):
+  '''Linear followed by an activation as a single Operation
+
+  Instead of a dot, an add and an activation each adding a node to the graph and keeping
+  its result alive, only one node is added and only what the activation needs for its
+  gradient is saved, which is a bool mask for ReLU and LeakyReLU. While linear is
+  calibrating or runs quantized, it's run unfused
+
+  Parameters:
+    linear (Linear): Linear whose Params are used
+    activation (ReLU or LeakyReLU or Sigmoid or Tanh): Activation applied to its outputs
+  '''
+  def __init__(self, linear, activation):
+    '''
+    Args:
+      linear (Linear): Linear whose Params are used
+      activation (ReLU or LeakyReLU or Sigmoid or Tanh): Activation applied to its outputs
+    '''
+    Layer.__init__(self)
+    self.linear = linear
+    self.activation = activation
+
+  def forward(self, inputs):
+    '''Forward pass of FusedLinear
+
+    Args:
+      inputs (Tensor): Inputs to the Layer
+
+    Returns:
+      Tensor of the result
+    '''
+    if self.linear.calibrating or self.linear.runs_quantized():
+      return self.activation(self.linear(inputs))
+    inputs, weights, bias = self.get_tensors(inputs, self.linear.weights, self.linear.bias)
+    outputs = np.dot(self.get_data(inputs), self.get_data(weights)) + self.get_data(bias)
+    result, saved = self.activation.activate(outputs)
+    return self.get_result_tensor(result, inputs, weights, bias, ctx=Context(saved=saved, ug=None, outputs_grad=None))
+
+  def backward(self, inputs, weights, bias, ctx):
+    '''Sets the grad_fn of inputs, weights and bias
+
+    The gradient of the outputs of the Linear is calculated once per upper gradient
+    and shared by the grad_fn of all the operands that require grad
+
+    Args:
+      inputs (Tensor): Inputs to the Layer
+      weights (Param): Weights of the Linear
+      bias (Param): Bias of the Linear
+      ctx (Context): Context with what the activation saved during forward
+    '''
+    inputs_data, weights_data = self.get_data(inputs), self.get_data(weights)
+    if self.operand_requires_grad(inputs):
+      inputs.set_grad_fn(lambda ug:np.dot(self.calc_outputs_grad(ug, ctx), weights_data.T))
+    if self.operand_requires_grad(weights):
+      weights.set_grad_fn(lambda ug:np.dot(inputs_data.T, self.calc_outputs_grad(ug, ctx)))
+    if self.operand_requires_grad(bias):
+      bias.set_grad_fn(lambda ug:np.sum(self.calc_outputs_grad(ug, ctx), axis=0, keepdims=True))
+
+  def calc_outputs_grad(self, ug, ctx):
+    '''Calculates the gradient of the outputs of the Linear, before the activation
+
+    Args:
+      ug (np.ndarray): Upper gradient
+      ctx (Context): Context with what the activation saved during forward
+
+    Returns:
+      gradient of the outputs of the Linear
+    '''
+    if ctx.ug is not ug:
+      ctx.ug, ctx.outputs_grad = ug, self.activation.calc_grad(ctx.saved, ug)
+    return ctx.outputs_grad
+
+  def get_broadcast_shape(self, *tensors):
+    '''Returns None, because the gradients are already of the shape of the operands
+    '''
+    return None
+
+  def __repr__(self):
+    return f'FusedLinear({self.linear.__repr__()}, {self.activation.__repr__()})'
+
+  def __str__(self):
+    return f'FusedLinear({self.linear.__str__()}, {self.activation.__str__()})'
+
+
+class FusedConv(Layer, Operation):
+  '''Conv2D/Conv3D followed by an activation and optionally a MaxPool as a single Operation
+
+  Since all the fusable activations are monotonically increasing, max pooling the convolved
+  outputs and then activating them gives the same result as activating and then max pooling,
+  so the activation is applied on the smaller pooled outputs. Only the argmax indices and
+  what the activation needs for its gradient are saved, the convolved outputs aren't kept.
+  While conv is calibrating or runs quantized, it's run unfused
+
+  Parameters:
+    conv (Conv2D or Conv3D): Convolution whose Params are used
+    activation (ReLU or LeakyReLU or Sigmoid or Tanh): Activation applied to its outputs
+    pool (None or MaxPool2D or MaxPool3D): Pooling applied to its outputs
+  '''
+  def __init__(self, conv, activation, pool=None):
+    '''
+    Args:
+      conv (Conv2D or Conv3D): Convolution whose Params are used
+      activation (ReLU or LeakyReLU or Sigmoid or Tanh): Activation applied to its outputs
+      pool (None or MaxPool2D or MaxPool3D): Pooling applied to its outputs. Defaults to None
+    '''
+    Layer.__init__(self)
+    self.conv = conv
+    self.activation = activation
+    self.pool = pool
+
+  def forward(self, inputs):
+    '''Forward pass of FusedConv
+
+    Args:
+      inputs (Tensor): Inputs to the Layer
+
+    Returns:
+      Tensor of the result
+    '''
+    if self.conv.calibrating or self.conv.runs_quantized():
+      outputs = self.activation(self.conv(inputs))
+      return outputs if self.pool is None else self.pool(outputs)
+    inputs, weights, bias = self.get_tensors(inputs, self.conv.weights, self.conv.bias)
+    outputs = self.get_conv_op().forward(self.get_data(inputs), self.get_data(weights), self.get_data(bias)).data
+    outputs_shape, indices = outputs.shape, None
+    if self.pool is not None:
+      outputs, indices = self.get_pool_op().pool(outputs)
+    result, saved = self.activation.activate(outputs)
+    ctx = Context(saved=saved, indices=indices, outputs_shape=outputs_shape, ug=None, outputs_grad=None)
+    return self.get_result_tensor(result, inputs, weights, bias, ctx=ctx)
+
+  def backward(self, inputs, weights, bias, ctx):
+    '''Sets the grad_fn of inputs, weights and bias
+
+    The grad_fn set by the backward of the convolution Operation are wrapped, so that
+    they receive the gradient of the convolved outputs instead of the upper gradient
+
+    Args:
+      inputs (Tensor): Inputs to the Layer
+      weights (Param): Weights of the convolution
+      bias (Param): Bias of the convolution
+      ctx (Context): Context with the argmax indices and what the activation saved during forward
+    '''
+    self.get_conv_op().backward(inputs, weights, bias)
+    def get_grad_fn(conv_grad_fn):
+      return lambda ug:conv_grad_fn(self.calc_outputs_grad(ug, ctx))
+    for operand in (inputs, weights, bias):
+      if self.operand_requires_grad(operand):
+        operand.set_grad_fn(get_grad_fn(operand.grad_fn))
+
+  def calc_outputs_grad(self, ug, ctx):
+    '''Calculates the gradient of the convolved outputs
+
+    Args:
+      ug (np.ndarray): Upper gradient
+      ctx (Context): Context with the argmax indices and what the activation saved during forward
+
+    Returns:
+      gradient of the convolved outputs
+    '''
+    if ctx.ug is not ug:
+      outputs_grad = self.activation.calc_grad(ctx.saved, ug)
+      if self.pool is not None:
+        outputs_grad = self.get_pool_op().unpool(outputs_grad, ctx.indices, ctx.outputs_shape)
+      ctx.ug, ctx.outputs_grad = ug, outputs_grad
+    return ctx.outputs_grad
+
+  def get_conv_op(self):
+    '''Returns the convolution Operation of conv
+    '''
+    conv_op = conv_ops.Conv2D if isinstance(self.conv, Conv2D) else conv_ops.Conv3D
+    return conv_op(self.conv.padding, self.conv.stride)
+
+  def get_pool_op(self):
+    '''Returns the pooling Operation of pool
+    '''
+    pool_op = conv_ops.MaxPool2D if isinstance(self.pool, MaxPool2D) else conv_ops.MaxPool3D
+    return pool_op(self.pool.kernel_shape, self.pool.padding, self.pool.stride)
+
+  def __repr__(self):
+    return f'FusedConv({self.conv.__repr__()}, {self.activation.__repr__()}, {self.pool.__repr__()})'
+
+  def __str__(self):
+    return f'FusedConv({self.conv.__str__()}, {self.activation.__str__()}, {self.pool.__str__()})'
+
+
+def fuse_layers(layers):
+  '''Replaces the known patterns of adjacent layers by fused Layers
+
+  The patterns are Linear -> activation, Conv2D -> activation -> MaxPool2D,
+  Conv3D -> activation -> MaxPool3D and Conv2D/Conv3D -> activation, where activation
+  is ReLU, LeakyReLU, Sigmoid or Tanh. The fused Layers share the Params of the
+  original layers
+
+  Args:
+    layers (tuple of Layer/Container): Layers to be fused
+
+  Returns:
+    tuple of Layer/Container with the patterns replaced
+  '''
+  fused_layers = []
+  i = 0
+  while i<len(layers):
+    layer, following = layers[i], layers[i+1:i+3]
+    if len(following)==0 or not(isinstance(following[0], FUSABLE_ACTIVATIONS)):
+      fused_layers.append(layer)
+      i+=1
+    elif isinstance(layer, Linear):
+      fused_layers.append(FusedLinear(layer, following[0]))
+      i+=2
+    elif isinstance(layer, (Conv2D, Conv3D)):
+      pool_type = MaxPool2D if isinstance(layer, Conv2D) else MaxPool3D
+      pool = following[1] if len(following)==2 and type(following[1])==pool_type else None
+      fused_layers.append(FusedConv(layer, following[0], pool))
+      i+=2 if pool is None else 3
+    else:
+      fused_layers.append(layer)
+      i+=1
+  return tuple(fused_layers)
@@ -1,17 +1,65 @@
 import numpy as np
 from ..layers import Container, Layer, Param
-from ...autograd import dot
-from ...autograd.ops.operation import Operation
+from ...autograd import dot, reshape
+from ...autograd.tensor import Tensor
+from ...autograd.ops.operation import Operation, Context
+from ...autograd.utils import get_graph, new_graph, no_track
+from .quantize import Quantizable
 
 
 class Sequential(Container):
   '''Sequential Container
   
   Outputs of one layer are passed as inputs to the next layer, sequentially
+
+  Parameters:
+    checkpoint_every (None or int): If not None, then every checkpoint_every consecutive
+      layers are run as an ActivationCheckpoint segment. Defaults to None
+    fused (bool): Whether known patterns of adjacent layers are run as fused Layers
+    segments (tuple of Layer/Container): What forward is run on, the layers themselves
+      or their fused Layers or ActivationCheckpoint segments
   '''
   
-  def __init__(self, *args):
+  def __init__(self, *args, checkpoint_every=None):
+    '''
+    Raises:
+      ValueError: If checkpoint_every isn't None and is less than 1
+    '''
+    if checkpoint_every is not None and checkpoint_every<1:
+      raise ValueError("checkpoint_every must be greater than or equal to 1")
     self.layers = args
+    self.checkpoint_every = checkpoint_every
+    self.fused = False
+    self.segments = self.get_segments()
+  
+  def fuse(self):
+    '''Runs known patterns of adjacent layers as fused Layers
+
+    Linear -> activation and Conv2D/Conv3D -> activation -> MaxPool2D/MaxPool3D are
+    replaced by a single Operation each, so that fewer nodes are added to the graph
+    and fewer intermediate results are kept alive. layers aren't modified, the fused
+    Layers share their Params, so parameters, save and load work as before
+
+    Returns:
+      The Sequential itself
+    '''
+    self.fused = True
+    self.segments = self.get_segments()
+    return self
+  
+  def get_segments(self):
+    '''Builds the segments from the layers
+
+    Returns:
+      tuple of Layer/Container that forward is run on
+    '''
+    if self.checkpoint_every is not None:
+      chunks = (Sequential(*self.layers[i:i+self.checkpoint_every]) for i in range(0, len(self.layers), self.checkpoint_every))
+      return tuple(ActivationCheckpoint(chunk.fuse() if self.fused else chunk) for chunk in chunks)
+    if self.fused:
+      from .fused import fuse_layers
+      return fuse_layers(self.layers)
+    return self.layers
   
   def forward(self, inputs):
     '''Forward pass of Sequential
@@ -22,7 +70,7 @@ class Sequential(Container):
     Returns:
       Tensor of the result
     '''
-    for layer in self.layers:
+    for layer in self.segments:
       output = layer(inputs)
       inputs = output
     return output
@@ -34,9 +82,150 @@ class Sequential(Container):
     return f'Sequential(\n{super().__repr__()}\n)'
 
 
-class Linear(Layer):
+class ActivationCheckpoint(Container, Operation):
+  '''Runs a segment without keeping its intermediate activations alive
+
+  During forward, the segment is run without tracking and only its inputs are kept.
+  During backward, the segment is run again under a new graph to calculate the gradients
+  of its inputs and params, trading extra compute for memory
+
+  The state of the Layers in the segment is restored before running it again, so
+  that layers like Dropout produce the same result as in forward, and restored to the
+  state after forward once it's run, so that the Params that don't require grad, like
+  the running statistics of BatchNorm, are updated only once
+
+  Parameters:
+    segment (Layer or Container): Segment to be checkpointed
+  '''
+  def __init__(self, segment):
+    '''
+    Args:
+      segment (Layer or Container): Segment to be checkpointed
+    '''
+    Container.__init__(self)
+    self.segment = segment
+    self.layers = (segment,)
+  
+  def forward(self, inputs):
+    '''Forward pass of ActivationCheckpoint
+
+    If tracking is disabled, then the segment is run as is
+
+    Args:
+      inputs (Tensor): Inputs to the segment
+    
+    Returns:
+      Tensor of the result
+    '''
+    if not(get_graph().track):
+      return self.segment(inputs)
+    inputs = self.get_tensors(inputs)
+    params = [param for param in self.segment.parameters() if param.requires_grad]
+    ctx = Context(states=self.get_states(), grads=None)
+    with no_track():
+      outputs = self.segment(inputs)
+    return self.get_result_tensor(outputs.data, inputs, *params, ctx=ctx)
+  
+  def backward(self, inputs, *params, ctx):
+    '''Sets the grad_fn of inputs and params
+
+    All the gradients are calculated together by recompute_grads the first time
+    any of the grad_fn is called
+
+    Args:
+      inputs (Tensor): Inputs to the segment
+      *params (Param): Params of the segment that require grad
+      ctx (Context): Context with the states of the Layers before forward
+    '''
+    def get_grad_fn(i):
+      return lambda ug:self.recompute_grads(inputs, params, ug, ctx)[i]
+    if self.operand_requires_grad(inputs):
+      inputs.set_grad_fn(get_grad_fn(0))
+    for i, param in enumerate(params, 1):
+      param.set_grad_fn(get_grad_fn(i))
+  
+  def recompute_grads(self, inputs, params, ug, ctx):
+    '''Runs the segment again and backpropagates the upper gradient through it
+
+    The existing grads of params are set aside during the backward pass of the segment,
+    so that only the gradients of this segment are returned. The gradients are saved in
+    ctx so that the segment is run only once per backward pass
+
+    Args:
+      inputs (Tensor): Inputs to the segment
+      params (tuple of Param): Params of the segment that require grad
+      ug (np.ndarray): Upper gradient
+      ctx (Context): Context with the states of the Layers before forward
+    
+    Returns:
+      list of gradients of inputs followed by the params
+    '''
+    if ctx.grads is not None:
+      return ctx.grads
+    params_grads = [param.grad.copy() if isinstance(param.grad, np.ndarray) else param.grad for param in params] # grads of flattened Params are views that are zeroed in place
+    for param in params:
+      param.zero_grad()
+    with new_graph():
+      recomputed_inputs = Tensor(self.get_data(inputs), requires_grad=self.operand_requires_grad(inputs))
+      states = self.get_states()
+      self.set_states(ctx.states)
+      outputs = self.segment(recomputed_inputs)
+      self.set_states(states)
+      outputs.backward(ug)
+    inputs_grad = np.zeros(recomputed_inputs.shape)+recomputed_inputs.grad if recomputed_inputs.requires_grad else None
+    ctx.grads = [inputs_grad]
+    for param, param_grad in zip(params, params_grads):
+      ctx.grads.append(np.zeros(param.shape)+param.grad)
+      param.grad = param_grad
+    return ctx.grads
+  
+  def get_broadcast_shape(self, *tensors):
+    '''Returns None, as the gradients are calculated in the shape of each operand
+    '''
+    return None
+  
+  def get_states(self):
+    '''Gathers the states of all the Layers in the segment
+
+    Returns:
+      dict with Layers as keys and a shallow copy of their __dict__ along with a dict of
+      attribute to a copy of the data of their Params that don't require grad, which are
+      updated in forward, as values
+    '''
+    states = {}
+    layers = [self.segment]
+    while len(layers)!=0:
+      layer = layers.pop()
+      if isinstance(layer, Container):
+        layers+=layer.layers
+      else:
+        params_data = {attr: val.data.copy() for attr, val in layer.__dict__.items() if isinstance(val, Param) and not(val.requires_grad)}
+        states[layer] = (dict(layer.__dict__), params_data)
+    return states
+  
+  def set_states(self, states):
+    '''Sets the states of the Layers in the segment
+
+    Args:
+      states (dict): States returned by get_states
+    '''
+    for layer, (state, params_data) in states.items():
+      layer.__dict__.update(state)
+      for attr, data in params_data.items():
+        getattr(layer, attr).data = data.copy()
+  
+  def __repr__(self):
+    return f'ActivationCheckpoint({self.segment.__repr__()})'
+  
+  def __str__(self):
+    return f'ActivationCheckpoint({self.segment.__str__()})'
+
+
+class Linear(Quantizable, Layer):
   '''Implements a fully connected Layer
 
+  Can be quantized to int8 weights with a scale per output
+
   Parameters:
     num_in (int): Number of inputs to the Layer
     num_out (int): Number of outputs from the Layer
@@ -62,6 +251,23 @@ class Linear(Layer):
     '''
     return dot(inputs, self.weights) + self.bias
   
+  def get_channel_axes(self):
+    '''Returns the axis of num_in, since each output has a column of weights
+    '''
+    return (0,)
+  
+  def quantized_forward(self, quantized_inputs):
+    '''Forward pass on the int8 inputs and weights
+
+    Args:
+      quantized_inputs (np.ndarray): Array of the int8 inputs, of accumulation_dtype
+    
+    Returns:
+      np.ndarray of the result
+    '''
+    outputs = np.dot(quantized_inputs, self.quantized_weights.astype(self.accumulation_dtype))
+    return outputs*(self.inputs_scale*self.weights_scale) + self.bias.data
+  
   def __repr__(self):
     return f'Linear({self.num_in}, {self.num_out})'
   
@@ -69,26 +275,65 @@ class Linear(Layer):
     return f'Linear in:{self.num_in} out:{self.num_out}'
 
 
+class Flatten(Layer):
+  '''Flattens all the axes of the inputs but the first, which is the batch axis
+
+  Lets a Model that reshapes the outputs of convolutions before a Linear be written
+  as a single Sequential
+  '''
+  def forward(self, inputs):
+    '''Forward pass of Flatten
+
+    Args:
+      inputs (Tensor): Inputs to the Layer
+    
+    Returns:
+      Tensor of shape (batch size, product of the other axes)
+    '''
+    return reshape(inputs, (inputs.shape[0], -1))
+  
+  def __repr__(self):
+    return 'Flatten()'
+  
+  def __str__(self):
+    return 'Flatten'
+
+
 class Dropout(Layer, Operation):
   '''Dropout Layer
   
   https://youtu.be/D8PJAL-MZv8
+
+  The mask is drawn as float32 from a counter based Philox generator that is private to the
+  Layer. Only the counter of a forward pass is saved for backward, from which the mask is
+  regenerated, so the mask is never stored or added to the graph
   
   Parameters:
     prob (float): Probability with which to keep the inputs
       With probability=prob, the units are kept and with probability=1-prob,
       they are shut off
+    key (np.ndarray): Key of the Philox generator, derived from the seed
+    counter (int): Number of masks that have been drawn, each forward pass when not in
+      eval mode draws a new mask
   '''
-  def __init__(self, prob):
+  def __init__(self, prob, seed=None):
+    '''
+    Args:
+      prob (float): Probability with which to keep the inputs
+      seed (None or int): Seed from which the key of the generator is derived. Defaults
+        to None, meaning fresh entropy is used
+    '''
     Layer.__init__(self)
     assert prob>0 and prob<=1, 'Probability should be between 0 and 1'
     self.prob = prob
+    self.key = np.random.SeedSequence(seed).generate_state(2, np.uint64)
+    self.counter = 0
   
   def forward(self, inputs):
     '''Forward pass of Dropout
 
-    The inputs are turned on with the given prob
-    If in eval mode, then all inputs are always on
+    The inputs are turned on with the given prob and scaled by it
+    If in eval mode, then all inputs are always on and aren't scaled
 
     Args:
       inputs (Tensor): Inputs to the Layer
@@ -96,33 +341,179 @@ class Dropout(Layer, Operation):
     Returns:
       Tensor of the result
     '''
+    inputs = self.get_tensors(inputs)
+    data = self.get_data(inputs)
     if self.eval:
-      filter = np.ones(inputs.shape) # dont discard anything, just dummy because if eval or not, backward needs to have filter arg
+      return self.get_result_tensor(data, inputs, ctx=Context(counter=None))
+    ctx = Context(counter=self.counter)
+    self.counter+=1
+    mask = self.generate_mask(ctx.counter, np.shape(data))
+    return self.get_result_tensor((data*mask)/self.prob, inputs, ctx=ctx)
+  
+  def backward(self, inputs, ctx):
+    '''Sets the grad_fn of inputs
+
+    Regenerates the mask that was applied during forward pass, multiplies the upper
+    gradient with it and scales it by the probability. If it was in eval mode during
+    forward, then the upper gradient is passed as is
+
+    Args:
+      inputs (Tensor): Inputs to the Layer
+      ctx (Context): Context with the counter of the forward pass
+    '''
+    if ctx.counter is None:
+      inputs.set_grad_fn(lambda ug:ug)
     else:
-      filter = np.where(np.random.random(inputs.shape)<self.prob, 1, 0)
-    inputs, filter = self.get_tensors(inputs, filter)
-    if not(self.eval): # Deliberately repeated condition check for eval, because if in eval, it shouldnt be scaled by prob
-      result = (inputs.data*filter.data)/self.prob
+      def dropout_backward(ug):
+        mask = self.generate_mask(ctx.counter, inputs.shape)
+        return (ug*mask)/self.prob
+      inputs.set_grad_fn(dropout_backward)
+  
+  def generate_mask(self, counter, shape):
+    '''Generates the dropout mask
+
+    Philox is counter based, so the mask of any forward pass can be regenerated from
+    the key and the counter of that pass. The counter of the generator is offset by
+    2^128 for each pass, so that the masks of different passes never overlap
+
+    Args:
+      counter (int): Counter of the forward pass
+      shape (tuple): Shape of the mask
+    
+    Returns:
+      bool mask
+    '''
+    generator = np.random.Generator(np.random.Philox(key=self.key, counter=counter*(2**128)))
+    return generator.random(shape, dtype=np.float32)<self.prob
+  
+  def __repr__(self):
+    return f'Dropout(prob={self.prob})'
+  
+  def __str__(self):
+    return f'Dropout(prob={self.prob})'
+
+
+
+class BatchNorm(Layer, Operation):
+  '''Batch Normalization Layer
+
+  https://youtu.be/tNIpEZLv_eg
+
+  Features are along axis 1, statistics are calculated over all the other axes, so it
+  works with both (num_examples, num_features) and (num_examples, num_channels, x_dim, y_dim)
+  inputs. The variance is calculated from the inputs centered by the mean, which are also
+  normalized, since E[x^2]-E[x]^2 loses precision when the mean is large compared to the
+  standard deviation. The backward is closed form, so only one Node is created in the graph
+
+  In eval mode, the running statistics are used instead of the batch statistics
+
+  Parameters:
+    num_features (int): Number of features/channels of the inputs
+    momentum (float): Momentum with which the running statistics are updated
+    epsilon (float): For numerical stability of the division
+    weights (Param): Scale of the normalized inputs
+    bias (Param): Shift of the normalized inputs
+    running_mean (Param): Running mean, doesn't require grad
+    running_var (Param): Running variance, doesn't require grad
+  '''
+  def __init__(self, num_features, momentum=0.9, epsilon=1e-5):
+    '''
+    Args:
+      num_features (int): Number of features/channels of the inputs
+      momentum (float): Momentum with which the running statistics are updated
+        Defaults to 0.9
+      epsilon (float): For numerical stability of the division Defaults to 1e-5
+    '''
+    Layer.__init__(self)
+    self.num_features = num_features
+    self.momentum = momentum
+    self.epsilon = epsilon
+    self.weights = Param(np.ones(num_features), requires_grad=True, requires_broadcasting=False)
+    self.bias = Param(np.zeros(num_features), requires_grad=True, requires_broadcasting=False)
+    self.running_mean = Param(np.zeros(num_features), requires_grad=False)
+    self.running_var = Param(np.ones(num_features), requires_grad=False)
+  
+  def forward(self, inputs):
+    '''Forward pass of BatchNorm
+
+    When not in eval mode, the running statistics are updated with the batch statistics
+
+    Args:
+      inputs (Tensor): Inputs to the Layer
+    
+    Returns:
+      Tensor of the result
+    '''
+    inputs = self.get_tensors(inputs)
+    data = self.get_data(inputs)
+    axes, shape = self.get_axes_and_shape(data)
+    if self.eval:
+      mean, var = self.running_mean.data, self.running_var.data
+      centered = data-mean.reshape(shape)
     else:
-      result = inputs.data
-    return self.get_result_tensor(inputs.data, inputs, filter)
+      mean = np.mean(data, axis=axes)
+      centered = data-mean.reshape(shape)
+      var = np.mean(np.square(centered), axis=axes)
+      self.running_mean.data = (self.momentum*self.running_mean.data) + ((1-self.momentum)*mean)
+      self.running_var.data = (self.momentum*self.running_var.data) + ((1-self.momentum)*var)
+    inv_std = 1/np.sqrt(var+self.epsilon)
+    normalized = centered*inv_std.reshape(shape)
+    result = (normalized*self.weights.data.reshape(shape)) + self.bias.data.reshape(shape)
+    ctx = Context(normalized=normalized, inv_std=inv_std, eval=self.eval)
+    return self.get_result_tensor(result, inputs, self.weights, self.bias, ctx=ctx)
   
-  def backward(self, inputs, filter):
-    '''Sets the grad_fn of inputs only because filter doesnt have requires_grad=True
+  def backward(self, inputs, weights, bias, ctx):
+    '''Sets the grad_fn of inputs, weights and bias
 
-    Just multiplies the upper gradient with the filter set during forward pass and scales
-    it by the probability
+    If batch statistics were used, then the gradient of inputs also flows through
+    the mean and variance, if running statistics were used then they are constants
 
     Args:
       inputs (Tensor): Inputs to the Layer
-      filter (Tensor): The dropout filter that was applied during forward pass
+      weights (Param): Scale of the normalized inputs
+      bias (Param): Shift of the normalized inputs
+      ctx (Context): Context with normalized inputs, inverse of standard deviation and
+        whether it was in eval mode during forward
     '''
-    if not(self.eval):
-      inputs.set_grad_fn(lambda ug:(ug*filter.data)/self.prob)
-    inputs.set_grad_fn(lambda ug:ug)
+    axes, shape = self.get_axes_and_shape(ctx.normalized)
+    num_reduced = ctx.normalized.size//self.num_features
+
+    def inputs_backward(ug):
+      normalized_grad = ug*weights.data.reshape(shape)
+      if ctx.eval:
+        return normalized_grad*ctx.inv_std.reshape(shape)
+      sum_grad = np.sum(normalized_grad, axis=axes).reshape(shape)
+      sum_normalized_grad = np.sum(normalized_grad*ctx.normalized, axis=axes).reshape(shape)
+      return (ctx.inv_std.reshape(shape)/num_reduced)*((num_reduced*normalized_grad) - sum_grad - (ctx.normalized*sum_normalized_grad))
+
+    if self.operand_requires_grad(inputs):
+      inputs.set_grad_fn(inputs_backward)
+    if self.operand_requires_grad(weights):
+      weights.set_grad_fn(lambda ug:np.sum(ug*ctx.normalized, axis=axes))
+    if self.operand_requires_grad(bias):
+      bias.set_grad_fn(lambda ug:np.sum(ug, axis=axes))
+  
+  def get_axes_and_shape(self, data):
+    '''Returns the axes over which statistics are calculated and the shape to which
+    statistics must be reshaped to be broadcasted with data
+
+    Args:
+      data (np.ndarray): Inputs data
+    
+    Returns:
+      tuple of axes, tuple of shape
+    
+    Raises:
+      ValueError: If axis 1 of data isn't num_features
+    '''
+    if len(data.shape)<2 or data.shape[1]!=self.num_features:
+      raise ValueError(f"Expected inputs with {self.num_features} features along axis 1, instead got shape {data.shape}")
+    axes = (0,)+tuple(range(2, len(data.shape)))
+    shape = (1, self.num_features)+((1,)*(len(data.shape)-2))
+    return axes, shape
   
   def __repr__(self):
-    return f'Dropout(prob={self.prob})'
+    return f'BatchNorm({self.num_features}, momentum={self.momentum}, epsilon={self.epsilon})'
   
   def __str__(self):
-    return f'Dropout(prob={self.prob})'
\ No newline at end of file
+    return f'BatchNorm features:{self.num_features}'
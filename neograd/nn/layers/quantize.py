@@ -0,0 +1,144 @@
+import numpy as np
+from ...autograd.tensor import Tensor
+
+
+INT8_MAX = np.iinfo(np.int8).max
+
+FLOAT32_EXACT_MAX = 2**24
+
+
+class Quantizable:
+  '''Mixin for Layers whose weights can be quantized to int8 for inference
+
+  While calibrating, the largest absolute value of the inputs is recorded, from which
+  the scale of the inputs is set. quantize then rounds the weights to int8 with one
+  scale per output channel. In eval mode a quantized Layer rounds its inputs to int8
+  too and runs quantized_forward on the integers, whose results are rescaled by the
+  product of the scales. The integers are multiplied as floats, which unlike the integer
+  dot of numpy runs on BLAS. float32 accumulates them exactly only as long as the sums
+  stay below 2**24, which holds for any inputs if 127**2 times the fan in of an output
+  is below it, so up to a fan in of 1040, above which float64 is used
+
+  If quantized for inference only, then the float weights Param is removed, so the
+  weights only take the int8 memory, and the quantized forward is always run
+
+  Parameters:
+    calibrating (bool): Whether the absmax of the inputs is being recorded
+    inputs_absmax (float): Largest absolute value of the inputs seen while calibrating
+    inputs_scale (None or float): Scale of the int8 inputs, None if not quantized
+    quantized_weights (None or np.ndarray): int8 weights, None if not quantized
+    weights_scale (None or np.ndarray): float32 scale of each output channel of the
+      weights, None if not quantized
+    accumulation_dtype (None or str): 'float32' or 'float64', the dtype the integers
+      are multiplied in, None if not quantized
+    inference_only (bool): Whether the float weights have been removed
+  '''
+  calibrating = False
+  inputs_absmax = 0.
+  inputs_scale = None
+  quantized_weights = None
+  weights_scale = None
+  accumulation_dtype = None
+  inference_only = False
+
+  def __call__(self, inputs):
+    '''Records the inputs while calibrating and runs quantized_forward in eval
+    mode if quantized, else calls the forward method
+
+    Args:
+      inputs (Tensor): Inputs to the Layer
+
+    Returns:
+      Tensor of the result
+    '''
+    if self.calibrating:
+      self.observe(inputs)
+    if self.runs_quantized():
+      return Tensor(self.quantized_forward(self.quantize_inputs(inputs)))
+    return self.forward(inputs)
+
+  def is_quantized(self):
+    '''Returns whether quantize has been called on the Layer
+    '''
+    return self.quantized_weights is not None
+
+  def runs_quantized(self):
+    '''Returns whether quantized_forward is run, which is in eval mode or if quantized
+    for inference only
+    '''
+    return self.is_quantized() and (self.eval or self.inference_only)
+
+  def observe(self, inputs):
+    '''Updates inputs_absmax with the inputs
+
+    Args:
+      inputs (Tensor or np.ndarray): Inputs to the Layer
+    '''
+    inputs_data = inputs.data if isinstance(inputs, Tensor) else np.asarray(inputs)
+    self.inputs_absmax = max(self.inputs_absmax, float(np.max(np.abs(inputs_data))))
+
+  def quantize(self, inference_only=False):
+    '''Quantizes the weights to int8 and sets the scale of the inputs from inputs_absmax
+
+    The scale of each output channel is its absmax divided by 127, channels that are
+    all 0 get a scale of 1
+
+    Args:
+      inference_only (bool): Whether the float weights are removed. Defaults to False
+    '''
+    weights_data = self.weights.data
+    channel_axes = self.get_channel_axes()
+    absmax = np.max(np.abs(weights_data), axis=channel_axes, keepdims=True)
+    weights_scale = np.where(absmax>0, absmax/INT8_MAX, 1).astype(np.float32)
+    self.quantized_weights = np.clip(np.rint(weights_data/weights_scale), -INT8_MAX, INT8_MAX).astype(np.int8)
+    self.weights_scale = weights_scale
+    self.inputs_scale = np.float32(self.inputs_absmax/INT8_MAX if self.inputs_absmax>0 else 1)
+    fan_in = int(np.prod([weights_data.shape[axis] for axis in channel_axes]))
+    self.accumulation_dtype = 'float32' if (INT8_MAX**2)*fan_in<FLOAT32_EXACT_MAX else 'float64'
+    if inference_only:
+      del self.weights
+      self.inference_only = True
+
+  def dequantize(self):
+    '''Removes the int8 weights, so that the Layer runs forward in eval mode again
+
+    Raises:
+      ValueError: If quantized for inference only, since the float weights are gone
+    '''
+    if self.inference_only:
+      raise ValueError(f"{type(self).__name__} was quantized for inference only, its float weights have been removed")
+    self.inputs_absmax = 0.
+    self.inputs_scale = self.quantized_weights = self.weights_scale = self.accumulation_dtype = None
+
+  def quantize_inputs(self, inputs):
+    '''Rounds the inputs to int8 values with inputs_scale
+
+    Args:
+      inputs (Tensor or np.ndarray): Inputs to the Layer
+
+    Returns:
+      np.ndarray of the rounded inputs, of accumulation_dtype
+    '''
+    inputs_data = inputs.data if isinstance(inputs, Tensor) else np.asarray(inputs)
+    return np.clip(np.rint(inputs_data/self.inputs_scale), -INT8_MAX, INT8_MAX).astype(self.accumulation_dtype)
+
+  def get_weights_shape(self):
+    '''Returns the shape of the weights, which are only int8 if quantized for inference only
+    '''
+    return self.quantized_weights.shape if self.inference_only else self.weights.shape
+
+  def get_channel_axes(self):
+    '''Returns the axes of the weights that are reduced to get the absmax of each output channel
+    '''
+    raise NotImplementedError(f"get_channel_axes method not implemented for {type(self)}")
+
+  def quantized_forward(self, quantized_inputs):
+    '''Forward pass on the int8 inputs and weights
+
+    Args:
+      quantized_inputs (np.ndarray): Array of the int8 inputs, of accumulation_dtype
+
+    Returns:
+      np.ndarray of the result
+    '''
+    raise NotImplementedError(f"quantized_forward method not implemented for {type(self)}")
@@ -1,6 +1,5 @@
 import numpy as np
-from ..autograd import sum as _sum, log
-from ..autograd.ops.operation import Operation
+from ..autograd.ops.operation import Operation, Context
 from .activations import Softmax
 
 
@@ -35,10 +34,37 @@ class Loss:
       return 1
     else:
       return outputs_shape[0] 
+  
+  def get_labels(self, outputs_data, targets_data, axis):
+    '''Returns the integer class labels if targets are labels instead of one-hot
+
+    Targets are labels if their shape is the shape of outputs without the class axis
+
+    Args:
+      outputs_data (np.ndarray): Data of the outputs
+      targets_data (np.ndarray): Data of the targets
+      axis (None or int or tuple of int): Class axis
+    
+    Returns:
+      Labels as int with the class axis added back with size 1, so that they can be used
+      with np.take_along_axis, None if targets are dense
+    
+    Raises:
+      ValueError: If targets are labels but axis isn't an int
+    '''
+    outputs_shape = np.shape(outputs_data)
+    if not(isinstance(axis, int)):
+      if np.ndim(targets_data)==len(outputs_shape)-1 and len(outputs_shape)>1:
+        raise ValueError(f"Integer class labels need an int axis, instead got {axis}")
+      return None
+    class_axis = axis%len(outputs_shape)
+    if np.shape(targets_data)!=(outputs_shape[:class_axis]+outputs_shape[class_axis+1:]):
+      return None
+    return np.expand_dims(np.asarray(targets_data).astype(np.intp), axis=class_axis)
 
 
 # <------------MEANSQUAREDERROR------------>
-class MSE(Loss):
+class MSE(Operation, Loss):
   '''Mean Squared Error
   '''
   def forward(self, outputs, targets):
@@ -51,9 +77,27 @@ class MSE(Loss):
     Returns:
       Tensor of the result
     '''
-    num_examples = self.get_num_examples(outputs.shape)
-    cost = (1/(2*num_examples))*_sum((outputs-targets)**2)
-    return cost
+    outputs, targets = self.get_tensors(outputs, targets)
+    num_examples = self.get_num_examples(np.shape(self.get_data(outputs)))
+    diff = self.get_data(outputs)-self.get_data(targets)
+    cost = np.sum(np.square(diff))/(2*num_examples)
+    return self.get_result_tensor(cost, outputs, targets, ctx=Context(diff=diff, num_examples=num_examples))
+  
+  def backward(self, outputs, targets, ctx):
+    '''Sets the grad_fn of outputs and targets
+
+    Local gradient of outputs is (outputs-targets)/num_examples and of targets is
+    its negative
+
+    Args:
+      outputs (Tensor): Outputs of Layer/Container/Model/Operation
+      targets (Tensor or np.ndarray): Targets to be evaluated against
+      ctx (Context): Context with the difference of outputs and targets
+    '''
+    if self.operand_requires_grad(outputs):
+      outputs.set_grad_fn(lambda ug:(ug/ctx.num_examples)*ctx.diff)
+    if self.operand_requires_grad(targets):
+      targets.set_grad_fn(lambda ug:(-ug/ctx.num_examples)*ctx.diff)
   
   def __repr__(self):
     return f'MSE()'
@@ -63,8 +107,10 @@ class MSE(Loss):
 
 
 # <------------BINARYCROSSENTROPY------------>
-class BCE(Loss):
+class BCE(Operation, Loss):
   '''Binary Cross Entropy
+
+  Outputs are expected to be probabilities, for raw outputs use BCEWithLogits
   '''
   def forward(self, outputs, targets, epsilon=1e-9):
     '''Forward pass of BCE
@@ -79,10 +125,34 @@ class BCE(Loss):
     Returns:
       Tensor of the result
     '''
-    num_examples = self.get_num_examples(outputs.shape)
-    entropy = _sum((outputs*log(targets+epsilon)) + ((1-outputs)*(log(1-targets+epsilon))))
+    outputs, targets = self.get_tensors(outputs, targets)
+    outputs_data, targets_data = self.get_data(outputs), self.get_data(targets)
+    num_examples = self.get_num_examples(np.shape(outputs_data))
+    log_outputs = np.log(outputs_data+epsilon)
+    log_one_minus_outputs = np.log(1-outputs_data+epsilon)
+    entropy = np.sum((targets_data*log_outputs) + ((1-targets_data)*log_one_minus_outputs))
     cost = (-1/num_examples)*entropy
-    return cost
+    ctx = Context(num_examples=num_examples, epsilon=epsilon)
+    if self.operand_requires_grad(targets):
+      ctx.log_ratio = log_outputs-log_one_minus_outputs
+    return self.get_result_tensor(cost, outputs, targets, ctx=ctx)
+  
+  def backward(self, outputs, targets, ctx):
+    '''Sets the grad_fn of outputs and targets
+
+    Args:
+      outputs (Tensor): Outputs of Layer/Container/Model/Operation
+      targets (Tensor or np.ndarray): Targets to be evaluated against
+      ctx (Context): Context with num_examples and epsilon used in forward
+    '''
+    outputs_data, targets_data = self.get_data(outputs), self.get_data(targets)
+    def outputs_backward(ug):
+      local_grad = ((1-targets_data)/(1-outputs_data+ctx.epsilon)) - (targets_data/(outputs_data+ctx.epsilon))
+      return (ug/ctx.num_examples)*local_grad
+    if self.operand_requires_grad(outputs):
+      outputs.set_grad_fn(outputs_backward)
+    if self.operand_requires_grad(targets):
+      targets.set_grad_fn(lambda ug:(-ug/ctx.num_examples)*ctx.log_ratio)
   
   def __repr__(self):
     return f'BCE()'
@@ -91,8 +161,56 @@ class BCE(Loss):
     return 'BinaryCrossEntropy'
 
 
+# <------------BINARYCROSSENTROPYWITHLOGITS------------>
+class BCEWithLogits(Operation, Loss):
+  '''Implements Sigmoid activation with Binary Cross Entropy
+
+  Numerically stable, since log(sigmoid(x)) is calculated as -(max(-x,0) + log(1+exp(-|x|)))
+  which never overflows, and the derivative is a minimal subtraction between the sigmoid
+  of the outputs and the targets
+  '''
+  def forward(self, outputs, targets):
+    '''Calculates Sigmoid of outputs and the Binary Cross Entropy loss
+
+    Args:
+      outputs (Tensor): Outputs of Layer/Container/Model/Operation, before Sigmoid
+      targets (Tensor): Targets to be evaluated against
+    
+    Returns:
+      Tensor of the result
+    '''
+    outputs, targets = self.get_tensors(outputs, targets)
+    outputs_data, targets_data = self.get_data(outputs), self.get_data(targets)
+    num_examples = self.get_num_examples(np.shape(outputs_data))
+    exp_neg_abs = np.exp(-np.abs(outputs_data))
+    cost = np.sum(np.maximum(outputs_data, 0) - (outputs_data*targets_data) + np.log1p(exp_neg_abs))/num_examples
+    probs = np.where(outputs_data>=0, 1, exp_neg_abs)/(1+exp_neg_abs)
+    return self.get_result_tensor(cost, outputs, targets, ctx=Context(probs=probs, num_examples=num_examples))
+  
+  def backward(self, outputs, targets, ctx):
+    '''Sets the grad_fn of outputs and targets
+
+    Args:
+      outputs (Tensor): Outputs of Layer/Container/Model/Operation, before Sigmoid
+      targets (Tensor or np.ndarray): Targets to be evaluated against
+      ctx (Context): Context with the Sigmoid of outputs calculated during forward
+    '''
+    targets_data = self.get_data(targets)
+    if self.operand_requires_grad(outputs):
+      outputs.set_grad_fn(lambda ug:(ug/ctx.num_examples)*(ctx.probs-targets_data))
+    if self.operand_requires_grad(targets):
+      outputs_data = self.get_data(outputs)
+      targets.set_grad_fn(lambda ug:(-ug/ctx.num_examples)*outputs_data)
+  
+  def __repr__(self):
+    return f'BCEWithLogits()'
+  
+  def __str__(self):
+    return 'BinaryCrossEntropyWithLogits'
+
+
 # <------------CROSSENTROPY------------>
-class CE(Loss):
+class CE(Operation, Loss):
   '''Cross Entropy
   '''
   def forward(self, outputs, targets, epsilon=1e-9):
@@ -108,10 +226,29 @@ class CE(Loss):
     Returns:
       Tensor of the result
     '''
-    num_examples = self.get_num_examples(outputs.shape)
-    entropy = _sum(targets*log(outputs+epsilon))
-    cost = (-1/num_examples)*entropy
-    return cost
+    outputs, targets = self.get_tensors(outputs, targets)
+    outputs_data, targets_data = self.get_data(outputs), self.get_data(targets)
+    num_examples = self.get_num_examples(np.shape(outputs_data))
+    log_outputs = np.log(outputs_data+epsilon)
+    cost = (-1/num_examples)*np.sum(targets_data*log_outputs)
+    ctx = Context(num_examples=num_examples, epsilon=epsilon)
+    if self.operand_requires_grad(targets):
+      ctx.log_outputs = log_outputs
+    return self.get_result_tensor(cost, outputs, targets, ctx=ctx)
+  
+  def backward(self, outputs, targets, ctx):
+    '''Sets the grad_fn of outputs and targets
+
+    Args:
+      outputs (Tensor): Outputs of Layer/Container/Model/Operation
+      targets (Tensor or np.ndarray): Targets to be evaluated against
+      ctx (Context): Context with num_examples and epsilon used in forward
+    '''
+    outputs_data, targets_data = self.get_data(outputs), self.get_data(targets)
+    if self.operand_requires_grad(outputs):
+      outputs.set_grad_fn(lambda ug:(-ug/ctx.num_examples)*(targets_data/(outputs_data+ctx.epsilon)))
+    if self.operand_requires_grad(targets):
+      targets.set_grad_fn(lambda ug:(-ug/ctx.num_examples)*ctx.log_outputs)
   
   def __repr__(self):
     return 'CE()'
@@ -130,6 +267,10 @@ class SoftmaxCE(Operation, Loss):
   is a very minimal subtraction between the softmax output and the targets.
   So many intermediate backward calculations can be prevented with this.
 
+  Targets can either be one-hot or integer class labels, which have the shape of
+  outputs without the class axis. With labels, no one-hot matrix is created, the loss is
+  the log-softmax gathered at the labels
+
   Parameters:
     axis (int or tuple of int): Axis along which to calculate the Softmax
       Defaults to None
@@ -144,29 +285,118 @@ class SoftmaxCE(Operation, Loss):
 
     Args:
       outputs (Tensor): Outputs of Layer/Container/Model/Operation
-      targets (Tensor): Targets to be evaluated against
-      epsilon (float): For numerical stability of log Defaults to 1e-9
+      targets (Tensor): Targets to be evaluated against, one-hot or integer class labels
+      epsilon (float): For numerical stability of log Defaults to 1e-9, not required
+        for labels
     
     Returns:
       Tensor of the result
     '''
+    outputs, targets = self.get_tensors(outputs, targets)
     num_examples = self.get_num_examples(outputs.shape)
-    probs = Softmax.calc_softmax(outputs.data, axis=self.axis)
-    entropy = np.sum(targets.data*np.log(probs+epsilon))
+    labels = self.get_labels(outputs.data, self.get_data(targets), self.axis)
+    if labels is None:
+      probs = Softmax.calc_softmax(outputs.data, axis=self.axis)
+      entropy = np.sum(self.get_data(targets)*np.log(probs+epsilon))
+    else:
+      shifted = outputs.data-np.max(outputs.data, axis=self.axis, keepdims=True)
+      probs = np.exp(shifted)
+      sum_val = np.sum(probs, axis=self.axis, keepdims=True)
+      probs/=sum_val
+      entropy = np.sum(np.take_along_axis(shifted, labels, axis=self.axis)-np.log(sum_val))
     cost = (-1/num_examples)*entropy
-    return self.get_result_tensor(cost, outputs, targets)
+    return self.get_result_tensor(cost, outputs, targets, ctx=Context(probs=probs, labels=labels, subtracted=False))
   
-  def backward(self, outputs, targets):
+  def backward(self, outputs, targets, ctx):
     '''Sets the grad_fn of outputs
 
+    With labels, 1 is subtracted in place from the probs at the labels, once even if
+    the grad_fn is called again, so no array of the shape of the probs is allocated
+
     Args:
       outputs (Tensor): Tensor which is usually the outputs of the last layer
         of the network
-      targets (Tensor): Targets to be evaluated against
+      targets (Tensor or np.ndarray): Targets to be evaluated against
+      ctx (Context): Context with the probs calculated during forward, the labels and
+        whether 1 has been subtracted from the probs at the labels
     '''
+    assert not(self.operand_requires_grad(targets)), 'Targets Tensor should have requires_grad=False'
+    targets_data = self.get_data(targets)
     def sce_backward(ug):
       num_examples = self.get_num_examples(outputs.shape)
-      probs = Softmax.calc_softmax(outputs.data, axis=self.axis)
-      return (ug/num_examples)*(probs-targets.data) # ug is a scalar(1 by default), because loss calculated in forward is a scalar
+      if ctx.labels is None:
+        grad = ctx.probs-targets_data
+      else:
+        if not(ctx.subtracted):
+          np.put_along_axis(ctx.probs, ctx.labels, np.take_along_axis(ctx.probs, ctx.labels, axis=self.axis)-1, axis=self.axis)
+          ctx.subtracted = True
+        grad = ctx.probs
+      return (ug/num_examples)*grad # ug is a scalar(1 by default), because loss calculated in forward is a scalar
     outputs.set_grad_fn(sce_backward)
-    assert targets.requires_grad is False, 'Targets Tensor should have requires_grad=False'
+  
+  def __repr__(self):
+    return f'SoftmaxCE(axis={self.axis})'
+  
+  def __str__(self):
+    return 'SoftmaxCrossEntropy'
+
+
+# <------------NEGATIVELOGLIKELIHOOD------------>
+class NLL(Operation, Loss):
+  '''Negative Log Likelihood
+
+  Outputs are expected to be log-probabilities. Targets can either be one-hot or integer
+  class labels, which have the shape of outputs without the class axis
+
+  Parameters:
+    axis (int): Class axis
+  '''
+  def __init__(self, axis):
+    self.axis = axis
+
+  def forward(self, outputs, targets):
+    '''Forward pass of NLL
+
+    Args:
+      outputs (Tensor): Log-probabilities
+      targets (Tensor): Targets to be evaluated against, one-hot or integer class labels
+    
+    Returns:
+      Tensor of the result
+    '''
+    outputs, targets = self.get_tensors(outputs, targets)
+    num_examples = self.get_num_examples(outputs.shape)
+    labels = self.get_labels(outputs.data, self.get_data(targets), self.axis)
+    if labels is None:
+      likelihood = np.sum(self.get_data(targets)*outputs.data)
+    else:
+      likelihood = np.sum(np.take_along_axis(outputs.data, labels, axis=self.axis))
+    cost = (-1/num_examples)*likelihood
+    return self.get_result_tensor(cost, outputs, targets, ctx=Context(labels=labels))
+  
+  def backward(self, outputs, targets, ctx):
+    '''Sets the grad_fn of outputs
+
+    Local gradient is -1 at the labels and 0 elsewhere, ie negative of one-hot targets
+
+    Args:
+      outputs (Tensor): Log-probabilities
+      targets (Tensor or np.ndarray): Targets to be evaluated against
+      ctx (Context): Context with the labels
+    '''
+    assert not(self.operand_requires_grad(targets)), 'Targets Tensor should have requires_grad=False'
+    targets_data = self.get_data(targets)
+    def nll_backward(ug):
+      num_examples = self.get_num_examples(outputs.shape)
+      if ctx.labels is None:
+        return (-ug/num_examples)*targets_data
+      grad = np.zeros(outputs.shape)
+      np.put_along_axis(grad, ctx.labels, -ug/num_examples, axis=self.axis)
+      return grad
+    outputs.set_grad_fn(nll_backward)
+  
+  def __repr__(self):
+    return f'NLL(axis={self.axis})'
+  
+  def __str__(self):
+    return 'NegativeLogLikelihood'
@@ -1,10 +1,23 @@
-import dill
+import os
+import pickle
+import numpy as np
 from itertools import chain as list_flattener
-from .layers import Container, Layer
+from .layers import Container, Layer, Param, Quantizable
+from .storage import save_chunked, load_chunked, save_sharded, load_sharded
 from ..autograd.utils import get_graph
 
 
 class Model:
+  '''Base class for all the Models
+
+  Parameters:
+    flat_data (None or np.ndarray): Contiguous buffer that the data of all the Params are views
+      into, if flatten_parameters has been called and they still are
+    flat_grad (None or np.ndarray): Contiguous buffer that the grads of all the Params are views
+      into, if flatten_parameters has been called and they still are
+  '''
+  _flat_buffers = None
+
   def __call__(self, inputs):
     '''Abstracts the forward method
 
@@ -55,6 +68,139 @@ class Model:
       params[attr] = layer.parameters(as_dict)
     return params if as_dict else list(list_flattener(*params.values()))
   
+  def named_parameters(self):
+    '''Gathers the params of the whole Model along with their names
+
+    The name of a Param is made of the attributes of the layers and the indices of the
+    layers in Containers that lead to it, joined by dots, like stack.0.weights
+
+    Returns:
+      dict of name to Param
+    '''
+    params = {}
+    stack = list(reversed(self.get_layers().items()))
+    while stack:
+      name, layer = stack.pop()
+      if isinstance(layer, Container):
+        stack+=reversed([(f'{name}.{i}', sub_layer) for i, sub_layer in enumerate(layer.layers)])
+      else:
+        params.update((f'{name}.{attr}', val) for attr, val in layer.__dict__.items() if isinstance(val, Param))
+    return params
+  
+  def flatten_parameters(self):
+    '''Places the data and grads of all the Params into two contiguous buffers
+
+    The data and grad of each Param become views into flat_data and flat_grad, so that
+    operations over all the Params, like updates, clipping or norms, can be performed on the
+    buffers at once. Setting data of the same shape on a Param copies it into the buffer
+
+    Returns:
+      flat_data and flat_grad
+    '''
+    params = list(dict.fromkeys(self.parameters())) # a Param shared by layers is placed once
+    sizes = [param.data.size for param in params]
+    flat_data, flat_grad = np.empty(sum(sizes)), np.zeros(sum(sizes))
+    offset = 0
+    for param, size in zip(params, sizes):
+      param.flatten(flat_data[offset:offset+size], flat_grad[offset:offset+size])
+      offset+=size
+    self._flat_buffers = (flat_data, flat_grad)
+    return flat_data, flat_grad
+  
+  @property
+  def flat_data(self):
+    '''Returns the flat data buffer, None if any of the Params isn't a view into it, like
+    those of a layer added after flatten_parameters, even inside of a Container
+    '''
+    return None if self.get_flat_buffers() is None else self._flat_buffers[0]
+  
+  @property
+  def flat_grad(self):
+    '''Returns the flat grad buffer, None if any of the Params isn't a view into it
+    '''
+    return None if self.get_flat_buffers() is None else self._flat_buffers[1]
+  
+  def get_flat_buffers(self):
+    '''Returns the flat buffers if all the Params of the Model are still views into them
+
+    Returns:
+      flat_data and flat_grad, None if flatten_parameters hasn't been called or if the
+      Params have changed since
+    '''
+    if self._flat_buffers is None:
+      return None
+    flat_data, flat_grad = self._flat_buffers
+    for param in self.parameters():
+      if (param._flat_grad is None) or (param.data.base is not flat_data) or (param._flat_grad.base is not flat_grad):
+        return None
+    return self._flat_buffers
+  
+  def quantize(self, calibration_batches, inference_only=False):
+    '''Quantizes the weights of all the Linear, Conv2D and Conv3D layers to int8
+
+    The Model is run in eval mode on calibration_batches, recording the largest absolute
+    value of the inputs of each of those layers, from which the scale of their inputs is
+    set. After quantizing, they run on int8 inputs and weights in eval mode, while
+    outside of it they keep training on their Params as before, so the int8 weights are
+    kept along with the float64 ones. If inference_only, then the float64 weights are
+    removed, which leaves the weights an eighth of their size, and the layers always
+    run on int8, but can't be trained or quantized again
+
+    Args:
+      calibration_batches (iterable of Tensor or np.ndarray): Inputs to the Model that
+        are representative of what it's run on in eval mode
+      inference_only (bool): Whether the float weights are removed. Defaults to False
+    
+    Returns:
+      list of the layers that were quantized
+    
+    Raises:
+      ValueError: If any of the layers was already quantized for inference only
+    '''
+    layers = self.get_quantizable_layers()
+    for layer in layers:
+      layer.dequantize()
+      layer.calibrating = True
+    try:
+      with self.eval():
+        for inputs in calibration_batches:
+          self(inputs)
+    finally:
+      for layer in layers:
+        layer.calibrating = False
+    for layer in layers:
+      layer.quantize(inference_only)
+    if inference_only and (self._flat_buffers is not None): # the remaining Params would keep the whole buffers alive
+      self.flatten_parameters()
+    return layers
+  
+  def get_quantizable_layers(self):
+    '''Gathers all the layers in the Model that can be quantized, including those
+    inside of Containers
+
+    Returns:
+      list of the layers, each appearing once
+    '''
+    layers, stack = {}, list(reversed(self.get_layers().values()))
+    while stack:
+      layer = stack.pop()
+      if isinstance(layer, Quantizable):
+        layers[id(layer)] = layer
+      elif isinstance(layer, Container):
+        stack+=reversed(layer.layers)
+    return list(layers.values())
+  
+  def export(self, fpath):
+    '''Exports the model for inference as JSON topology and npz Params
+
+    Refer to nn.export.export_model
+
+    Args:
+      fpath (str): File path without extension
+    '''
+    from .export import export_model
+    export_model(self, fpath)
+  
   def set_eval(self, eval):
     '''Sets eval
 
@@ -66,15 +212,20 @@ class Model:
     for layer in self.get_layers().values():
       layer.set_eval(eval)
   
-  def save(self, fpath):
+  def save(self, fpath, params=None):
     '''Saves the params of the model in the specified file path
 
     Args:
       fpath (str): File path
+      params (None or dict): Data of the params as returned by parameters(as_dict=True),
+        like a snapshot taken earlier, to be saved instead of the current params.
+        Defaults to None
     '''
-    params = self.parameters(as_dict=True)
+    if params is None:
+      params = self.parameters(as_dict=True)
+    import dill # imported here, so that loading an export doesn't import it
     with open(fpath, 'wb') as fp:
-      dill.dump(params, fp)
+      dill.dump(params, fp, protocol=pickle.HIGHEST_PROTOCOL) # from protocol 5, arrays are written straight from their buffers
     print(f"\nPARAMS SAVED at {fpath}\n")
 
   def load(self, fpath):
@@ -83,6 +234,7 @@ class Model:
     Args:
       fpath (str): File path
     '''
+    import dill
     with open(fpath, 'rb') as fp:
       params = dill.load(fp)
     for attr, param in params.items():
@@ -90,11 +242,91 @@ class Model:
       layer.set_params(param)
     print(f"\nPARAMS LOADED from {fpath}\n")
   
+  def save_npy(self, dirpath):
+    '''Saves each of the params of the model as a .npy file in dirpath
+
+    The files are named by named_parameters, so they can be memory mapped by load_npy
+
+    Args:
+      dirpath (str): Directory path, which is created if it doesn't exist
+    '''
+    os.makedirs(dirpath, exist_ok=True)
+    for name, param in self.named_parameters().items():
+      param.save(f'{dirpath}/{name}.npy')
+  
+  def load_npy(self, dirpath, mmap=False):
+    '''Loads the params saved by save_npy onto the model
+
+    Either the files are memory mapped, which loads the params lazily and lets processes
+    share them through the page cache, or they are read straight into the current data of
+    the params, so only constant extra memory is used
+
+    Args:
+      dirpath (str): Directory path
+      mmap (bool): Whether to memory map the files, the params are then read only.
+        Defaults to False
+    '''
+    for name, param in self.named_parameters().items():
+      param.load(f'{dirpath}/{name}.npy', mmap)
+  
+  def save_compressed(self, fpath, codec='zlib', shuffle=True, chunk_size=2**20, num_workers=None):
+    '''Saves the params of the model as chunks compressed in parallel
+
+    Refer to nn.storage.save_chunked
+
+    Args:
+      fpath (str): File path
+      codec (str): 'zlib', 'lzma' or 'bz2'. Defaults to 'zlib'
+      shuffle (bool): Whether the bytes of the elements are shuffled before compressing.
+        Defaults to True
+      chunk_size (int): Maximum size of a chunk in bytes. Defaults to 1MiB
+      num_workers (None or int): Number of threads. Defaults to None, which is the number of CPUs
+    '''
+    save_chunked(fpath, {name: param.data for name, param in self.named_parameters().items()}, codec, shuffle, chunk_size, num_workers)
+  
+  def load_compressed(self, fpath, num_workers=None):
+    '''Loads the params saved by save_compressed onto the model, chunk by chunk
+
+    Args:
+      fpath (str): File path
+      num_workers (None or int): Number of threads. Defaults to None, which is the number of CPUs
+    '''
+    load_chunked(fpath, self.named_parameters(), num_workers)
+  
+  def save_sharded(self, dirpath, max_shard_size=None, num_workers=None):
+    '''Saves the params of the model as shards that are written concurrently
+
+    Refer to nn.storage.save_sharded
+
+    Args:
+      dirpath (str): Directory path
+      max_shard_size (None or int): Maximum size of a shard in bytes. Defaults to None,
+        which is a shard per layer
+      num_workers (None or int): Number of threads. Defaults to None, which is the number of CPUs
+    '''
+    save_sharded(dirpath, {name: param.data for name, param in self.named_parameters().items()}, max_shard_size, num_workers)
+  
+  def load_sharded(self, dirpath, prefix=None, num_workers=None):
+    '''Loads the params saved by save_sharded onto the model, reading the shards concurrently
+
+    Args:
+      dirpath (str): Directory path
+      prefix (None or str): If given, then only the params whose names from named_parameters
+        start with it are loaded, like 'stack' or 'stack.0' to load a Sequential or one
+        of its layers, and only the shards that have them are read. Defaults to None
+      num_workers (None or int): Number of threads. Defaults to None, which is the number of CPUs
+    '''
+    params = self.named_parameters()
+    if prefix is not None:
+      params = {name: param for name, param in params.items() if name.startswith(f'{prefix}.')}
+    load_sharded(dirpath, params, num_workers)
+  
   def __setattr__(self, attr, val):
     '''Sets the attributes
 
     Doesn't allow redefining an attribute that's been previously defined if the
-    value of the attribute is instance of Container/Layer
+    value of the attribute is instance of Container/Layer. flatten_parameters needs to
+    be called again to include the Params of a Container/Layer that's set
 
     Args:
       attr (str): Attribute to be set
@@ -104,6 +336,18 @@ class Model:
       raise AttributeError(f"Attribute {attr} has already been defined, it cannot be defined again for a Container/Layer")
     object.__setattr__(self, attr, val)
   
+  def __getstate__(self):
+    '''Returns the state for the object that is to be pickled
+
+    The flat buffers aren't pickled, so the Params of the unpickled Model aren't flattened
+
+    Returns:
+      state of the current Model
+    '''
+    state = dict(self.__dict__)
+    state.pop('_flat_buffers', None)
+    return state
+  
   def __repr__(self):
     return f'Model( {[str(layer) for layer in self.get_layers().values()]} )'
   
@@ -2,16 +2,152 @@ import numpy as np
 from ..autograd.utils import get_graph
 
 
+class StateBuffer:
+  '''Holds a state buffer of an optimizer, optionally compressed
+
+  With float16, the values are stored as float16. With int8, the values are split into blocks
+  of block_size and each block is stored as int8 scaled by the absolute max of the block,
+  so 1 byte per value and 1 float per block are kept
+
+  Parameters:
+    size (int): Number of values
+    precision (None or str): None for float64, 'float16' or 'int8'
+    sqrt (bool): Whether the square root of the values is stored when compressed. Used for
+      non negative states like rms_grad, whose values span the square of the range of the grads.
+      Positive values are never rounded to 0, so that they can safely be divided by
+    block_size (int): Number of values that share a scale with int8
+    values (np.ndarray): Stored values
+    scales (None or np.ndarray): Scale of each block with int8
+  '''
+  def __init__(self, size, precision=None, sqrt=False, block_size=256):
+    '''
+    Raises:
+      ValueError: If precision isn't None, 'float16' or 'int8'
+    '''
+    if precision not in (None, 'float16', 'int8'):
+      raise ValueError(f"precision must be None, 'float16' or 'int8', instead got {precision}")
+    self.size = size
+    self.precision = precision
+    self.sqrt = sqrt and (precision is not None)
+    self.block_size = block_size
+    self.values = np.zeros(size, dtype={None:np.float64, 'float16':np.float16, 'int8':np.int8}[precision])
+    self.scales = np.zeros(-(-size//block_size)) if precision=='int8' else None
+  
+  def get(self, start, end):
+    '''Returns the values from start to end as float64
+
+    Without compression, a view into values is returned, which is updated in place
+
+    Args:
+      start (int): Start index
+      end (int): End index
+    
+    Returns:
+      values from start to end
+    '''
+    if self.precision is None:
+      return self.values[start:end]
+    if self.precision=='float16':
+      values = self.values[start:end].astype(np.float64)
+    else:
+      first_block = start//self.block_size
+      values = self.decode(first_block, -(-end//self.block_size))
+      values = values[start-(first_block*self.block_size):end-(first_block*self.block_size)]
+    return np.square(values) if self.sqrt else values
+  
+  def set(self, start, end, values):
+    '''Stores the values from start to end
+
+    Without compression, nothing needs to be done, as get returned a view
+
+    Args:
+      start (int): Start index
+      end (int): End index
+      values (np.ndarray): Values to be stored
+    '''
+    if self.precision is None:
+      return
+    values = np.sqrt(values) if self.sqrt else values
+    if self.precision=='float16':
+      self.values[start:end] = values
+      return
+    first_block, last_block = start//self.block_size, -(-end//self.block_size)
+    offset = first_block*self.block_size
+    if (start%self.block_size==0) and (end%self.block_size==0 or end==self.size):
+      blocks = values
+    else: # the values of the partially covered blocks outside start and end are retained
+      blocks = self.decode(first_block, last_block)
+      blocks[start-offset:end-offset] = values
+    self.encode(first_block, last_block, blocks)
+  
+  def decode(self, first_block, last_block):
+    '''Dequantizes the int8 blocks from first_block to last_block
+
+    Args:
+      first_block (int): Index of the first block
+      last_block (int): Index after the last block
+    
+    Returns:
+      dequantized values of the blocks
+    '''
+    values = self.values[first_block*self.block_size:last_block*self.block_size]
+    return values*np.repeat(self.scales[first_block:last_block], self.block_size)[:values.size]
+  
+  def encode(self, first_block, last_block, values):
+    '''Quantizes the values into the int8 blocks from first_block to last_block
+
+    Args:
+      first_block (int): Index of the first block
+      last_block (int): Index after the last block
+      values (np.ndarray): Values of the blocks
+    '''
+    padded = np.zeros((last_block-first_block)*self.block_size)
+    padded[:values.size] = values
+    padded = padded.reshape(-1, self.block_size)
+    scales = np.max(np.abs(padded), axis=1)/np.iinfo(np.int8).max
+    quantized = np.rint(np.divide(padded, scales[:,None], out=np.zeros(padded.shape), where=scales[:,None]>0))
+    if self.sqrt:
+      quantized = np.where(padded>0, np.maximum(quantized, 1), 0)
+    self.values[first_block*self.block_size:last_block*self.block_size] = quantized.ravel()[:values.size]
+    self.scales[first_block:last_block] = scales
+
+
 class Optimizer:
   '''Base class for all optimizers
 
+  The Params are updated in place with ufuncs writing into preallocated state buffers.
+  Params that have been flattened by Model.flatten_parameters and lie next to each other in
+  the flat buffers are updated together as a single slice of the buffers
+
+  The state can be stored compressed as float16 or block-wise int8, in which case it is
+  dequantized and quantized again in chunks of chunk_size during step, so that only a chunk
+  is ever held in float64
+
   Parameters:
     params (list of Param): Params that need to be updated
     lr (float): Learning rate
+    state_precision (None or str): None, 'float16' or 'int8', precision in which the state
+      is stored. Defaults to None meaning float64
+    state (dict): State of the optimizer, with the id of a flat buffer or of a Param as key and
+      a dict of its StateBuffers as value
+    state_names (tuple of str): Names of the state buffers the optimizer needs, besides
+      scratch which is used for the temporaries of update
+    chunk_size (int): Number of values of a flat group updated at once when the state is compressed
   '''
-  def __init__(self, params, lr):
+  state_names = ()
+  chunk_size = 2**16
+
+  def __init__(self, params, lr, state_precision=None):
+    '''
+    Raises:
+      ValueError: If state_precision isn't None, 'float16' or 'int8'
+    '''
+    if state_precision not in (None, 'float16', 'int8'):
+      raise ValueError(f"state_precision must be None, 'float16' or 'int8', instead got {state_precision}")
     self.params = params
     self.lr = lr
+    self.state_precision = state_precision
+    self.state = {}
 
   def zero_grad(self, all_members=False):
     '''Resets the grads of tensors
@@ -31,6 +167,91 @@ class Optimizer:
       graph.zero_grad()
     for param in self.params: # This is done for redundancy, if all_members=True on a graph that's been reset
         param.zero_grad()
+  
+  def step(self):
+    '''Updates the params
+
+    Calls update on each group of params that require grad, a chunk at a time for flat
+    groups with compressed state
+    '''
+    for data, grad, buffers, offset in self.get_groups():
+      chunk_size = self.chunk_size if (self.state_precision is not None) and (data.ndim==1) else max(data.size, 1)
+      for start in range(0, data.size, chunk_size):
+        end = min(start+chunk_size, data.size)
+        idx = slice(start, end) if data.ndim==1 else Ellipsis
+        state = {name:buffer.get(offset+start, offset+end).reshape(data[idx].shape) for name, buffer in buffers.items()}
+        if 'scratch' not in state:
+          state['scratch'] = np.empty(data[idx].shape)
+        self.update(data[idx], grad[idx], state)
+        for name, buffer in buffers.items():
+          buffer.set(offset+start, offset+end, state[name].ravel())
+  
+  def update(self, data, grad, state):
+    '''Updates data in place
+
+    Args:
+      data (np.ndarray): Data of the Params in the group, to be updated in place
+      grad (np.ndarray): Gradient of the Params in the group
+      state (dict): State arrays of the group, of the same shape as data
+    
+    Raises:
+      NotImplementedError: If not implemented by the optimizer
+    '''
+    raise NotImplementedError(f"update isn't implemented for {type(self).__name__}")
+  
+  def get_groups(self):
+    '''Groups the params that require grad for updating
+
+    Flattened Params are grouped into runs of consecutive slices of their flat buffers, every
+    other Param is a group of its own
+
+    Returns:
+      list of data, grad, StateBuffers and the offset of the group in the StateBuffers
+    '''
+    groups, runs = [], {}
+    for param in self.params:
+      if not(param.requires_grad):
+        continue
+      flat_grad = getattr(param, '_flat_grad', None)
+      if flat_grad is None:
+        grad = param.grad if isinstance(param.grad, np.ndarray) else np.broadcast_to(param.grad, param.shape)
+        groups.append((param.data, grad, self.get_state(param, param.data.size), 0))
+      else:
+        data_buffer, grad_buffer = param.data.base, flat_grad.base
+        offset = (param.data.__array_interface__['data'][0]-data_buffer.__array_interface__['data'][0])//data_buffer.itemsize
+        runs.setdefault(id(data_buffer), (data_buffer, grad_buffer, []))[2].append((offset, offset+param.data.size))
+    for data_buffer, grad_buffer, slices in runs.values():
+      merged = []
+      for start, end in sorted(slices):
+        if len(merged)!=0 and merged[-1][1]==start:
+          merged[-1][1] = end
+        else:
+          merged.append([start, end])
+      buffers = self.get_state(data_buffer, data_buffer.size)
+      for start, end in merged:
+        groups.append((data_buffer[start:end], grad_buffer[start:end], buffers, start))
+    return groups
+  
+  def get_state(self, owner, size):
+    '''Returns the StateBuffers of a flat buffer or a Param, allocating them the first time
+
+    scratch is only kept without compression, else it is allocated for each chunk.
+    rms_grad is stored as its square root when compressed
+
+    Args:
+      owner (np.ndarray or Param): Flat buffer or Param whose state is required
+      size (int): Number of values in the owner
+    
+    Returns:
+      dict of StateBuffers
+    '''
+    entry = self.state.get(id(owner))
+    if (entry is None) or (entry['owner'] is not owner) or (entry['size']!=size):
+      names = self.state_names if self.state_precision is not None else ('scratch',)+self.state_names
+      buffers = {name:StateBuffer(size, self.state_precision, sqrt=(name=='rms_grad')) for name in names}
+      entry = {'owner':owner, 'size':size, 'state':buffers} # owner is kept in the entry so that its id isn't reused
+      self.state[id(owner)] = entry
+    return entry['state']
 
 
 class GD(Optimizer):
@@ -39,12 +260,16 @@ class GD(Optimizer):
   def __init__(self, params, lr):
     super().__init__(params, lr)
   
-  def step(self):
-    '''Updates the params
+  def update(self, data, grad, state):
+    '''Updates data in place
+
+    Args:
+      data (np.ndarray): Data of the Params in the group
+      grad (np.ndarray): Gradient of the Params in the group
+      state (dict): State buffers of the group
     '''
-    for param in self.params:
-      if param.requires_grad:
-        param.data -= (self.lr*param.grad)
+    np.multiply(grad, self.lr, out=state['scratch'])
+    np.subtract(data, state['scratch'], out=data)
   
   def __repr__(self):
     return f'GD(params={self.params}, lr={self.lr})'
@@ -61,42 +286,32 @@ class Momentum(Optimizer):
   Parameters:
     beta (float): Value of Beta
   '''
-  def __init__(self, params, lr, beta=0.9):
-    super().__init__(params, lr)
+  state_names = ('momentum_grad',)
+
+  def __init__(self, params, lr, beta=0.9, state_precision=None):
+    super().__init__(params, lr, state_precision)
     self.beta = beta
-    self.init_momentum_grads()
 
-  def step(self):
-    '''Updates the params
+  def update(self, data, grad, state):
+    '''Updates the momentum_grad and then data in place
 
-    Uses the momentum_grads to update the params
-    '''
-    self.update_momentum_grads()
-    for param in self.params:
-      if param.requires_grad:
-        param.data -= (self.lr*param.momentum_grad)
-  
-  def init_momentum_grads(self):
-    '''Initializes momentum grads
-
-    For each param, it sets its momentum_grad to 0
+    Args:
+      data (np.ndarray): Data of the Params in the group
+      grad (np.ndarray): Gradient of the Params in the group
+      state (dict): State buffers of the group
     '''
-    for param in self.params:
-      if param.requires_grad:
-        param.momentum_grad = 0
-  
-  def update_momentum_grads(self):
-    '''Updates momentum grads
-    '''
-    for param in self.params:
-      if param.requires_grad:
-        param.momentum_grad = (self.beta*param.momentum_grad) + ((1-self.beta)*param.grad)
+    momentum_grad, scratch = state['momentum_grad'], state['scratch']
+    momentum_grad*=self.beta
+    np.multiply(grad, 1-self.beta, out=scratch)
+    momentum_grad+=scratch
+    np.multiply(momentum_grad, self.lr, out=scratch)
+    np.subtract(data, scratch, out=data)
   
   def __repr__(self):
-    return f'Momentum(params={self.params}, lr={self.lr}, beta={self.beta})'
+    return f'Momentum(params={self.params}, lr={self.lr}, beta={self.beta}, state_precision={self.state_precision})'
   
   def __str__(self):
-    return f'Momentum(params={self.params}, lr={self.lr}, beta={self.beta})'
+    return f'Momentum(params={self.params}, lr={self.lr}, beta={self.beta}, state_precision={self.state_precision})'
 
 
 class RMSProp(Optimizer):
@@ -108,43 +323,37 @@ class RMSProp(Optimizer):
     beta (float): Value of Beta
     epsilon (float): Value of epsilon
   '''
-  def __init__(self, params, lr, beta=0.9, epsilon=1e-8):
-    super().__init__(params, lr)
+  state_names = ('rms_grad',)
+
+  def __init__(self, params, lr, beta=0.9, epsilon=1e-8, state_precision=None):
+    super().__init__(params, lr, state_precision)
     self.beta = beta
     self.epsilon = epsilon
-    self.init_rms_grads()
 
-  def step(self):
-    '''Updates the params
-
-    Uses the rms_grads to update the params
-    '''
-    self.update_rms_grads()
-    for param in self.params:
-      if param.requires_grad:
-        param.data -= (self.lr*(param.grad/(np.sqrt(param.rms_grad) + self.epsilon)))
-  
-  def init_rms_grads(self):
-    '''Initializes rms grads
+  def update(self, data, grad, state):
+    '''Updates the rms_grad and then data in place
 
-    For each param, it sets its rms_grad to 0
-    '''
-    for param in self.params:
-      if param.requires_grad:
-        param.rms_grad = 0
-  
-  def update_rms_grads(self):
-    '''Updates rms grads
+    Args:
+      data (np.ndarray): Data of the Params in the group
+      grad (np.ndarray): Gradient of the Params in the group
+      state (dict): State buffers of the group
     '''
-    for param in self.params:
-      if param.requires_grad:
-        param.rms_grad = (self.beta*param.rms_grad) + ((1-self.beta)*np.square(param.grad))
+    rms_grad, scratch = state['rms_grad'], state['scratch']
+    rms_grad*=self.beta
+    np.square(grad, out=scratch)
+    scratch*=(1-self.beta)
+    rms_grad+=scratch
+    np.sqrt(rms_grad, out=scratch)
+    scratch+=self.epsilon
+    np.divide(grad, scratch, out=scratch)
+    scratch*=self.lr
+    np.subtract(data, scratch, out=data)
   
   def __repr__(self):
-    return f'RMSProp(params={self.params}, lr={self.lr}, beta={self.beta}, epsilon={self.epsilon})'
+    return f'RMSProp(params={self.params}, lr={self.lr}, beta={self.beta}, epsilon={self.epsilon}, state_precision={self.state_precision})'
   
   def __str__(self):
-    return f'RMSProp(params={self.params}, lr={self.lr}, beta={self.beta}, epsilon={self.epsilon})'
+    return f'RMSProp(params={self.params}, lr={self.lr}, beta={self.beta}, epsilon={self.epsilon}, state_precision={self.state_precision})'
 
 
 class Adam(Optimizer):
@@ -158,43 +367,47 @@ class Adam(Optimizer):
     beta2 (float): Value of beta2
     epsilon (float): Value of epsilon
   '''
-  def __init__(self, params, lr, beta1=0.9, beta2=0.999, epsilon=1e-8):
-    super().__init__(params, lr)
+  state_names = ('momentum_grad', 'rms_grad')
+
+  def __init__(self, params, lr, beta1=0.9, beta2=0.999, epsilon=1e-8, state_precision=None):
+    super().__init__(params, lr, state_precision)
     self.iter = 0
     self.beta1, self.beta2 = beta1, beta2
     self.epsilon = epsilon
-    self.init_adam_grads()
   
   def step(self):
     '''Updates the params
 
-    Uses the rms_grads and momentum_grads to update the params
+    Increments iter and then calls update on each group
     '''
     self.iter+=1
-    self.update_adam_grads()
-    for param in self.params:
-      if param.requires_grad:
-        bias_corrected_momentum_grad = param.momentum_grad/(1-(self.beta1**self.iter))
-        bias_corrected_rms_grad = param.rms_grad/(1-(self.beta2**self.iter))
-        param.data -= (self.lr*(bias_corrected_momentum_grad/(np.sqrt(bias_corrected_rms_grad)+self.epsilon)))
+    super().step()
   
-  def init_adam_grads(self):
-    '''Initializes rms grads and momentum grads
+  def update(self, data, grad, state):
+    '''Updates the momentum_grad and rms_grad and then data in place
 
-    For each param, it sets its rms_grad to 0, momentum_grad to 0
-    '''
-    for param in self.params:
-      if param.requires_grad:
-        param.momentum_grad = 0
-        param.rms_grad = 0
-  
-  def update_adam_grads(self):
-    '''Updates rms grads and momentum_grads
+    The bias corrections are applied on the scalars, lr/(1-beta1^iter) and sqrt(1-beta2^iter),
+    so that the bias corrected grads aren't calculated
+
+    Args:
+      data (np.ndarray): Data of the Params in the group
+      grad (np.ndarray): Gradient of the Params in the group
+      state (dict): State buffers of the group
     '''
-    for param in self.params:
-      if param.requires_grad:
-        param.momentum_grad = (self.beta1*param.momentum_grad) + ((1-self.beta1)*param.grad)
-        param.rms_grad = (self.beta2*param.rms_grad) + ((1-self.beta2)*np.square(param.grad))
+    momentum_grad, rms_grad, scratch = state['momentum_grad'], state['rms_grad'], state['scratch']
+    momentum_grad*=self.beta1
+    np.multiply(grad, 1-self.beta1, out=scratch)
+    momentum_grad+=scratch
+    rms_grad*=self.beta2
+    np.square(grad, out=scratch)
+    scratch*=(1-self.beta2)
+    rms_grad+=scratch
+    np.sqrt(rms_grad, out=scratch)
+    scratch/=np.sqrt(1-(self.beta2**self.iter))
+    scratch+=self.epsilon
+    np.divide(momentum_grad, scratch, out=scratch)
+    scratch*=(self.lr/(1-(self.beta1**self.iter)))
+    np.subtract(data, scratch, out=data)
 
   def reset_iter(self):
     '''Resets iter to 0
@@ -202,9 +415,71 @@ class Adam(Optimizer):
     self.iter = 0
   
   def __repr__(self):
-    return f'Adam(params={self.params}, lr={self.lr}, beta1={self.beta1}, beta2={self.beta2}, epsilon={self.epsilon})'
+    return f'Adam(params={self.params}, lr={self.lr}, beta1={self.beta1}, beta2={self.beta2}, epsilon={self.epsilon}, state_precision={self.state_precision})'
   
   def __str__(self):
-    return f'Adam(params={self.params}, lr={self.lr}, beta1={self.beta1}, beta2={self.beta2}, epsilon={self.epsilon})'
-    
+    return f'Adam(params={self.params}, lr={self.lr}, beta1={self.beta1}, beta2={self.beta2}, epsilon={self.epsilon}, state_precision={self.state_precision})'
+
+
+class LossScaler:
+  '''Dynamic loss scaling for training under autocast
+
+  The backward pass is started with scale as the upper gradient, so that small grads don't
+  underflow in low precision. Before the optimizer steps, the grads of the params are unscaled
+  in place, if any of them isn't finite, then the step is skipped and scale is reduced by
+  backoff_factor. After growth_interval consecutive steps without overflow, scale is multiplied
+  by growth_factor
+
+  Parameters:
+    optim (Optimizer): Optimizer whose params are updated
+    scale (float): Current scale. Defaults to 2**15
+    growth_factor (float): Factor by which scale grows. Defaults to 2
+    backoff_factor (float): Factor by which scale is reduced on overflow. Defaults to 0.5
+    growth_interval (int): Number of consecutive steps without overflow after which scale
+      grows. Defaults to 2000
+    num_good_steps (int): Number of consecutive steps without overflow
+  '''
+  def __init__(self, optim, scale=2.**15, growth_factor=2., backoff_factor=0.5, growth_interval=2000):
+    self.optim = optim
+    self.scale = scale
+    self.growth_factor = growth_factor
+    self.backoff_factor = backoff_factor
+    self.growth_interval = growth_interval
+    self.num_good_steps = 0
+  
+  def backward(self, loss):
+    '''Starts the backward pass of loss with scale as upper gradient
+
+    Overflows are expected in low precision, they are detected in step
+
+    Args:
+      loss (Tensor): Loss to be backpropagated
+    '''
+    with np.errstate(over='ignore', invalid='ignore'):
+      loss.backward(self.scale)
   
+  def step(self):
+    '''Unscales the grads and steps the optimizer, unless there is an overflow
+
+    Returns:
+      True if the optimizer stepped, False if the step was skipped
+    '''
+    grads = [param.grad for param in self.optim.params if param.requires_grad and isinstance(param.grad, np.ndarray)]
+    if not(all(np.all(np.isfinite(grad)) for grad in grads)):
+      self.scale*=self.backoff_factor
+      self.num_good_steps = 0
+      return False
+    for grad in grads:
+      grad/=self.scale
+    self.optim.step()
+    self.num_good_steps+=1
+    if self.num_good_steps==self.growth_interval:
+      self.scale*=self.growth_factor
+      self.num_good_steps = 0
+    return True
+  
+  def __repr__(self):
+    return f'LossScaler(optim={self.optim}, scale={self.scale})'
+  
+  def __str__(self):
+    return f'LossScaler(optim={self.optim}, scale={self.scale})'
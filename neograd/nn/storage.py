@@ -0,0 +1,435 @@
+import os
+import bz2
+import json
+import lzma
+import time
+import zlib
+import tempfile
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+
+
+def write_atomic(fpath, write_fn):
+  '''Writes a file through a uniquely named temporary file in the same directory, that
+  is then renamed to fpath
+
+  Args:
+    fpath (str): Path of the file
+    write_fn (callable): Called with the temporary file opened in binary mode
+
+  Raises:
+    Exception: Raised by write_fn, after the temporary file is removed
+  '''
+  fd, tmp_fpath = tempfile.mkstemp(dir=os.path.dirname(fpath) or '.', prefix=f'{os.path.basename(fpath)}.', suffix='.tmp')
+  try:
+    with os.fdopen(fd, 'wb') as fp:
+      write_fn(fp)
+    os.replace(tmp_fpath, fpath)
+  except BaseException:
+    os.remove(tmp_fpath)
+    raise
+
+
+class BlobStore:
+  '''Content addressed store of arrays
+
+  Each array is saved once as a .npy blob named by the sha256 digest of its dtype, shape
+  and bytes, so storing an array that's already in the store only costs hashing it.
+  Blobs and manifests are written to a uniquely named temporary file that is then
+  renamed, so an interrupted write never leaves a partial file under the final name,
+  and threads putting equal arrays at the same time don't write to the same file
+
+  Parameters:
+    dirpath (str): Directory in which the blobs are saved
+  '''
+  def __init__(self, dirpath):
+    '''
+    Args:
+      dirpath (str): Directory in which the blobs are saved, which is created if it
+        doesn't exist
+    '''
+    os.makedirs(dirpath, exist_ok=True)
+    self.dirpath = dirpath
+
+  def get_digest(self, data):
+    '''Returns the hex sha256 digest of the dtype, shape and bytes of data
+
+    Args:
+      data (np.ndarray): Array to be hashed
+
+    Returns:
+      hex digest
+    '''
+    data = np.asarray(data, order='C')
+    digest = sha256(f'{data.dtype.str}{data.shape}'.encode('utf-8'))
+    digest.update(memoryview(data).cast('B'))
+    return digest.hexdigest()
+
+  def get_path(self, digest):
+    '''Returns the path of the blob with digest
+    '''
+    return f'{self.dirpath}/{digest}.npy'
+
+  def put(self, data):
+    '''Saves data as a blob, if it isn't already in the store
+
+    Args:
+      data (np.ndarray): Array to be saved
+
+    Returns:
+      digest of the blob
+    '''
+    digest = self.get_digest(data)
+    fpath = self.get_path(digest)
+    if not(os.path.exists(fpath)):
+      write_atomic(fpath, lambda fp:np.save(fp, data))
+    return digest
+
+  def write_manifest(self, fpath, params):
+    '''Saves the data of named params as blobs and writes a manifest referencing them
+
+    Args:
+      fpath (str): Path of the manifest
+      params (dict): Dict of name to data of the params, or to the digest if it's
+        already been put
+    '''
+    manifest = {name: data if isinstance(data, str) else self.put(data) for name, data in params.items()}
+    write_atomic(fpath, lambda fp:fp.write(json.dumps(manifest).encode('utf-8')))
+
+  def load_manifest(self, fpath, params):
+    '''Loads the blobs referenced by a manifest into named params
+
+    Args:
+      fpath (str): Path of the manifest
+      params (dict): Dict of name to Param, like named_parameters of a Model
+
+    Raises:
+      ValueError: If the names in the manifest don't match the names of params
+    '''
+    with open(fpath) as fp:
+      manifest = json.load(fp)
+    if manifest.keys()!=params.keys():
+      raise ValueError(f"Params in {fpath} don't match the params of the model")
+    for name, param in params.items():
+      param.load(self.get_path(manifest[name]))
+
+
+CODECS = {'zlib': zlib, 'lzma': lzma, 'bz2': bz2}
+
+CHUNKED_MAGIC = b'NGCHUNK1'
+
+
+def shuffle_bytes(buffer, itemsize):
+  '''Groups the bytes of the elements in buffer by their position in the element
+
+  The first bytes of all the elements come first, then the second bytes and so on. The
+  high bytes of floats that are close to each other repeat, so the codecs compress
+  them better when they're next to each other
+
+  Args:
+    buffer (np.ndarray): uint8 array of the bytes of the elements
+    itemsize (int): Size of an element in bytes
+
+  Returns:
+    bytes that are shuffled
+  '''
+  return buffer.reshape(-1, itemsize).T.tobytes()
+
+
+def unshuffle_bytes(buffer, itemsize):
+  '''Reverses shuffle_bytes
+
+  Args:
+    buffer (bytes): Bytes that are shuffled
+    itemsize (int): Size of an element in bytes
+
+  Returns:
+    bytes of the elements
+  '''
+  return np.frombuffer(buffer, np.uint8).reshape(itemsize, -1).T.tobytes()
+
+
+def map_ordered(pool, fn, tasks, window):
+  '''Maps fn over tasks in pool, yielding the results in order
+
+  Unlike Executor.map, tasks is consumed lazily, at most window tasks are submitted
+  ahead of the result that's yielded, so memory stays bounded when streaming
+
+  Args:
+    pool (Executor): Pool that fn is run in
+    fn (callable): Function to be mapped
+    tasks (iterable): Arguments of each call to fn
+    window (int): Maximum number of tasks in flight
+
+  Yields:
+    result of fn for each of the tasks
+  '''
+  futures = deque()
+  for task in tasks:
+    futures.append(pool.submit(fn, task))
+    if len(futures)>=window:
+      yield futures.popleft().result()
+  while futures:
+    yield futures.popleft().result()
+
+
+def save_chunked(fpath, params, codec='zlib', shuffle=True, chunk_size=2**20, num_workers=None):
+  '''Saves named arrays as compressed chunks
+
+  The bytes of each array are split into chunks of upto chunk_size bytes, which are
+  compressed in parallel by num_workers threads, since the codecs release the GIL, and
+  written in order as soon as they're ready. The file starts with CHUNKED_MAGIC and ends
+  with a JSON footer of the codec, shuffle, chunk_size and the name, dtype, shape and compressed chunk sizes of
+  each array, followed by the size of the footer as 8 little endian bytes. It's written
+  through write_atomic, so a failed write leaves neither a partial file nor a temporary one
+
+  Args:
+    fpath (str): File path
+    params (dict): Dict of name to np.ndarray
+    codec (str): One of the CODECS. Defaults to 'zlib'
+    shuffle (bool): Whether to apply shuffle_bytes to the chunks before compressing them.
+      Defaults to True
+    chunk_size (int): Maximum size of a chunk in bytes. Defaults to 1MiB
+    num_workers (None or int): Number of threads compressing the chunks. Defaults to
+      None, which is the number of CPUs
+
+  Raises:
+    ValueError: If codec isn't one of the CODECS
+  '''
+  if codec not in CODECS:
+    raise ValueError(f"Codec {codec} isn't one of {tuple(CODECS)}")
+  compress = CODECS[codec].compress
+  arrays = {name: np.asarray(data, order='C') for name, data in params.items()}
+  entries = [{'name': name, 'dtype': data.dtype.str, 'shape': data.shape, 'chunks': []} for name, data in arrays.items()]
+  def get_tasks():
+    for entry, data in zip(entries, arrays.values()):
+      step = max(chunk_size//data.itemsize, 1)*data.itemsize
+      buffer = data.reshape(-1).view(np.uint8)
+      for start in range(0, buffer.size, step):
+        yield entry, buffer[start:start+step], data.itemsize
+  def encode(task):
+    entry, buffer, itemsize = task
+    return entry, compress(shuffle_bytes(buffer, itemsize) if shuffle else buffer.tobytes())
+  num_workers = num_workers or os.cpu_count() or 1
+  def write_chunks(fp):
+    fp.write(CHUNKED_MAGIC)
+    with ThreadPoolExecutor(num_workers) as pool:
+      for entry, compressed in map_ordered(pool, encode, get_tasks(), 2*num_workers):
+        fp.write(compressed)
+        entry['chunks'].append(len(compressed))
+    footer = json.dumps({'codec': codec, 'shuffle': shuffle, 'chunk_size': chunk_size, 'params': entries}).encode('utf-8')
+    fp.write(footer)
+    fp.write(len(footer).to_bytes(8, 'little'))
+  write_atomic(fpath, write_chunks)
+
+
+def load_chunked(fpath, params, num_workers=None):
+  '''Loads arrays saved by save_chunked into named params
+
+  The chunks are read one after the other and decompressed in parallel by num_workers
+  threads straight into the data of the params, if their shape and dtype match, so
+  only the chunks in flight take extra memory
+
+  Args:
+    fpath (str): File path
+    params (dict): Dict of name to Param, like named_parameters of a Model
+    num_workers (None or int): Number of threads decompressing the chunks. Defaults to
+      None, which is the number of CPUs
+
+  Raises:
+    ValueError: If the file wasn't saved by save_chunked
+    ValueError: If the names in the file don't match the names of params
+  '''
+  with open(fpath, 'rb') as fp:
+    if fp.read(len(CHUNKED_MAGIC))!=CHUNKED_MAGIC:
+      raise ValueError(f"{fpath} wasn't saved by save_chunked")
+    fp.seek(-8, os.SEEK_END)
+    footer_size = int.from_bytes(fp.read(8), 'little')
+    fp.seek(-8-footer_size, os.SEEK_END)
+    footer = json.loads(fp.read(footer_size))
+    if [entry['name'] for entry in footer['params']]!=list(params.keys()):
+      raise ValueError(f"Params in {fpath} don't match the params of the model")
+    decompress, shuffle = CODECS[footer['codec']].decompress, footer['shuffle']
+    outputs = []
+    for entry in footer['params']:
+      param, dtype, shape = params[entry['name']], np.dtype(entry['dtype']), tuple(entry['shape'])
+      data = param.data
+      if not((data.shape==shape) and (data.dtype==dtype) and data.flags.c_contiguous and data.flags.writeable):
+        data = np.empty(shape, dtype)
+      outputs.append((param, data))
+    def get_tasks():
+      fp.seek(len(CHUNKED_MAGIC))
+      for entry, (_, data) in zip(footer['params'], outputs):
+        step = max(footer['chunk_size']//data.itemsize, 1)*data.itemsize
+        buffer = data.reshape(-1).view(np.uint8)
+        for i, size in enumerate(entry['chunks']):
+          yield fp.read(size), buffer[i*step:(i+1)*step], data.itemsize
+    def decode(task):
+      compressed, buffer, itemsize = task
+      decompressed = decompress(compressed)
+      buffer[:] = np.frombuffer(unshuffle_bytes(decompressed, itemsize) if shuffle else decompressed, np.uint8)
+    num_workers = num_workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(num_workers) as pool:
+      for _ in map_ordered(pool, decode, get_tasks(), 2*num_workers):
+        pass
+  for param, data in outputs:
+    if data is not param.data:
+      param.data = data
+
+
+SHARD_ALIGNMENT = 64
+
+
+def get_shards(params, max_shard_size=None):
+  '''Groups named arrays into shards
+
+  Args:
+    params (dict): Dict of name to np.ndarray, in the order they're saved
+    max_shard_size (None or int): Maximum size of a shard in bytes, an array larger than
+      it gets a shard of its own. Defaults to None, which is a shard per layer, the arrays
+      whose names only differ in the last part, like stack.0.weights and stack.0.bias
+
+  Returns:
+    list of list of names
+  '''
+  shards, shard_key, shard_size = [], None, 0
+  for name, data in params.items():
+    if max_shard_size is None:
+      key = name.rsplit('.', 1)[0]
+      new_shard = key!=shard_key
+      shard_key = key
+    else:
+      new_shard = (shard_size+data.nbytes>max_shard_size) or not(shards)
+      shard_size = (0 if new_shard else shard_size)+data.nbytes
+    if new_shard:
+      shards.append([])
+    shards[-1].append(name)
+  return shards
+
+
+def save_sharded(dirpath, params, max_shard_size=None, num_workers=None):
+  '''Saves named arrays as raw shards that are written concurrently
+
+  Each shard shard-{i}.bin has the raw bytes of its arrays, each starting at a multiple of
+  SHARD_ALIGNMENT bytes. manifest.json lists the shards and the name, dtype, shape and
+  offset of each of their arrays, it's written last, so a directory with a manifest has
+  all its shards
+
+  Args:
+    dirpath (str): Directory path, which is created if it doesn't exist
+    params (dict): Dict of name to np.ndarray
+    max_shard_size (None or int): Maximum size of a shard in bytes. Defaults to None,
+      which is a shard per layer, refer get_shards
+    num_workers (None or int): Number of threads writing the shards. Defaults to None,
+      which is the number of CPUs
+  '''
+  os.makedirs(dirpath, exist_ok=True)
+  arrays = {name: np.asarray(data, order='C') for name, data in params.items()}
+  manifest = {'alignment': SHARD_ALIGNMENT, 'shards': []}
+  for i, names in enumerate(get_shards(arrays, max_shard_size)):
+    entries, offset = [], 0
+    for name in names:
+      entries.append({'name': name, 'dtype': arrays[name].dtype.str, 'shape': arrays[name].shape, 'offset': offset})
+      offset+=-(-arrays[name].nbytes//SHARD_ALIGNMENT)*SHARD_ALIGNMENT
+    manifest['shards'].append({'fname': f'shard-{i:05d}.bin', 'params': entries})
+  def write_shard(shard):
+    with open(f"{dirpath}/{shard['fname']}", 'wb') as fp:
+      for entry in shard['params']:
+        fp.seek(entry['offset'])
+        fp.write(arrays[entry['name']].reshape(-1).view(np.uint8))
+  with ThreadPoolExecutor(num_workers or os.cpu_count() or 1) as pool:
+    list(pool.map(write_shard, manifest['shards']))
+  write_atomic(f'{dirpath}/manifest.json', lambda fp:fp.write(json.dumps(manifest).encode('utf-8')))
+
+
+def load_sharded(dirpath, params, num_workers=None):
+  '''Loads the arrays saved by save_sharded into named params
+
+  Only the shards that have any of params are read, concurrently, straight into the
+  data of the params if their shape and dtype match, so a subset of the params, like
+  those of one layer, can be loaded
+
+  Args:
+    dirpath (str): Directory path
+    params (dict): Dict of name to Param, like named_parameters of a Model
+    num_workers (None or int): Number of threads reading the shards. Defaults to None,
+      which is the number of CPUs
+
+  Raises:
+    ValueError: If any of params isn't in the manifest
+    ValueError: If a shard is truncated, in which case the data read into in place is
+      partly overwritten
+  '''
+  with open(f'{dirpath}/manifest.json') as fp:
+    manifest = json.load(fp)
+  entries = [(shard['fname'], entry) for shard in manifest['shards'] for entry in shard['params'] if entry['name'] in params]
+  missing = params.keys()-{entry['name'] for _, entry in entries}
+  if missing:
+    raise ValueError(f"Params {sorted(missing)} aren't in {dirpath}")
+  outputs = {}
+  for _, entry in entries:
+    data = params[entry['name']].data
+    if not((data.shape==tuple(entry['shape'])) and (data.dtype==np.dtype(entry['dtype'])) and data.flags.c_contiguous and data.flags.writeable):
+      data = np.empty(tuple(entry['shape']), np.dtype(entry['dtype']))
+    outputs[entry['name']] = data
+  shards = {}
+  for fname, entry in entries:
+    shards.setdefault(fname, []).append(entry)
+  def read_shard(shard):
+    fname, shard_entries = shard
+    with open(f'{dirpath}/{fname}', 'rb') as fp:
+      for entry in shard_entries:
+        fp.seek(entry['offset'])
+        buffer = outputs[entry['name']].reshape(-1).view(np.uint8)
+        num_read = fp.readinto(buffer)
+        if num_read!=buffer.nbytes:
+          raise ValueError(f"{dirpath}/{fname} is truncated, read {num_read} of {buffer.nbytes} bytes of {entry['name']}")
+  with ThreadPoolExecutor(num_workers or os.cpu_count() or 1) as pool:
+    list(pool.map(read_shard, shards.items()))
+  for name, data in outputs.items():
+    if data is not params[name].data:
+      params[name].data = data
+
+
+def benchmark_codecs(params, dirpath, codecs=tuple(CODECS), chunk_size=2**20, num_workers=None):
+  '''Measures the size and throughput of save_chunked and load_chunked for each codec
+
+  Each codec is run with and without shuffle, along with np.save of the arrays for
+  comparison, whose row has None as the codec
+
+  Args:
+    params (dict): Dict of name to Param, like named_parameters of a Model
+    dirpath (str): Directory the files are written to
+    codecs (tuple of str): Codecs to be measured. Defaults to all the CODECS
+    chunk_size (int): Maximum size of a chunk in bytes. Defaults to 1MiB
+    num_workers (None or int): Number of threads. Defaults to None, which is the number of CPUs
+
+  Returns:
+    list of dict with the codec, shuffle, ratio of the size of the data to the size of
+    the file, and the write and read throughputs of the data in MB/s
+  '''
+  nbytes = sum(param.data.nbytes for param in params.values())
+  rows = []
+  for codec, shuffle in [(None, False)]+[(codec, shuffle) for codec in codecs for shuffle in (False, True)]:
+    fpath = f'{dirpath}/benchmark_{codec}_{shuffle}'
+    start = time.perf_counter()
+    if codec is None:
+      np.savez(fpath, **{name: param.data for name, param in params.items()})
+      fpath+='.npz'
+    else:
+      save_chunked(fpath, {name: param.data for name, param in params.items()}, codec, shuffle, chunk_size, num_workers)
+    write_time = time.perf_counter()-start
+    start = time.perf_counter()
+    if codec is None:
+      with np.load(fpath) as arrays:
+        for name, param in params.items():
+          param.data = arrays[name]
+    else:
+      load_chunked(fpath, params, num_workers)
+    read_time = time.perf_counter()-start
+    rows.append({'codec': codec, 'shuffle': shuffle, 'ratio': nbytes/os.path.getsize(fpath),
+      'write_MBps': nbytes/write_time/1e6, 'read_MBps': nbytes/read_time/1e6})
+    os.remove(fpath)
+  return rows
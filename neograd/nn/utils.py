@@ -1,11 +1,14 @@
-import dill
+import pickle
 from .model import Model
+from ..autograd.utils import new_graph
 
 
 def save_model(fpath, model):
   '''Saves the model
 
-  Saves the model by pickling it onto a file
+  Saves the model along with its params by pickling it onto a file with the highest
+  protocol, which from Python 3.8 is 5, so the data of the Params is written without
+  being copied
 
   Args:
     fpath (str): Path in which to save the model
@@ -16,8 +19,9 @@ def save_model(fpath, model):
   '''
   if not isinstance(model, Model):
     raise TypeError(f'Expected Model object, instead got {type(model)}')
+  import dill # imported lazily, since it's slow to import and only needed here
   with open(fpath,'wb') as fp:
-    dill.dump(model, fp)
+    dill.dump(model, fp, protocol=pickle.HIGHEST_PROTOCOL)
     print(f'MODEL SAVED at {fpath}')
 
 
@@ -30,6 +34,7 @@ def load_model(fpath):
   Returns:
     Model object that is loaded
   '''
+  import dill
   with open(fpath,'rb') as fp:
     model = dill.load(fp)
     print(f'MODEL LOADED from {fpath}')
@@ -79,4 +84,38 @@ def get_batches(inputs, targets=None, batch_size=None):
       yield inputs[start:end], targets[start:end]
     else:
       yield inputs[start:end]
-    start = end
\ No newline at end of file
+    start = end
+
+
+def train_step(model, loss_fn, optim, inputs, targets, micro_batch_size=None):
+  '''Performs one optimizer step on a batch, accumulating the grads over micro-batches
+
+  The batch is split by get_batches into micro-batches of micro_batch_size, each is run
+  forward and backward under a new graph, so that only the activations of one micro-batch
+  are alive at a time. The backward of each micro-batch starts with its share of the batch
+  as upper gradient, so for losses that average over the examples, the accumulated grads
+  are the same as those of the whole batch. optim.step is called once at the end
+
+  Args:
+    model (Model or Container or Layer): Model to be trained
+    loss_fn (Loss): Loss to be minimized
+    optim (Optimizer): Optimizer of the params of the model
+    inputs (Tensor): Inputs of the batch
+    targets (Tensor): Targets of the batch
+    micro_batch_size (int): Size of the micro-batches. Defaults to None meaning the whole
+      batch is run at once
+  
+  Returns:
+    Loss of the whole batch
+  '''
+  optim.zero_grad()
+  num_examples = inputs.shape[0]
+  loss_val = 0.
+  for micro_inputs, micro_targets in get_batches(inputs, targets, micro_batch_size):
+    share = micro_inputs.shape[0]/num_examples
+    with new_graph():
+      loss = loss_fn(model(micro_inputs), micro_targets)
+      loss.backward(share)
+    loss_val+=share*loss.data
+  optim.step()
+  return loss_val
@@ -0,0 +1,208 @@
+import asyncio
+import queue
+import threading
+import time
+import numpy as np
+from concurrent.futures import Future
+from .autograd.tensor import Tensor
+
+
+class Batcher:
+  '''Runs the Model on batches of concurrent single example requests
+
+  Requests submitted from any number of threads or asyncio tasks are put in a queue.
+  A worker thread takes upto max_batch of them, waiting at most max_wait_ms after the
+  first one for more to arrive, stacks them and runs the Model once on the batch in
+  eval mode without tracking. Each request then gets its slice of the outputs
+
+  The Model should be used only through the Batcher while it's open, since eval mode
+  and tracking are set on the Model and the global graph
+
+  Parameters:
+    model (Model): Model to be run
+    max_batch (int): Maximum number of requests in a batch
+    max_wait_ms (float): Maximum time in milliseconds to wait for a batch to fill up
+    requests (queue.Queue): Queue of (inputs, Future) of the requests
+    worker (threading.Thread): Thread that runs the batches
+    closed (bool): Whether the Batcher has been closed
+
+  Raises:
+    ValueError: If max_batch is less than 1 or max_wait_ms is negative
+  '''
+  def __init__(self, model, max_batch=32, max_wait_ms=5):
+    '''
+    Args:
+      model (Model): Model to be run
+      max_batch (int): Maximum number of requests in a batch. Defaults to 32
+      max_wait_ms (float): Maximum time in milliseconds to wait for a batch to fill up.
+        Defaults to 5
+    '''
+    if max_batch<1:
+      raise ValueError("max_batch must be greater than or equal to 1")
+    if max_wait_ms<0:
+      raise ValueError("max_wait_ms must be greater than or equal to 0")
+    self.model = model
+    self.max_batch = max_batch
+    self.max_wait_ms = max_wait_ms
+    self.requests = queue.Queue()
+    self.closed = False
+    self.worker = threading.Thread(target=self.run, daemon=True)
+    self.worker.start()
+
+  def __call__(self, inputs):
+    '''Runs the Model on inputs and waits for its outputs
+
+    Args:
+      inputs (Tensor or np.ndarray): Single example, without the batch axis
+
+    Returns:
+      np.ndarray of the outputs for the example
+    '''
+    return self.submit(inputs).result()
+
+  def submit(self, inputs):
+    '''Queues inputs to be run in the next batch
+
+    Args:
+      inputs (Tensor or np.ndarray): Single example, without the batch axis
+
+    Returns:
+      Future that is set to the outputs for the example
+
+    Raises:
+      RuntimeError: If the Batcher has been closed
+    '''
+    if self.closed:
+      raise RuntimeError("Batcher has been closed")
+    future = Future()
+    self.requests.put((inputs.data if isinstance(inputs, Tensor) else np.asarray(inputs), future))
+    return future
+
+  async def predict_async(self, inputs):
+    '''Runs the Model on inputs from an asyncio task
+
+    Args:
+      inputs (Tensor or np.ndarray): Single example, without the batch axis
+
+    Returns:
+      np.ndarray of the outputs for the example
+    '''
+    return await asyncio.wrap_future(self.submit(inputs))
+
+  def get_batch(self):
+    '''Waits for the first request and gathers the ones that arrive within max_wait_ms
+
+    Returns:
+      list of (inputs, Future), which is empty if the Batcher has been closed
+    '''
+    request = self.requests.get()
+    if request is None:
+      return []
+    batch = [request]
+    deadline = time.perf_counter()+self.max_wait_ms/1000
+    while len(batch)<self.max_batch:
+      try:
+        request = self.requests.get(timeout=max(deadline-time.perf_counter(), 0))
+      except queue.Empty:
+        break
+      if request is None:
+        self.requests.put(None) # so that run stops after this batch
+        break
+      batch.append(request)
+    return batch
+
+  def run(self):
+    '''Runs the batches until the Batcher is closed
+
+    Cancelled requests are skipped. The requests of a batch are grouped by the shape
+    of their inputs and each group is run separately, so a request with an unexpected
+    shape doesn't fail the others
+    '''
+    while True:
+      batch = self.get_batch()
+      if not(batch):
+        return
+      groups = {}
+      for inputs, future in batch:
+        if future.set_running_or_notify_cancel():
+          groups.setdefault(inputs.shape, []).append((inputs, future))
+      for group in groups.values():
+        self.run_batch(group)
+
+  def run_batch(self, batch):
+    '''Runs the Model on a batch of requests whose inputs have the same shape
+
+    If the Model raises, then the exception is set on all the Futures of the batch
+
+    Args:
+      batch (list of (np.ndarray, Future)): Requests to be run
+    '''
+    futures = [future for _, future in batch]
+    try:
+      inputs = np.stack([inputs for inputs, _ in batch])
+      with self.model.eval():
+        outputs = self.model(inputs).data
+    except Exception as e:
+      for future in futures:
+        future.set_exception(e)
+      return
+    for future, example_outputs in zip(futures, outputs):
+      future.set_result(example_outputs)
+
+  def close(self):
+    '''Stops the worker after the queued requests have been run
+    '''
+    if not(self.closed):
+      self.closed = True
+      self.requests.put(None)
+      self.worker.join()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, exc_traceback):
+    self.close()
+
+  def __repr__(self):
+    return f'Batcher(max_batch={self.max_batch}, max_wait_ms={self.max_wait_ms})'
+
+  def __str__(self):
+    return f'Batcher(max_batch={self.max_batch}, max_wait_ms={self.max_wait_ms})'
+
+
+def benchmark(batcher, examples, num_clients=8):
+  '''Measures the throughput and latency of a Batcher
+
+  examples are split between num_clients threads, each sending its requests one after
+  the other and waiting for the outputs of each
+
+  Args:
+    batcher (Batcher or callable): Batcher, or anything that runs the Model on a single
+      example, like a function calling the Model directly to compare against
+    examples (np.ndarray): Examples stacked along the first axis
+    num_clients (int): Number of concurrent threads sending requests. Defaults to 8
+
+  Returns:
+    dict with the throughput in requests per second and the p50 and p99 latencies in
+    milliseconds
+  '''
+  latencies = []
+  lock = threading.Lock()
+  def client(client_examples):
+    client_latencies = []
+    for example in client_examples:
+      start = time.perf_counter()
+      batcher(example)
+      client_latencies.append(time.perf_counter()-start)
+    with lock:
+      latencies.extend(client_latencies)
+  clients = [threading.Thread(target=client, args=(client_examples,)) for client_examples in np.array_split(examples, num_clients)]
+  start = time.perf_counter()
+  for thread in clients:
+    thread.start()
+  for thread in clients:
+    thread.join()
+  elapsed = time.perf_counter()-start
+  latencies_ms = np.array(latencies)*1000
+  return {'throughput': len(examples)/elapsed, 'p50_latency_ms': float(np.percentile(latencies_ms, 50)),
+    'p99_latency_ms': float(np.percentile(latencies_ms, 99))}
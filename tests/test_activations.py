@@ -45,4 +45,20 @@ def test_softmax():
 # <------------LEAKYRELU------------>
 def test_leaky_relu():
   leaky_relu = LeakyReLU()
-  execute(leaky_relu, [f])
\ No newline at end of file
+  execute(leaky_relu, [f])
+
+# <------------SHARED LAYER------------>
+def test_shared_activation():
+  sigmoid = Sigmoid()
+  leaky_relu = LeakyReLU()
+  execute(lambda tens: sigmoid(sigmoid(tens)*3), [f])
+  execute(lambda tens: leaky_relu(leaky_relu(tens)-0.3), [f])
+
+
+# <------------PACKED MASKS------------>
+def test_packed_masks():
+  relu = ReLU(pack_mask=True)
+  leaky_relu = LeakyReLU(pack_mask=True)
+  execute(relu, [f])
+  execute(leaky_relu, [f])
+  execute(relu, [d-4.5])
@@ -2,6 +2,7 @@ import _setup
 from _setup import execute
 import numpy as np
 import neograd as ng
+from neograd.autograd.utils import get_graph
 
 
 a = np.array(3)
@@ -75,4 +76,15 @@ def test_flatten():
 
 # <------------RESHAPE------------>
 def test_reshape():
-  execute(ng.reshape, [g], new_shape=(2,3))
\ No newline at end of file
+  execute(ng.reshape, [g], new_shape=(2,3))
+
+
+# <------------IMMEDIATES------------>
+def test_immediates():
+  execute(lambda tens: ((1-tens)*2) + (tens/4) - 3 + (-tens)**2, [c])
+  with ng.new_graph():
+    tens = ng.tensor(c, requires_grad=True)
+    result = (2*tens) + ng.tensor(b) - 1
+    nodes = get_graph().nodes_dict
+    assert len(nodes)==4 # tens and the three results, constants never become nodes
+    assert all(node.tens.requires_grad for node in nodes.values())
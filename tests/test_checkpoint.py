@@ -0,0 +1,192 @@
+import _setup
+import os
+import sys
+import subprocess
+import json
+import shutil
+import numpy as np
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from neograd import nn
+from neograd.nn.storage import BlobStore
+
+
+class NN(nn.Model):
+  def __init__(self):
+    self.stack = nn.Sequential(nn.Linear(5,4), nn.ReLU(), nn.Linear(4,3))
+  
+  def forward(self, inputs):
+    return self.stack(inputs)
+
+
+def test_checkpoint(tmp_path):
+  model = NN()
+  checkpoint = nn.Checkpoint(model, str(tmp_path))
+  session = checkpoint.session
+  checkpoint.add(epoch=0, loss=1.5)
+  data = [param.data.copy() for param in model.parameters()]
+  for param in model.parameters():
+    param.data = param.data+1
+  checkpoint.add(epoch=1, loss=0.5)
+  fnames = [row[0] for row in checkpoint.index.execute('SELECT fname FROM checkpoints ORDER BY id')]
+  assert len(fnames)==2
+  checkpoint = nn.Checkpoint(model, str(tmp_path))
+  assert checkpoint.session==session
+  tracked = checkpoint.load(f'{fnames[0]}.hkl')
+  assert tracked['epoch']==0 and tracked['loss']==1.5 and 'datetime' in tracked
+  assert all(np.array_equal(param.data, param_data) for param, param_data in zip(model.parameters(), data))
+  checkpoint.new_session()
+  with pytest.raises(ValueError):
+    checkpoint.load(f'{fnames[0]}.hkl')
+  checkpoint.specify_session(session)
+  assert checkpoint.load(f'{fnames[1]}.hkl', load_params=False)['epoch']==1
+  with pytest.raises(ValueError):
+    checkpoint.specify_session('invalid')
+
+
+def test_checkpoint_json_import(tmp_path):
+  sessions = {'first': {'abc': {'loss': 1.0, 'datetime': 'now'}}, 'second': {'def': {'loss': 2.0, 'datetime': 'now'}}}
+  with open(tmp_path/'checkpoints.json', 'w') as fp:
+    json.dump(sessions, fp)
+  checkpoint = nn.Checkpoint(NN(), str(tmp_path))
+  assert checkpoint.session=='second'
+  assert checkpoint.load('def.hkl', load_params=False)['loss']==2.0
+  checkpoint.specify_session('first')
+  assert checkpoint.load('abc.hkl', load_params=False)['loss']==1.0
+
+
+def test_async_checkpoint(tmp_path):
+  model = NN()
+  checkpoint = nn.Checkpoint(model, str(tmp_path), async_writes=True, max_pending=1)
+  data = []
+  for epoch in range(3):
+    data.append([param.data.copy() for param in model.parameters()])
+    checkpoint.add(epoch=epoch)
+    for param in model.parameters():
+      param.data-=1 # modified in place while the previous checkpoint may be being written
+  checkpoint.wait()
+  fnames = [row[0] for row in checkpoint.index.execute('SELECT fname FROM checkpoints ORDER BY id')]
+  for fname, checkpoint_data in zip(fnames, data):
+    checkpoint.load(f'{fname}.hkl')
+    assert all(np.array_equal(param.data, param_data) for param, param_data in zip(model.parameters(), checkpoint_data))
+  shutil.rmtree(tmp_path/checkpoint.session)
+  checkpoint.add(epoch=3)
+  with pytest.raises(FileNotFoundError):
+    checkpoint.flush()
+  checkpoint.wait()
+  assert checkpoint.query(where={'epoch': 3})==[] # only checkpoints whose files were written are indexed
+
+
+def test_async_checkpoint_exit(tmp_path):
+  script = f'''
+import sys
+sys.path.insert(0, {os.path.dirname(os.path.dirname(os.path.abspath(__file__)))!r})
+from neograd import nn
+class NN(nn.Model):
+  def __init__(self):
+    self.stack = nn.Sequential(nn.Linear(5,4), nn.ReLU(), nn.Linear(4,3))
+checkpoint = nn.Checkpoint(NN(), {str(tmp_path)!r}, async_writes=True)
+for epoch in range(2):
+  checkpoint.add(epoch=epoch)
+'''
+  subprocess.run([sys.executable, '-c', script], check=True)
+  checkpoint = nn.Checkpoint(NN(), str(tmp_path))
+  fnames = checkpoint.query()
+  assert len(fnames)==2
+  for fname in fnames:
+    checkpoint.load(fname)
+
+
+def test_deduplicated_checkpoint(tmp_path):
+  for async_writes in (False, True):
+    model = NN()
+    model.stack.layers[0].freeze()
+    checkpoint = nn.Checkpoint(model, str(tmp_path/str(async_writes)), async_writes=async_writes, deduplicate=True)
+    data = []
+    for epoch in range(3):
+      data.append([param.data.copy() for param in model.parameters()])
+      checkpoint.add(epoch=epoch)
+      model.stack.layers[2].weights.data-=1
+    checkpoint.wait()
+    assert len(os.listdir(tmp_path/str(async_writes)/'blobs'))==1+2+3 # frozen weights and both biases once, unfrozen weights per epoch
+    fnames = [row[0] for row in checkpoint.index.execute('SELECT fname FROM checkpoints ORDER BY id')]
+    for fname, checkpoint_data in zip(fnames, data):
+      checkpoint.load(f'{fname}.hkl')
+      assert all(np.array_equal(param.data, param_data) for param, param_data in zip(model.parameters(), checkpoint_data))
+
+  model = NN()
+  model.stack.layers[0].freeze()
+  checkpoint = nn.Checkpoint(model, str(tmp_path/'in_place'), deduplicate=True)
+  checkpoint.add(epoch=1)
+  model.stack.layers[0].weights.data[...] = 7 # same array, so only its contents changed
+  checkpoint.add(epoch=2)
+  model.stack.layers[0].weights.data[...] = 0
+  checkpoint.load(checkpoint.query(where={'epoch': 2})[0])
+  assert np.all(model.stack.layers[0].weights.data==7)
+
+
+def test_blob_store_concurrent_puts(tmp_path):
+  blobs = BlobStore(str(tmp_path))
+  data = np.zeros((256,256))
+  with ThreadPoolExecutor(8) as pool:
+    digests = set(pool.map(lambda _:blobs.put(data), range(64)))
+  assert len(digests)==1 and os.listdir(tmp_path)==[f'{digests.pop()}.npy']
+
+
+def test_compressed_checkpoint(tmp_path):
+  model = NN()
+  checkpoint = nn.Checkpoint(model, str(tmp_path), codec='lzma')
+  data = [param.data.copy() for param in model.parameters()]
+  checkpoint.add(epoch=0)
+  for param in model.parameters():
+    param.data = param.data+1
+  fname = checkpoint.index.execute('SELECT fname FROM checkpoints').fetchone()[0]
+  checkpoint.load(f'{fname}.hkl')
+  assert all(np.array_equal(param.data, param_data) for param, param_data in zip(model.parameters(), data))
+  with pytest.raises(ValueError):
+    nn.Checkpoint(model, str(tmp_path), deduplicate=True, codec='zlib')
+
+
+def test_sharded_checkpoint(tmp_path):
+  model = NN()
+  checkpoint = nn.Checkpoint(model, str(tmp_path), sharded=True, max_shard_size=64)
+  data = [param.data.copy() for param in model.parameters()]
+  checkpoint.add(epoch=0)
+  for param in model.parameters():
+    param.data = param.data+1
+  fname = checkpoint.index.execute('SELECT fname FROM checkpoints').fetchone()[0]
+  assert os.path.exists(f'{tmp_path}/{checkpoint.session}/{fname}/manifest.json')
+  checkpoint.load(f'{fname}.hkl')
+  assert all(np.array_equal(param.data, param_data) for param, param_data in zip(model.parameters(), data))
+  with pytest.raises(ValueError):
+    nn.Checkpoint(model, str(tmp_path), sharded=True, codec='zlib')
+
+
+def test_checkpoint_queries(tmp_path):
+  model = NN()
+  checkpoint = nn.Checkpoint(model, str(tmp_path))
+  losses = [0.9, 0.3, 0.5, 0.1, 0.7]
+  data = {}
+  for epoch, loss in enumerate(losses):
+    checkpoint.add(epoch=epoch, loss=loss, phase='warmup' if epoch<2 else 'train', notes={'lr': 0.1})
+    fname = checkpoint.query(where={'epoch': epoch})[0]
+    data[fname] = [param.data.copy() for param in model.parameters()]
+    for param in model.parameters():
+      param.data = param.data+1
+  fnames = checkpoint.query()
+  assert len(fnames)==5
+  assert checkpoint.best('loss')==[fnames[3]]
+  assert checkpoint.best('loss', mode='max', k=2)==[fnames[0], fnames[4]]
+  assert checkpoint.best('epoch', k=10)==fnames
+  assert checkpoint.query(where={'loss': ('<', 0.6), 'phase': 'train'})==[fnames[2], fnames[3]]
+  assert checkpoint.query(where={'loss': ('>=', 0.5), 'epoch': ('!=', 0)})==[fnames[2], fnames[4]]
+  assert checkpoint.best('notes')==[]
+  checkpoint.load(checkpoint.best('loss')[0])
+  assert all(np.array_equal(param.data, param_data) for param, param_data in zip(model.parameters(), data[fnames[3]]))
+  session = checkpoint.session
+  checkpoint.new_session()
+  assert checkpoint.query()==[] and checkpoint.best('loss', session=session)==[fnames[3]]
+  with pytest.raises(ValueError):
+    checkpoint.best('loss', mode='lowest')
+  with pytest.raises(ValueError):
+    checkpoint.query(where={'loss': ('LIKE', 0.5)})
@@ -3,19 +3,33 @@ from _setup import execute
 import numpy as np
 import neograd as ng
 from neograd import nn
+from neograd.nn.loss import MSE
 
 
 # <------------DROPOUT------------>
+def fixed_mask(dropout, fn=None):
+  '''Resets the counter before each call, so that the same mask is used while gradient checking
+  '''
+  def fixed_fn(inputs):
+    dropout.counter = 0
+    return (dropout if fn is None else fn)(inputs)
+  return fixed_fn
+
 def test_dropout():
   input_data = np.random.randn(7,5)
   fn1 = nn.Dropout(0.5)
   fn2 = nn.Dropout(0.3)
   fn3 = nn.Dropout(0.7)
   fn4 = nn.Dropout(1)
-  execute(fn1, [input_data])
-  execute(fn2, [input_data])
-  execute(fn3, [input_data])
-  execute(fn4, [input_data])
+  execute(fixed_mask(fn1), [input_data])
+  execute(fixed_mask(fn2), [input_data])
+  execute(fixed_mask(fn3), [input_data])
+  execute(fixed_mask(fn4), [input_data])
+  fn5 = nn.Dropout(0.5, seed=0)
+  outputs = fn5(ng.tensor(np.ones((100,100))))
+  assert set(np.unique(outputs.data))=={0,2}
+  assert fn5.counter==1
+  assert np.array_equal(fn5.generate_mask(0, (100,100)), outputs.data!=0)
 
 
 # <------------LINEAR------------>
@@ -67,4 +81,81 @@ def test_maxpool2d():
 def test_maxpool3d():
   input_data = np.random.randn(2,3,12,15)
   fn1 = nn.MaxPool3D((3,3), stride=3)
-  execute(fn1, [input_data], fn1.parameters())
\ No newline at end of file
+  execute(fn1, [input_data], fn1.parameters())
+
+# <------------MAXPOOL INDICES------------>
+def test_maxpool_indices():
+  input_data = np.random.randn(2,3,12,16)
+  fn1 = nn.MaxPool3D((4,4), stride=4)
+  fn2 = nn.MaxPool3D((12,16), stride=1)
+  execute(fn1, [input_data], fn1.parameters())
+  execute(fn2, [input_data], fn2.parameters())
+
+
+# <------------ACTIVATION CHECKPOINT------------>
+def test_activation_checkpoint():
+  input_data = np.random.randn(4,5)
+  fn1 = nn.Sequential(nn.Linear(5,4), nn.Tanh(), nn.Linear(4,4), nn.Sigmoid(), nn.Linear(4,3), checkpoint_every=2)
+  execute(fn1, [input_data], fn1.parameters(), tolerance=3e-7)
+  dropout = nn.Dropout(0.5)
+  fn2 = nn.ActivationCheckpoint(nn.Sequential(nn.Linear(5,4), dropout, nn.Sigmoid()))
+  execute(fixed_mask(dropout, fn2), [input_data], fn2.parameters(), tolerance=3e-7)
+
+
+# <------------BATCHNORM------------>
+def test_batchnorm():
+  fn1 = nn.BatchNorm(4)
+  fn2 = nn.BatchNorm(3)
+  execute(fn1, [np.random.randn(6,4)], fn1.parameters(), tolerance=3e-7)
+  execute(fn2, [np.random.randn(2,3,4,5)], fn2.parameters(), tolerance=3e-7)
+  fn2.eval = True
+  execute(fn2, [np.random.randn(2,3,4,5)], fn2.parameters(), tolerance=3e-7)
+  inputs = np.random.randn(2,3,4,5)
+  outputs = fn2(inputs).data
+  expected = (inputs-fn2.running_mean.data.reshape(1,3,1,1))/np.sqrt(fn2.running_var.data.reshape(1,3,1,1)+fn2.epsilon)
+  assert np.allclose(outputs, expected)
+
+  inputs = 1e8+np.random.randn(64,3) # E[x^2]-E[x]^2 loses all the digits of the variance
+  fn3 = nn.BatchNorm(3)
+  fn3(inputs)
+  assert np.allclose(fn3.running_var.data, 0.9+0.1*np.var(inputs, axis=0))
+  fn4, fn5 = nn.BatchNorm(3), nn.BatchNorm(3)
+  fn6 = nn.ActivationCheckpoint(nn.Sequential(nn.Linear(3,3), fn5))
+  fn6.segment.layers[0].weights.data = np.eye(3)
+  inputs = 3+np.random.randn(8,3)
+  expected = fn4(inputs)
+  outputs = fn6(ng.tensor(inputs, requires_grad=True))
+  outputs.backward(np.ones(outputs.shape)) # runs the segment again
+  assert np.allclose(outputs.data, expected.data)
+  assert np.allclose(fn5.running_mean.data, fn4.running_mean.data) and np.allclose(fn5.running_var.data, fn4.running_var.data)
+  fn4, fn5 = nn.BatchNorm(3), nn.BatchNorm(3)
+  fn6 = nn.ActivationCheckpoint(nn.Sequential(nn.Linear(3,3), fn5))
+  fn6.segment.layers[0].weights.data = np.eye(3)
+  fn6.freeze()
+  fn6.unfreeze()
+  assert not(fn5.running_mean.requires_grad) and not(fn5.running_var.requires_grad) and fn5.weights.requires_grad
+  expected = fn4(inputs)
+  outputs = fn6(ng.tensor(inputs, requires_grad=True))
+  outputs.backward(np.ones(outputs.shape))
+  assert np.allclose(outputs.data, expected.data)
+  assert np.allclose(fn5.running_mean.data, fn4.running_mean.data) and np.allclose(fn5.running_var.data, fn4.running_var.data)
+
+
+# <------------FUSE------------>
+def test_fuse():
+  input_data = np.random.randn(4,5)
+  fn1 = nn.Sequential(nn.Linear(5,4), nn.LeakyReLU(), nn.Linear(4,4), nn.ReLU(), nn.Linear(4,3), nn.Tanh()).fuse()
+  assert all(isinstance(layer, nn.FusedLinear) for layer in fn1.segments)
+  execute(fn1, [input_data], fn1.parameters(), tolerance=3e-7)
+  fn2 = nn.Sequential(nn.Conv2D((3,3)), nn.ReLU(), nn.MaxPool2D((2,2), stride=2), nn.Conv2D((2,2)), nn.Sigmoid()).fuse()
+  assert [type(layer) for layer in fn2.segments]==[nn.FusedConv, nn.FusedConv]
+  execute(fn2, [np.random.randn(2,10,10)], fn2.parameters(), tolerance=3e-7)
+  fn3 = nn.Sequential(nn.Conv3D(2,3,(3,3)), nn.LeakyReLU(), nn.MaxPool3D((2,2), stride=2), checkpoint_every=3).fuse()
+  execute(fn3, [np.random.randn(2,2,10,12)], fn3.parameters(), tolerance=3e-7)
+  fn4 = nn.Sequential(nn.Conv2D((3,3)), nn.ReLU(), nn.MaxPool2D((2,2), stride=2))
+  inputs = np.random.randn(2,10,12)
+  outputs = fn4(inputs).data
+  assert np.allclose(outputs, fn4.fuse()(inputs).data)
+  fn5 = nn.Sequential(nn.Linear(5,4), nn.ReLU(), nn.Linear(4,3)).fuse()
+  MSE()(fn5(input_data), ng.tensor(np.random.randn(4,3))).backward() # np.ndarray inputs are immediates
+  assert all(np.any(param.grad) for param in fn5.parameters())
@@ -2,11 +2,13 @@ import _setup
 from _setup import execute
 import numpy as np
 import neograd as ng
-from neograd.nn.loss import BCE, CE, MSE, SoftmaxCE
+from neograd.nn.loss import BCE, BCEWithLogits, CE, MSE, SoftmaxCE, NLL
 from neograd.nn.activations import Softmax
 
 
 inputs = np.random.randn(10,5)
+probs = 1/(1+np.exp(-inputs))
+binary_targets = np.random.randint(low=0, high=2, size=(10,5))
 def fn(inputs):
   # Returns inputs themselves because, we're only testing the loss function
   return inputs
@@ -14,7 +16,17 @@ def fn(inputs):
 
 # <------------BCE------------>
 def test_bce():
-  execute(fn, [inputs], loss_fn=BCE())
+  execute(fn, [probs], loss_fn=BCE())
+  execute(fn, [probs], targets=ng.tensor(binary_targets), loss_fn=BCE())
+  execute(lambda outputs, targets: BCE()(outputs, targets), [probs, np.random.rand(10,5)])
+
+
+# <------------BCEWITHLOGITS------------>
+def test_bce_with_logits():
+  execute(fn, [inputs], targets=ng.tensor(binary_targets), loss_fn=BCEWithLogits())
+  loss = BCEWithLogits()(ng.tensor(inputs), ng.tensor(binary_targets)).data
+  assert np.allclose(loss, BCE()(ng.tensor(probs), ng.tensor(binary_targets)).data)
+  assert np.isfinite(BCEWithLogits()(ng.tensor([[1000.], [-1000.]]), ng.tensor([[0.], [1.]])).data)
 
 
 # <------------CE------------>
@@ -25,8 +37,35 @@ def test_ce():
 # <------------MSE------------>
 def test_mse():
   execute(fn, [inputs], loss_fn=MSE())
+  execute(lambda outputs, targets: MSE()(outputs, targets), [inputs, np.random.randn(5)])
 
 
 # <------------SoftmaxCE------------>
 def test_softmaxce():
-  execute(fn, [inputs], targets=ng.tensor(np.eye(5)[np.random.randint(low=0,high=4)]), loss_fn=SoftmaxCE(axis=1))
\ No newline at end of file
+  execute(fn, [inputs], targets=ng.tensor(np.eye(5)[np.random.randint(low=0,high=4)]), loss_fn=SoftmaxCE(axis=1))
+
+
+# <------------LABELS------------>
+labels = np.random.randint(low=0, high=5, size=10)
+
+def test_softmaxce_labels():
+  execute(fn, [inputs], targets=ng.tensor(labels), loss_fn=SoftmaxCE(axis=1))
+  execute(fn, [inputs.T], targets=labels, loss_fn=SoftmaxCE(axis=0))
+  loss = SoftmaxCE(axis=1)(ng.tensor(inputs), ng.tensor(labels)).data
+  assert np.allclose(loss, SoftmaxCE(axis=1)(ng.tensor(inputs), ng.tensor(np.eye(5)[labels])).data)
+  grads = []
+  for targets in (labels, np.eye(5)[labels]):
+    outputs = ng.tensor(inputs, requires_grad=True)
+    loss = SoftmaxCE(axis=1)(outputs, ng.tensor(targets))
+    loss.backward(retain_graph=True)
+    loss.backward() # 1 is subtracted at the labels only once
+    grads.append(outputs.grad)
+  assert np.allclose(grads[0], grads[1])
+
+
+def test_nll():
+  log_probs = np.log(Softmax.calc_softmax(inputs, axis=1))
+  execute(fn, [log_probs], targets=ng.tensor(labels), loss_fn=NLL(axis=1))
+  execute(fn, [log_probs], targets=ng.tensor(np.eye(5)[labels]), loss_fn=NLL(axis=1))
+  loss = NLL(axis=1)(ng.tensor(log_probs), ng.tensor(labels)).data
+  assert np.allclose(loss, SoftmaxCE(axis=1)(ng.tensor(inputs), ng.tensor(labels)).data)
@@ -0,0 +1,365 @@
+import _setup
+import os
+import json
+import pickle
+import numpy as np
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+import neograd as ng
+from neograd import nn
+from neograd.nn.loss import MSE
+from neograd.nn.utils import train_step
+from neograd.nn.storage import save_chunked
+from neograd.nn.optim import GD, Momentum, RMSProp, Adam, StateBuffer, LossScaler
+
+
+class NN(nn.Model):
+  def __init__(self):
+    self.stack = nn.Sequential(nn.Linear(5,4), nn.ReLU(), nn.Linear(4,3))
+  
+  def forward(self, inputs):
+    return self.stack(inputs)
+
+
+# <------------FLATTEN_PARAMETERS------------>
+def test_flatten_parameters():
+  inputs, targets = ng.tensor(np.random.randn(6,5)), ng.tensor(np.random.randn(6,3))
+  model, flat_model = NN(), NN()
+  flat_model.stack.set_params(model.stack.parameters(as_dict=True))
+  flat_data, flat_grad = flat_model.flatten_parameters()
+  assert flat_data.size==sum(param.data.size for param in flat_model.parameters())
+  assert all(np.shares_memory(param.data, flat_data) for param in flat_model.parameters())
+  for mdl in (model, flat_model):
+    optim = GD(mdl.parameters(), 0.1)
+    for _ in range(2):
+      optim.zero_grad()
+      MSE()(mdl(inputs), targets).backward()
+      optim.step()
+  for param, flat_param in zip(model.parameters(), flat_model.parameters()):
+    assert np.allclose(param.data, flat_param.data)
+    assert np.allclose(param.grad, flat_param.grad)
+  assert np.allclose(flat_grad, np.concatenate([param.grad.ravel() for param in model.parameters()]))
+  assert all(np.shares_memory(param.grad, flat_grad) for param in flat_model.parameters())
+  flat_model.head = nn.Linear(3,1)
+  assert flat_model.flat_data is None and len(flat_model.parameters())==6
+  flat_model = NN()
+  flat_model.flatten_parameters()
+  assert flat_model.flat_data is not None
+  flat_model.stack.layers = flat_model.stack.layers+(nn.Linear(3,2),) # inside of a Container
+  assert flat_model.flat_data is None and flat_model.flat_grad is None and len(flat_model.parameters())==6
+
+
+# <------------OPTIM------------>
+def reference_step(optim, params, grads, state, iter):
+  '''Out of place update of the params, following the formulae of the optimizers
+  '''
+  for i, (param, grad) in enumerate(zip(params, grads)):
+    m, v = state.get(i, (0, 0))
+    if isinstance(optim, GD):
+      param -= optim.lr*grad
+    elif isinstance(optim, Momentum):
+      m = optim.beta*m + (1-optim.beta)*grad
+      param -= optim.lr*m
+    elif isinstance(optim, RMSProp):
+      v = optim.beta*v + (1-optim.beta)*np.square(grad)
+      param -= optim.lr*(grad/(np.sqrt(v)+optim.epsilon))
+    else:
+      m = optim.beta1*m + (1-optim.beta1)*grad
+      v = optim.beta2*v + (1-optim.beta2)*np.square(grad)
+      param -= optim.lr*((m/(1-optim.beta1**iter))/(np.sqrt(v/(1-optim.beta2**iter))+optim.epsilon))
+    state[i] = (m, v)
+
+def test_optimizers():
+  inputs, targets = ng.tensor(np.random.randn(6,5)), ng.tensor(np.random.randn(6,3))
+  for optim_cls in (GD, Momentum, RMSProp, Adam):
+    for flatten in (False, True):
+      model = NN()
+      if flatten:
+        model.flatten_parameters()
+      model.stack.layers[2].bias.freeze()
+      optim = optim_cls(model.parameters(), 0.01)
+      expected = [param.data.copy() for param in model.parameters()]
+      state = {}
+      for iter in range(1, 4):
+        optim.zero_grad()
+        MSE()(model(inputs), targets).backward()
+        trainable = [(data, param.grad) for data, param in zip(expected, model.parameters()) if param.requires_grad]
+        reference_step(optim, *zip(*trainable), state, iter)
+        optim.step()
+      for param, data in zip(model.parameters(), expected):
+        assert np.allclose(param.data, data)
+      assert all(not(hasattr(param, 'momentum_grad')) for param in model.parameters())
+      if flatten:
+        assert len(optim.get_groups())==1
+
+def test_compressed_optimizer_state():
+  values = np.random.randn(1000)
+  for precision, tolerance in (('float16', 1e-3), ('int8', 1e-2)):
+    buffer = StateBuffer(values.size, precision, block_size=64)
+    buffer.set(0, values.size, values)
+    assert np.allclose(buffer.get(0, values.size), values, atol=tolerance*np.abs(values).max())
+    buffer.set(100, 130, np.zeros(30)) # partially covers blocks
+    assert np.all(buffer.get(100, 130)==0) and np.allclose(buffer.get(0, 100), values[:100], atol=tolerance*np.abs(values).max())
+  rms_buffer = StateBuffer(4, 'int8', sqrt=True)
+  rms_buffer.set(0, 4, np.array([1e-12, 0, 4, 1]))
+  rms = rms_buffer.get(0, 4)
+  assert rms[0]>0 and rms[1]==0 and np.isclose(rms[2], 4)
+  rng = np.random.RandomState(1) # the same data every run, so the losses are compared deterministically
+  inputs = ng.tensor(rng.randn(32,5))
+  targets = ng.tensor(rng.randn(32,3))
+  for flatten in (False, True):
+    losses = {}
+    for precision in (None, 'float16', 'int8'):
+      np.random.seed(0)
+      model = NN()
+      if flatten:
+        model.flatten_parameters()
+      optim = Adam(model.parameters(), 0.01, state_precision=precision)
+      optim.chunk_size = 16
+      for _ in range(50):
+        optim.zero_grad()
+        loss = MSE()(model(inputs), targets)
+        loss.backward()
+        optim.step()
+      losses[precision] = loss.data
+    assert np.isclose(losses['float16'], losses[None], rtol=1e-2)
+    assert np.isclose(losses['int8'], losses[None], rtol=5e-2)
+
+
+# <------------TRAIN_STEP------------>
+def test_train_step():
+  inputs, targets = ng.tensor(np.random.randn(10,5)), ng.tensor(np.random.randn(10,3))
+  model, micro_model = NN(), NN()
+  micro_model.stack.set_params(model.stack.parameters(as_dict=True))
+  optim, micro_optim = Adam(model.parameters(), 0.01), Adam(micro_model.parameters(), 0.01)
+  for _ in range(3):
+    loss = train_step(model, MSE(), optim, inputs, targets)
+    micro_loss = train_step(micro_model, MSE(), micro_optim, inputs, targets, micro_batch_size=3)
+    assert np.isclose(loss, micro_loss)
+    for param, micro_param in zip(model.parameters(), micro_model.parameters()):
+      assert np.allclose(param.grad, micro_param.grad)
+      assert np.allclose(param.data, micro_param.data)
+
+
+# <------------MIXED PRECISION------------>
+def test_mixed_precision():
+  inputs, targets = ng.tensor(np.random.randn(8,5)), ng.tensor(np.random.randn(8,3))
+  model, amp_model = NN(), NN()
+  amp_model.stack.set_params(model.stack.parameters(as_dict=True))
+  MSE()(model(inputs), targets).backward()
+  with ng.autocast(np.float32):
+    outputs = amp_model(inputs)
+  assert outputs.data.dtype==np.float32
+  scaler = LossScaler(GD(amp_model.parameters(), 0.1))
+  scaler.backward(MSE()(outputs, targets))
+  for param, amp_param in zip(model.parameters(), amp_model.parameters()):
+    assert amp_param.data.dtype==np.float64 and amp_param.grad.dtype==np.float64
+    assert np.allclose(param.grad*scaler.scale, amp_param.grad, rtol=1e-4)
+  assert scaler.step()
+  for param, amp_param in zip(model.parameters(), amp_model.parameters()):
+    assert np.allclose(param.data-(0.1*param.grad), amp_param.data, rtol=1e-4)
+  data = [param.data.copy() for param in amp_model.parameters()]
+  scaler.scale = 1e300 # overflows float16
+  scaler.optim.zero_grad()
+  with ng.autocast(np.float16):
+    scaler.backward(MSE()(amp_model(inputs), targets))
+  assert not(scaler.step()) and scaler.scale==5e299
+  assert all(np.all(param.data==param_data) for param, param_data in zip(amp_model.parameters(), data))
+  assert ng.tensor(np.ones(3, dtype=np.float32)).data.dtype==np.float64 # low precision is kept only under autocast
+  with ng.autocast(np.float16):
+    with ThreadPoolExecutor(1) as pool:
+      other_thread_outputs = pool.submit(model, inputs).result()
+    outputs = model(inputs)
+  assert other_thread_outputs.data.dtype==np.float64 and outputs.data.dtype==np.float16
+
+
+# <------------QUANTIZE------------>
+class ConvNN(nn.Model):
+  def __init__(self):
+    self.conv = nn.Sequential(nn.Conv2D((3,3)), nn.ReLU())
+    self.conv3d = nn.Sequential(nn.Conv3D(1,3,(3,3)), nn.ReLU(), nn.MaxPool3D((2,2))).fuse()
+  
+  def forward(self, inputs):
+    outputs = self.conv(inputs)
+    return self.conv3d(ng.reshape(outputs, (outputs.shape[0], 1, *outputs.shape[1:])))
+
+
+def test_quantize():
+  for model, inputs in ((NN(), np.random.randn(64,5)), (ConvNN(), np.random.randn(4,10,10))):
+    with model.eval():
+      outputs = model(inputs).data
+    layers = model.quantize(np.array_split(inputs, 4))
+    assert len(layers)==2
+    for layer in layers:
+      assert layer.quantized_weights.dtype==np.int8 and layer.quantized_weights.nbytes*8==layer.weights.data.nbytes
+    with model.eval():
+      quantized_outputs = model(inputs).data
+    assert np.abs(quantized_outputs-outputs).max()<0.05*np.abs(outputs).max()
+    assert np.allclose(model(inputs).data, outputs) # outside of eval the Params are used
+  model = NN()
+  linear = model.stack.layers[0]
+  model.quantize([np.random.randn(8,5)])
+  assert linear.weights_scale.shape==(1,4) and linear.inputs_scale>0
+  linear.dequantize()
+  assert not(linear.is_quantized())
+  model, inputs = ConvNN(), np.random.randn(4,10,10)
+  model.flatten_parameters()
+  model.quantize([inputs])
+  with model.eval():
+    outputs = model(inputs).data
+  model.quantize([inputs], inference_only=True)
+  assert len(model.parameters())==2 and model.flat_data.size==1+3 # only the biases are left
+  assert np.allclose(model(inputs).data, outputs) # int8 is run outside of eval too
+  with pytest.raises(ValueError):
+    model.quantize([inputs])
+  linear = nn.Linear(2000,2) # 127**2*2000 is over 2**24, so float32 wouldn't be exact
+  inputs = np.random.randn(4,2000)
+  linear.calibrating = True
+  linear(inputs)
+  linear.calibrating = False
+  linear.quantize()
+  assert linear.accumulation_dtype=='float64'
+  expected = np.dot(linear.quantize_inputs(inputs).astype(np.int64), linear.quantized_weights.astype(np.int64))
+  assert np.array_equal(linear.quantized_forward(linear.quantize_inputs(inputs)), expected*(linear.inputs_scale*linear.weights_scale)+linear.bias.data)
+
+
+# <------------EXPORT------------>
+class ExportNN(nn.Model):
+  def __init__(self):
+    self.stack = nn.Sequential(nn.Conv3D(1,2,(3,3)), nn.LeakyReLU(0.1), nn.MaxPool3D((2,2)), nn.Flatten(), nn.Linear(50,6),
+      nn.BatchNorm(6), nn.Tanh(), nn.Dropout(0.5), nn.Linear(6,3), nn.Softmax(1), checkpoint_every=2)
+  
+  def forward(self, inputs):
+    return self.stack(inputs)
+
+
+def test_export(tmp_path):
+  model, inputs = NN(), np.random.randn(6,5)
+  model.export(str(tmp_path/'model'))
+  exported = nn.load_exported(str(tmp_path/'model'))
+  with model.eval():
+    assert np.allclose(exported(inputs).data, model(inputs).data)
+  assert all(not(param.requires_grad) for param in exported.parameters())
+  with exported.eval():
+    pass
+  assert exported.stack.layers[0].eval
+  model, inputs = ExportNN(), np.random.randn(4,1,8,8)
+  model(inputs) # updates the running stats of BatchNorm
+  model.export(str(tmp_path/'conv'))
+  exported = nn.load_exported(str(tmp_path/'conv'))
+  assert [type(layer) for layer in exported.stack.layers[:4]]==[nn.Conv3D, nn.LeakyReLU, nn.MaxPool3D, nn.Flatten]
+  assert exported.stack.layers[5].running_var is not model.stack.layers[5].running_var
+  for param, exported_param in zip(model.parameters(), exported.parameters()):
+    assert np.array_equal(param.data, exported_param.data)
+  with model.eval():
+    assert np.allclose(exported(inputs).data, model(inputs).data)
+  with pytest.raises(ValueError):
+    ConvNN().export(str(tmp_path/'branched'))
+  model, inputs = NN(), np.random.randn(16,5)
+  model.quantize([inputs])
+  model.export(str(tmp_path/'quantized'))
+  exported = nn.load_exported(str(tmp_path/'quantized'))
+  assert exported.stack.layers[0].quantized_weights.dtype==np.int8
+  with model.eval():
+    assert np.allclose(exported(inputs).data, model(inputs).data)
+  model.stack.layers = (nn.FusedLinear(nn.Linear(5,4), nn.ReLU()), nn.Linear(4,3))
+  with pytest.raises(TypeError):
+    model.export(str(tmp_path/'fused'))
+
+
+# <------------SAVE_NPY------------>
+def test_save_npy(tmp_path):
+  model, inputs = NN(), np.random.randn(6,5)
+  assert list(model.named_parameters())==['stack.0.weights', 'stack.0.bias', 'stack.2.weights', 'stack.2.bias']
+  model.save_npy(str(tmp_path))
+  with model.eval():
+    outputs = model(inputs).data
+  mapped_model, loaded_model = NN(), NN()
+  mapped_model.load_npy(str(tmp_path), mmap=True)
+  assert all(isinstance(param.data, np.memmap) for param in mapped_model.parameters())
+  flat_data, _ = loaded_model.flatten_parameters()
+  loaded_model.load_npy(str(tmp_path))
+  assert all(np.shares_memory(param.data, flat_data) for param in loaded_model.parameters())
+  for mdl in (mapped_model, loaded_model):
+    with mdl.eval():
+      assert np.array_equal(mdl(inputs).data, outputs)
+  fpath = tmp_path/'stack.0.weights.npy'
+  with open(fpath, 'r+b') as fp:
+    fp.truncate(os.path.getsize(fpath)-8)
+  with pytest.raises(ValueError):
+    loaded_model.load_npy(str(tmp_path))
+
+
+# <------------PICKLE------------>
+def test_pickle(tmp_path):
+  model, inputs = NN(), np.random.randn(6,5)
+  model.stack.layers[0].freeze()
+  model.stack.fuse()
+  with model.eval():
+    outputs = model(inputs).data
+  if pickle.HIGHEST_PROTOCOL>=5:
+    buffers = []
+    pickled = pickle.dumps(model, protocol=5, buffer_callback=buffers.append)
+    assert len(buffers)==4
+    unpickled = pickle.loads(pickled, buffers=buffers)
+  else: # Python 3.7 has no out of band buffers
+    unpickled = pickle.loads(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL))
+  for param, unpickled_param in zip(model.parameters(), unpickled.parameters()):
+    assert np.shares_memory(param.data, unpickled_param.data) or pickle.HIGHEST_PROTOCOL<5
+    assert param.requires_grad==unpickled_param.requires_grad and unpickled_param.grad_fn is None
+  assert unpickled.stack.segments[0].linear.weights is unpickled.stack.layers[0].weights
+  unpickled.stack.layers[0].unfreeze()
+  assert unpickled.stack.layers[0].weights.requires_grad
+  ng.save(str(tmp_path/'model.pkl'), model)
+  loaded = ng.load(str(tmp_path/'model.pkl'))
+  with loaded.eval():
+    assert np.array_equal(loaded(inputs).data, outputs)
+
+
+# <------------SAVE_COMPRESSED------------>
+def test_save_compressed(tmp_path):
+  model = ConvNN()
+  data = [param.data.copy() for param in model.parameters()]
+  for codec in ('zlib', 'lzma', 'bz2'):
+    for shuffle in (False, True):
+      model.save_compressed(str(tmp_path/'model.ngc'), codec, shuffle, chunk_size=40, num_workers=3)
+      loaded_model = ConvNN()
+      flat_data, _ = loaded_model.flatten_parameters()
+      loaded_model.load_compressed(str(tmp_path/'model.ngc'), num_workers=2)
+      assert all(np.array_equal(param.data, param_data) for param, param_data in zip(loaded_model.parameters(), data))
+      assert all(np.shares_memory(param.data, flat_data) for param in loaded_model.parameters())
+  with pytest.raises(ValueError):
+    model.save_compressed(str(tmp_path/'model.ngc'), 'gzip')
+  with pytest.raises(TypeError): # object arrays have no bytes to compress, so the write fails midway
+    save_chunked(str(tmp_path/'failed.ngc'), {'weights': np.ones(3), 'objects': np.array([None, 1])})
+  assert sorted(os.listdir(tmp_path))==['model.ngc'] # no partial or temporary file is left
+  with pytest.raises(ValueError):
+    NN().load_compressed(str(tmp_path/'model.ngc'))
+
+
+# <------------SAVE_SHARDED------------>
+def test_save_sharded(tmp_path):
+  model = ConvNN()
+  data = [param.data.copy() for param in model.parameters()]
+  for max_shard_size, num_shards in ((None, 2), (8, 4)):
+    dirpath = str(tmp_path/f'sharded_{max_shard_size}')
+    model.save_sharded(dirpath, max_shard_size, num_workers=2)
+    with open(f'{dirpath}/manifest.json') as fp:
+      assert len(json.load(fp)['shards'])==num_shards
+    loaded_model = ConvNN()
+    flat_data, _ = loaded_model.flatten_parameters()
+    loaded_model.load_sharded(dirpath, num_workers=2)
+    assert all(np.array_equal(param.data, param_data) for param, param_data in zip(loaded_model.parameters(), data))
+    assert all(np.shares_memory(param.data, flat_data) for param in loaded_model.parameters())
+  loaded_model = ConvNN()
+  os.remove(str(tmp_path/'sharded_None'/'shard-00000.bin')) # only the shard of conv3d is read
+  loaded_model.load_sharded(str(tmp_path/'sharded_None'), prefix='conv3d')
+  assert all(np.array_equal(param.data, param_data) for param, param_data in zip(loaded_model.conv3d.parameters(), data[2:]))
+  assert not(np.array_equal(loaded_model.conv.parameters()[0].data, data[0]))
+  with pytest.raises(ValueError):
+    NN().load_sharded(str(tmp_path/'sharded_8'))
+  fpath = tmp_path/'sharded_8'/'shard-00003.bin'
+  with open(fpath, 'r+b') as fp:
+    fp.truncate(os.path.getsize(fpath)-8)
+  with pytest.raises(ValueError):
+    ConvNN().load_sharded(str(tmp_path/'sharded_8'))
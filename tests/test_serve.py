@@ -0,0 +1,42 @@
+import _setup
+import asyncio
+import numpy as np
+import pytest
+import neograd as ng
+from neograd import nn
+from neograd.serve import Batcher, benchmark
+
+
+class NN(nn.Model):
+  def __init__(self):
+    self.stack = nn.Sequential(nn.Linear(5,4), nn.ReLU(), nn.Linear(4,3), nn.Dropout(0.5))
+  
+  def forward(self, inputs):
+    return self.stack(inputs)
+
+
+def test_batcher():
+  model, examples = NN(), np.random.randn(64,5)
+  with model.eval():
+    outputs = model(examples).data
+  with Batcher(model, max_batch=16, max_wait_ms=20) as batcher:
+    futures = [batcher.submit(example) for example in examples]
+    assert all(np.allclose(future.result(), example_outputs) for future, example_outputs in zip(futures, outputs))
+    async def predict_all():
+      return await asyncio.gather(*(batcher.predict_async(ng.tensor(example)) for example in examples[:8]))
+    assert np.allclose(np.stack(asyncio.run(predict_all())), outputs[:8])
+    results = benchmark(batcher, examples, num_clients=4)
+    assert results['throughput']>0 and results['p99_latency_ms']>=results['p50_latency_ms']
+    with pytest.raises(ValueError):
+      batcher(np.random.randn(4))
+    futures = [batcher.submit(example) for example in examples[:4]]
+    bad_future = batcher.submit(np.random.randn(4)) # batched along with the valid requests
+    futures+=[batcher.submit(example) for example in examples[4:8]]
+    assert all(np.allclose(future.result(), example_outputs) for future, example_outputs in zip(futures, outputs))
+    with pytest.raises(ValueError):
+      bad_future.result()
+  assert ng.autograd.utils.get_graph().track
+  with pytest.raises(RuntimeError):
+    batcher.submit(examples[0])
+  with pytest.raises(ValueError):
+    Batcher(model, max_batch=0)